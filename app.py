@@ -1,18 +1,30 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from main import run_pipeline
+from main import run_pipeline_async
 import config
 import os
 import uvicorn
-import pickle
-import faiss
-import pandas as pd
 import time
 import traceback
-from src.database.neo4j_client import get_graph_connection, fetch_variable_and_value_nodes
+from src.database.neo4j_client import get_graph_connection, get_async_graph_connection, fetch_variable_and_value_nodes
+from src.database.graph_snapshot import GraphSnapshotManager
 from src.embeddings.vector_index import get_embedding_model, create_faiss_index
+from src.embeddings.entry_index import EntryEmbeddingIndex
+from src.embeddings.artifacts import artifact_paths, load_index, load_entry_ids, load_embeddings, load_manifest
 from src.retrieval.node_retrieval import build_entries
+from src.retrieval.entry_store import EntryStore
+from src.retrieval.query_cache import SemanticQueryCache
+from src.data.dataset_cache import load_dataset, file_content_hash
+from src.data.bitmap_index import load_or_build_bitmap_index
 from src.generation.gemini_client import initialize_gemini
+from src.execution.sandbox import SandboxPool
+from src.execution.step_cache import get_step_cache
+from src.jobs.job_queue import JobQueue, QueueFullError
+from src.jobs.job_store import get_job_store
 
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
@@ -24,6 +36,9 @@ initialized = False
 init_error = None
 init_stage = "Not started"
 init_start_time = None
+startup_profile = []
+analysis_slots = None
+job_queue = None
 
 class Query(BaseModel):
     query: str
@@ -34,49 +49,142 @@ class StatusResponse(BaseModel):
     error: str = None
     elapsed_time: float = None
     progress: list = None
+    embedding_cache: dict = None
+    llm_cache: dict = None
+    query_cache: dict = None
+    step_cache: dict = None
+    job_queue: dict = None
+    startup_profile: list = None
+
+def _rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak RSS, KB on Linux
+
+def _kg_version(paths, graph_snapshot):
+    """Version of the KG answers depend on: the loaded artifact set plus the live graph snapshot"""
+    manifest = load_manifest(paths["version"]) or {}
+    # Legacy (unversioned) caches are identified by the content of their entries file
+    artifacts = manifest.get("kg_content_hash") or paths["version"] or file_content_hash(paths["entries"])
+    snapshot = graph_snapshot.current if graph_snapshot is not None else None
+    return f"{artifacts}:{snapshot.version}" if snapshot is not None else artifacts
+
+def _complete_stage(progress_steps, stage, stage_start, detail=""):
+    """Record a finished init stage with its wall time and the process RSS"""
+    elapsed = time.time() - stage_start
+    rss = _rss_mb()
+    startup_profile.append({"stage": stage, "seconds": round(elapsed, 4), "rss_mb": round(rss, 1)})
+    message = f"✅ {stage}{detail} - Complete ({elapsed:.2f}s, RSS {rss:.0f} MB)"
+    print(message)
+    progress_steps.append(message)
 
 def init_all():
     global resources, initialized, init_error, init_stage, init_start_time
 
     init_start_time = time.time()
     progress_steps = []
+    startup_profile.clear()
 
     try:
         init_stage = "Connecting to Neo4j graph database"
         print(f"⚙️ {init_stage}...")
+        stage_start = time.time()
         graph = get_graph_connection()
-        progress_steps.append(f"✅ {init_stage} - Complete")
+        async_graph = get_async_graph_connection()
+        _complete_stage(progress_steps, init_stage, stage_start)
+
+        init_stage = "Loading in-process graph snapshot"
+        print(f"⚙️ {init_stage}...")
+        stage_start = time.time()
+        graph_snapshot = None
+        if config.GRAPH_SNAPSHOT_ENABLED:
+            try:
+                graph_snapshot = GraphSnapshotManager(graph)
+                graph_snapshot.load()
+                graph_snapshot.start()
+            except Exception as e:
+                # The pipeline falls back to querying Neo4j directly
+                print(f"⚠️ Graph snapshot unavailable, using Neo4j queries: {e}")
+                graph_snapshot = None
+        _complete_stage(progress_steps, init_stage, stage_start)
 
         init_stage = "Loading embedding model"
         print(f"⚙️ {init_stage}...")
+        stage_start = time.time()
         embed_model = get_embedding_model()
-        progress_steps.append(f"✅ {init_stage} - Complete")
+        _complete_stage(progress_steps, init_stage, stage_start)
 
         init_stage = "Initializing Gemini LLM"
         print(f"⚙️ {init_stage}...")
+        stage_start = time.time()
         llm_model = initialize_gemini()
-        progress_steps.append(f"✅ {init_stage} - Complete")
+        _complete_stage(progress_steps, init_stage, stage_start)
 
         init_stage = "Loading Excel data"
         print(f"⚙️ {init_stage}...")
-        df = pd.read_csv(config.CSV_PATH)
+        stage_start = time.time()
+        df, dataset_version = load_dataset()
         actual_columns = list(df.columns)
         column_context = "\n".join(f"- {col}" for col in actual_columns)
-        progress_steps.append(f"✅ {init_stage} - Complete")
+        _complete_stage(progress_steps, init_stage, stage_start,
+                        f" ({len(df)} rows, {df.memory_usage(index=False, deep=True).sum() / 1e6:.1f} MB)")
+
+        bitmap_index = None
+        if config.BITMAP_INDEX_ENABLED:
+            init_stage = "Loading bitmap index of coded columns"
+            print(f"⚙️ {init_stage}...")
+            stage_start = time.time()
+            bitmap_index = load_or_build_bitmap_index(df, dataset_version)
+            _complete_stage(progress_steps, init_stage, stage_start,
+                            f" ({len(bitmap_index.columns)} columns, {bitmap_index.nbytes() / 1e6:.1f} MB)")
+
+        sandbox_pool = None
+        if config.SANDBOX_ENABLED:
+            init_stage = "Starting plan execution sandbox workers"
+            print(f"⚙️ {init_stage}...")
+            stage_start = time.time()
+            sandbox_pool = SandboxPool(df, bitmap_index=bitmap_index).start()
+            _complete_stage(progress_steps, init_stage, stage_start, f" ({sandbox_pool.size} workers)")
 
         init_stage = "Loading cached knowledge graph entries"
         print(f"⚙️ {init_stage}...")
-        CACHE_DIR = "cache"
-        ENTRIES_CACHE = os.path.join(CACHE_DIR, "kg_entries.pkl")
-        with open(ENTRIES_CACHE, 'rb') as f:
-            all_entries = pickle.load(f)
-        progress_steps.append(f"✅ {init_stage} - Complete")
+        stage_start = time.time()
+        paths = artifact_paths()
+        all_entries = EntryStore.load(paths["entries"])
+        _complete_stage(progress_steps, init_stage, stage_start,
+                        f" ({paths['version'] or 'legacy cache'}, {len(all_entries)} entries, "
+                        f"{all_entries.nbytes() / 1e6:.1f} MB)")
 
         init_stage = "Loading FAISS vector index"
         print(f"⚙️ {init_stage}...")
-        FAISS_INDEX_CACHE = os.path.join(CACHE_DIR, "faiss_index.faiss")
-        faiss_index = faiss.read_index(FAISS_INDEX_CACHE)
-        progress_steps.append(f"✅ {init_stage} - Complete")
+        stage_start = time.time()
+        id_mapped = (load_manifest(paths["version"]) or {}).get("id_mapped", False)
+        faiss_index = load_index(paths["index"], entry_ids=load_entry_ids(paths["entry_ids"]) if id_mapped else None)
+        _complete_stage(progress_steps, init_stage, stage_start)
+
+        init_stage = "Loading entry embedding matrix"
+        print(f"⚙️ {init_stage}...")
+        stage_start = time.time()
+        entry_index = EntryEmbeddingIndex(all_entries, load_embeddings(paths["embeddings"]))
+        _complete_stage(progress_steps, init_stage, stage_start)
+
+        init_stage = "Opening semantic query cache"
+        print(f"⚙️ {init_stage}...")
+        stage_start = time.time()
+        query_cache = None
+        if config.QUERY_CACHE_ENABLED:
+            # Cached answers are only valid for the dataset and KG they were computed from
+            query_cache = SemanticQueryCache(embed_model,
+                                             dataset_version=dataset_version,
+                                             kg_version=_kg_version(paths, graph_snapshot))
+            if graph_snapshot is not None:
+                graph_snapshot.add_listener(lambda snapshot: query_cache.set_versions(
+                    query_cache.dataset_version, _kg_version(paths, graph_snapshot)))
+        _complete_stage(progress_steps, init_stage, stage_start)
 
         resources = {
             "graph": graph,
@@ -86,12 +194,19 @@ def init_all():
             "all_entries": all_entries,
             "faiss_index": faiss_index,
             "column_context": column_context,
+            "entry_index": entry_index,
+            "graph_snapshot": graph_snapshot,
+            "async_graph": async_graph,
+            "query_cache": query_cache,
+            "sandbox_pool": sandbox_pool,
+            "dataset_version": dataset_version,
+            "bitmap_index": bitmap_index,
             "progress_steps": progress_steps
         }
 
         init_stage = "Initialization complete"
         initialized = True
-        print(f"✅ {init_stage} in {time.time() - init_start_time:.2f} seconds")
+        print(f"✅ {init_stage} in {time.time() - init_start_time:.2f} seconds (RSS {_rss_mb():.0f} MB)")
 
     except Exception as e:
         error_msg = f"❌ ERROR during {init_stage}: {str(e)}"
@@ -102,11 +217,27 @@ def init_all():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global analysis_slots, job_queue
+    # Blocking pipeline work (plan execution, sync fallbacks) runs on this pool
+    executor = ThreadPoolExecutor(max_workers=config.PIPELINE_THREAD_WORKERS)
+    asyncio.get_running_loop().set_default_executor(executor)
+    analysis_slots = asyncio.Semaphore(config.MAX_CONCURRENT_ANALYSES)
+    job_queue = await JobQueue(_run_job, get_job_store()).start()
+
     # Start background initialization without blocking server startup
     init_thread = Thread(target=init_all)
     init_thread.start()
     yield
     # Cleanup operations can go here (if needed)
+    await job_queue.stop()
+    job_queue.store.close()
+    if resources.get("graph_snapshot"):
+        resources["graph_snapshot"].stop()
+    if resources.get("sandbox_pool"):
+        resources["sandbox_pool"].close()
+    if resources.get("async_graph"):
+        await resources["async_graph"].close()
+    executor.shutdown(wait=False)
     print("Shutting down...")
 
 app = FastAPI(lifespan=lifespan)
@@ -122,45 +253,145 @@ def get_status():
 
     progress_steps = resources.get("progress_steps", [])
 
+    embed_cache = getattr(resources.get("embed_model"), "cache", None)
+    llm_cache = getattr(resources.get("llm_model"), "cache", None)
+    query_cache = resources.get("query_cache")
+
     return StatusResponse(
         initialized=initialized,
         stage=init_stage,
         error=init_error,
         elapsed_time=elapsed,
-        progress=progress_steps
+        progress=progress_steps,
+        embedding_cache=embed_cache.stats() if embed_cache else None,
+        llm_cache=llm_cache.stats() if llm_cache else None,
+        query_cache=query_cache.stats() if query_cache else None,
+        step_cache=get_step_cache().stats() if config.STEP_CACHE_ENABLED else None,
+        job_queue=job_queue.metrics() if job_queue else None,
+        startup_profile=startup_profile
     )
 
+def _not_ready_response():
+    elapsed = "unknown"
+    if init_start_time:
+        elapsed = f"{time.time() - init_start_time:.2f} seconds"
+
+    if init_error:
+        return {
+            "status": "initialization_failed",
+            "error": init_error,
+            "elapsed": elapsed
+        }
+    else:
+        return {
+            "status": "initializing",
+            "current_stage": init_stage,
+            "elapsed": elapsed,
+            "progress": resources.get("progress_steps", [])
+        }
+
+def _pipeline_resources():
+    return {k: v for k, v in resources.items() if k != "progress_steps"}
+
 @app.post("/analyze")
-def analyze(q: Query):
+async def analyze(q: Query):
     if not initialized:
-        elapsed = "unknown"
-        if init_start_time:
-            elapsed = f"{time.time() - init_start_time:.2f} seconds"
-
-        if init_error:
-            return {
-                "status": "initialization_failed",
-                "error": init_error,
-                "elapsed": elapsed
-            }
-        else:
-            return {
-                "status": "initializing",
-                "current_stage": init_stage,
-                "elapsed": elapsed,
-                "progress": resources.get("progress_steps", [])
-            }
+        return _not_ready_response()
 
     try:
-        return run_pipeline(
-            q.query,
-            **{k: v for k, v in resources.items() if k != "progress_steps"}
-        )
+        async with analysis_slots:
+            return await run_pipeline_async(q.query, **_pipeline_resources())
     except Exception as e:
         error_msg = str(e)
         print("❌ ERROR during query processing:", error_msg)
         traceback.print_exc()
         return {"error": error_msg}
 
+async def _run_job(query):
+    # Queued jobs share the analysis slots with /analyze, so total concurrency stays bounded
+    async with analysis_slots:
+        return await run_pipeline_async(query, **_pipeline_resources())
+
+@app.post("/jobs", status_code=202)
+async def submit_job(q: Query):
+    """Queue an analysis and return its job id immediately"""
+    if not initialized:
+        return JSONResponse(_not_ready_response(), status_code=503)
+    try:
+        job_id = await job_queue.submit(q.query)
+    except QueueFullError as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(config.JOB_RETRY_AFTER_SECONDS)})
+    return {"job_id": job_id, "status": "queued", "position": job_queue.position(job_id)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job '{job_id}'"}, status_code=404)
+    job.pop("result")
+    if job["status"] == "queued":
+        job["position"] = job_queue.position(job_id)
+    if job["started_at"]:
+        job["wait_seconds"] = round(job["started_at"] - job["submitted_at"], 3)
+    return job
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job '{job_id}'"}, status_code=404)
+    if job["status"] == "failed":
+        return JSONResponse({"status": "failed", "error": job["error"]}, status_code=500)
+    if job["status"] != "completed":
+        return JSONResponse({"status": job["status"]}, status_code=202)
+    return job["result"]
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_stream(q: Query):
+    """Server-sent events: one event per finished pipeline stage, synthesis tokens, then the result"""
+    if not initialized:
+        return _not_ready_response()
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    started = time.time()
+
+    def on_event(event, data=None):
+        # Called from the event loop and from the plan-execution worker thread
+        payload = dict(data) if isinstance(data, dict) else ({} if data is None else {"value": data})
+        payload["elapsed"] = round(time.time() - started, 3)
+        loop.call_soon_threadsafe(events.put_nowait, (event, payload))
+
+    async def run():
+        try:
+            async with analysis_slots:
+                on_event("started")
+                result = await run_pipeline_async(q.query, on_event=on_event, **_pipeline_resources())
+            on_event("result", {"result": result})
+        except Exception as e:
+            print("❌ ERROR during query processing:", str(e))
+            traceback.print_exc()
+            on_event("error", {"error": str(e)})
+        finally:
+            on_event("done")
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, payload = await events.get()
+                yield _sse(event, payload)
+                if event == "done":
+                    break
+        finally:
+            if not task.done():
+                task.cancel()  # client went away
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,118 @@
+"""Build or benchmark the knowledge graph FAISS index.
+
+Usage:
+    python build_index.py build [--index-type hnsw] [--from-neo4j]
+    python build_index.py sync [--index-type hnsw]
+    python build_index.py migrate [--index-type hnsw]
+    python build_index.py benchmark [--index-types flat_ip hnsw ivf_flat] [--synthetic-size 1000000]
+"""
+import argparse
+import os
+import pickle
+import sys
+
+import faiss
+import numpy as np
+
+sys.path.append('.')
+
+import config
+from src.embeddings.vector_index import build_faiss_index
+from src.embeddings.index_benchmark import benchmark_index_types, sample_queries, synthesize_embeddings, format_report
+
+ENTRIES_CACHE = os.path.join(config.CACHE_DIR, "kg_entries.pkl")
+EMBEDDINGS_CACHE = os.path.join(config.CACHE_DIR, "embeddings.npy")
+
+
+def build(args):
+    from src.embeddings.artifacts import current_version
+
+    # Once a versioned artifact set is current, the app ignores the legacy index path
+    if current_version() is not None:
+        if args.from_neo4j:
+            sys.exit("❌ A versioned KG artifact set is active - use `python build_index.py sync` to refresh it from Neo4j")
+        from src.embeddings.kg_sync import rebuild_index
+        rebuild_index(index_type=args.index_type)
+        return
+
+    if args.from_neo4j:
+        from src.database.neo4j_client import get_graph_connection, fetch_variable_and_value_nodes
+        from src.embeddings.vector_index import get_embedding_model, create_faiss_index
+        from src.retrieval.node_retrieval import build_entries
+
+        print("⚙️ Fetching variables and values from Neo4j...")
+        driver = get_graph_connection()
+        entries = build_entries(fetch_variable_and_value_nodes(driver))
+        driver.close()
+
+        print(f"⚙️ Embedding {len(entries)} entries...")
+        index, embeddings = create_faiss_index(entries, get_embedding_model(), args.index_type)
+        with open(ENTRIES_CACHE, "wb") as f:
+            pickle.dump(entries, f)
+        np.save(EMBEDDINGS_CACHE, embeddings)
+    else:
+        print(f"⚙️ Building '{args.index_type}' index from {EMBEDDINGS_CACHE}...")
+        index = build_faiss_index(np.load(EMBEDDINGS_CACHE), args.index_type)
+
+    faiss.write_index(index, args.output)
+    print(f"✅ Wrote {args.index_type} index with {index.ntotal} vectors to {args.output}")
+
+def sync(args):
+    from src.database.neo4j_client import get_graph_connection
+    from src.embeddings.vector_index import get_embedding_model
+    from src.embeddings.kg_sync import sync_kg
+
+    driver = get_graph_connection()
+    try:
+        sync_kg(driver, get_embedding_model(), index_type=args.index_type)
+    finally:
+        driver.close()
+
+def migrate(args):
+    from src.embeddings.kg_sync import migrate_legacy_cache
+
+    migrate_legacy_cache(index_type=args.index_type)
+
+def benchmark(args):
+    embeddings = np.load(EMBEDDINGS_CACHE)
+    if args.synthetic_size:
+        embeddings = synthesize_embeddings(embeddings, args.synthetic_size)
+
+    queries = sample_queries(embeddings, args.queries)
+    print(f"⚙️ Benchmarking {', '.join(args.index_types)} on {len(embeddings)} vectors, "
+          f"{len(queries)} queries, top_k={args.top_k}...\n")
+    print(format_report(benchmark_index_types(embeddings, queries, args.index_types, args.top_k)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = sub.add_parser("build", help="Build the configured index and write it to the cache "
+                                                "(as a new version of the current artifact set when one exists)")
+    build_parser.add_argument("--index-type", default=config.FAISS_INDEX_TYPE)
+    build_parser.add_argument("--output", default=config.FAISS_INDEX_PATH, help="Legacy cache only")
+    build_parser.add_argument("--from-neo4j", action="store_true",
+                              help="Re-fetch and re-embed all entries instead of reusing embeddings.npy")
+    build_parser.set_defaults(func=build)
+
+    sync_parser = sub.add_parser("sync", help="Incrementally sync a new versioned artifact set from Neo4j")
+    sync_parser.add_argument("--index-type", default=config.FAISS_INDEX_TYPE)
+    sync_parser.set_defaults(func=sync)
+
+    migrate_parser = sub.add_parser("migrate", help="Convert the legacy pickle cache into a versioned columnar artifact set")
+    migrate_parser.add_argument("--index-type", default=config.FAISS_INDEX_TYPE)
+    migrate_parser.set_defaults(func=migrate)
+
+    bench_parser = sub.add_parser("benchmark", help="Report recall@TOP_K and p50/p99 latency per index type")
+    bench_parser.add_argument("--index-types", nargs="+", default=["flat_ip", "hnsw", "ivf_flat"])
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--top-k", type=int, default=config.TOP_K)
+    bench_parser.add_argument("--synthetic-size", type=int, default=0,
+                              help="Grow the KG embeddings to this many rows to project behaviour at scale")
+    bench_parser.set_defaults(func=benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
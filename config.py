@@ -15,3 +15,122 @@ EXCEL_PATH = "data/data.xlsx"
 
 # Path to your Excel file
 CSV_PATH = "data/data.csv"
+
+# Embedding backend: "hf_api" (HuggingFace Inference API) or "local" (in-process sentence-transformers on CPU)
+EMBED_BACKEND = "hf_api"
+
+# Texts sent per embedding provider call
+EMBED_BATCH_SIZE = 20
+
+# Device used by the local embedding backend
+EMBED_LOCAL_DEVICE = "cpu"
+
+# Persistent embedding cache (in-memory LRU in front of sqlite)
+EMBED_CACHE_ENABLED = True
+EMBED_CACHE_PATH = "cache/embedding_cache.sqlite"
+EMBED_CACHE_MEMORY_ITEMS = 10000
+EMBED_CACHE_MAX_DISK_ITEMS = 1000000
+
+# Cached knowledge graph artifacts
+CACHE_DIR = "cache"
+FAISS_INDEX_PATH = "cache/faiss_index.faiss"
+
+# FAISS index type: "flat_l2" (legacy), "flat_ip", "hnsw" or "ivf_flat" (all but flat_l2 use cosine similarity)
+FAISS_INDEX_TYPE = "flat_ip"
+
+# HNSW graph parameters
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# IVF parameters (nlist is clipped to the number of vectors / 39)
+IVF_NLIST = 4096
+IVF_NPROBE = 16
+
+# Versioned KG artifact sets written by `python build_index.py sync`
+KG_VERSIONS_DIR = "cache/kg"
+KG_KEEP_VERSIONS = 3
+
+# Memory-map cached KG artifacts (index, embeddings, entry columns) so workers share pages
+MMAP_ARTIFACTS = True
+
+# Seconds to cache variable -> value labels looked up from Neo4j (0 disables), and the LRU size cap
+VALUES_CACHE_TTL_SECONDS = 3600
+VALUES_CACHE_MAX_ITEMS = 5000
+
+# In-process snapshot of the Variable/Value/Category graph, re-checked for changes every N seconds
+GRAPH_SNAPSHOT_ENABLED = True
+GRAPH_SNAPSHOT_REFRESH_SECONDS = 300
+
+# /analyze concurrency: pipelines running at once, and threads for blocking work (plan execution, sync clients)
+MAX_CONCURRENT_ANALYSES = 8
+PIPELINE_THREAD_WORKERS = 16
+
+# Variables expanded concurrently in the graph expansion stage
+EXPANSION_MAX_WORKERS = 8
+
+# Expansion relevance filter: prompt-token budget per chunk, item cap per chunk, chunks in flight
+EXPANSION_FILTER_TOKEN_BUDGET = 1500
+EXPANSION_FILTER_MAX_ITEMS = 40
+EXPANSION_FILTER_MAX_CONCURRENCY = 8
+
+# Process-wide Gemini rate limit applied to every model call that misses the response cache (token bucket; 0 disables)
+GEMINI_REQUESTS_PER_SECOND = 10
+GEMINI_BURST = 10
+
+# Persistent Gemini response cache for deterministic prompt stages (in-memory LRU in front of sqlite).
+# Only stages listed here with a TTL (seconds) > 0 are cached; remove a stage to opt it out.
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = "cache/llm_cache.sqlite"
+LLM_CACHE_MEMORY_ITEMS = 2000
+LLM_CACHE_MAX_DISK_ITEMS = 200000
+LLM_CACHE_TTLS = {
+    "rename_dict": 7 * 24 * 3600,
+    "plan": 24 * 3600,
+    "expansion_filter": 24 * 3600,
+    "response_json": 24 * 3600,
+}
+
+# Semantic whole-query result cache: cosine similarity needed to reuse a past answer
+QUERY_CACHE_ENABLED = True
+QUERY_CACHE_PATH = "cache/query_cache.sqlite"
+QUERY_CACHE_SIMILARITY_THRESHOLD = 0.95
+QUERY_CACHE_MAX_ITEMS = 5000
+
+# Plan execution fast mode (opt-in): fused thought+code call, reflections only after recovery, no final check
+PLAN_EXECUTION_FAST_MODE = False
+
+# Prompt section budgets in estimated tokens (~4 characters each)
+CONTEXT_TOKEN_BUDGET = 6000
+COLUMN_CONTEXT_TOKEN_BUDGET = 3000
+REACT_LOG_TOKEN_BUDGET = 8000
+
+# Async analysis jobs (/jobs): queue bound (429 beyond it), worker pool size, job store backend ("sqlite" or "memory")
+JOB_QUEUE_MAX_SIZE = 100
+JOB_WORKERS = 4
+JOB_STORE_BACKEND = "sqlite"
+JOB_STORE_PATH = "cache/jobs.sqlite"
+JOB_RETRY_AFTER_SECONDS = 30
+
+# Run generated plan code in pre-warmed worker processes that map the dataset from shared memory
+SANDBOX_ENABLED = False
+SANDBOX_WORKERS = 4
+SANDBOX_START_METHOD = "forkserver"
+SANDBOX_STEP_TIMEOUT_SECONDS = 60
+SANDBOX_MEMORY_LIMIT_MB = 4096
+SANDBOX_MAX_RESULT_BYTES = 65536
+SANDBOX_START_TIMEOUT_SECONDS = 60
+
+# Columnar cache of the analysis CSV ("parquet" needs pyarrow, otherwise memory-mapped .npy columns), rebuilt when the CSV hash changes
+DATA_CACHE_ENABLED = True
+DATA_CACHE_DIR = "cache/data"
+DATA_CACHE_FORMAT = "parquet"
+DATA_CATEGORICAL_MAX_CATEGORIES = 256
+
+# Memoize plan step outputs across requests (keyed by normalized code, input lineage and dataset version)
+STEP_CACHE_ENABLED = True
+STEP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Packed row bitmaps per (column, code) for coded columns with at most this many distinct codes
+BITMAP_INDEX_ENABLED = True
+BITMAP_INDEX_MAX_CODES = 64
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import pandas as pd
 import sys
@@ -11,25 +12,22 @@ sys.path.append('.')
 import config
 
 # Import necessary modules
-from src.retrieval.node_retrieval import retrieve_nodes, merge_results
-from src.retrieval.graph_expansion import expand_graph_from_variable_filtered
-from src.generation.gemini_client import summarize_expansions_with_llm
-from src.generation.answer_generation import format_context, reflection_loop, generate_answer, create_response_json
-from src.execution.plan_generation import generate_plan
+from src.retrieval.node_retrieval import retrieve_nodes, retrieve_nodes_async, merge_results
+from src.retrieval.graph_expansion import expand_variables, expand_variables_async
+from src.generation.gemini_client import (summarize_expansions_with_llm, summarize_expansions_with_llm_async,
+                                          generate_text, generate_text_async)
+from src.generation.answer_generation import (format_context, reflection_loop, generate_answer, create_response_json,
+                                              format_context_async, reflection_loop_async, generate_answer_async,
+                                              create_response_json_async)
+from src.execution.plan_generation import generate_plan, generate_plan_async
 from src.execution.plan_execution import execute_plan
-from src.database.neo4j_client import get_all_values_for_variables, extract_variable_array_from_text
+from src.generation.context_budget import budget_column_context
+from src.database.neo4j_client import (get_all_values_for_variables, get_all_values_for_variables_async,
+                                       extract_variable_array_from_text)
 
 
-def run_pipeline(
-    user_input: str,
-    graph,
-    embed_model,
-    llm_model,
-    df,
-    all_entries,
-    faiss_index,
-    column_context
-):
+def _parse_user_input(user_input):
+    """Return (user_query, mode, picot) from the raw request body"""
     try:
         parsed = json.loads(user_input)
         user_query = parsed.get("fullQuestion") or "No question provided"
@@ -39,9 +37,21 @@ def run_pipeline(
         user_query = user_input
         mode = "default"
         picot = {}
+    return user_query, mode, picot
 
-    # 2) Initial retrieval
-    results = retrieve_nodes(user_query, all_entries, faiss_index, embed_model, top_k=config.TOP_K)
+def _emit(on_event, event, data=None):
+    """Report a finished pipeline stage to a streaming client, if one is listening"""
+    if on_event is not None:
+        on_event(event, data)
+
+def _result_summaries(results):
+    return [{"type": entry['type'],
+             "variable": entry['parent_var'] if entry['type'] == 'value' else entry['var_name'],
+             "label": entry['label'] if entry['type'] == 'value' else None,
+             "score": float(dist)}
+            for entry, dist in results]
+
+def _print_initial_results(results):
     print("\n🔍 Initial Concepts (from FAISS vector search):")
     for (entry, dist) in results:
         if entry['type'] == 'value':
@@ -49,19 +59,7 @@ def run_pipeline(
         else:
             print(f"  ✔ Variable '{entry['var_name']}' (score={dist:.2f})")
 
-    # 3) Reflection Loop
-    reflected_results = reflection_loop(llm_model, user_query, results, all_entries, faiss_index, embed_model, graph, column_context, steps=2)
-
-    # 4) Graph expansion
-    expansions = []
-    for (entry, dist) in reflected_results:
-        if entry['type'] == 'variable':
-            expansions_for_var = expand_graph_from_variable_filtered(graph, entry['var_name'], user_query, embed_model)
-            expansions = merge_results(expansions, expansions_for_var)
-    expansions = summarize_expansions_with_llm(llm_model, user_query, expansions)
-    full_results = merge_results(reflected_results, expansions)
-
-    # 5) Final graph-based context
+def _print_full_results(full_results):
     print("\n⟲ Final Expanded Results (Reflections + Expansions):")
     for (entry, _) in full_results:
         if entry['type'] == 'value':
@@ -69,24 +67,8 @@ def run_pipeline(
         else:
             print(f"  ✔ Variable '{entry['var_name']}'")
 
-    final_context = format_context(full_results, graph)
-
-    # 6) Gemini LLM generates reasoning over KG
-    final_answer = generate_answer(llm_model, user_query, final_context, column_context, mode=mode, picot=picot)
-    print("\n📝 Final Answer (Knowledge Graph Synthesis):\n")
-    print(final_answer)
-
-
-    # 🧵 Step 6.5 - Extract variables from LLM answer
-    variable_names = extract_variable_array_from_text(final_answer)
-    print("\n🔢 Extracted Variable Names:", variable_names)
-
-    # 🧠 Step 6.6 - Get all value labels for those variables from Neo4j
-    value_dict = get_all_values_for_variables(graph, variable_names)
-
-
-    def rename_dict_with_llm(value_dict):
-        prompt = f"""
+def _rename_dict_prompt(column_context, value_dict):
+    return f"""
     You are an assistant that corrects variable names in a Python dictionary to match column names in a DataFrame.
 
     Here is the list of column names (case and spelling must match exactly):
@@ -103,36 +85,116 @@ def run_pipeline(
     - Preserve the dictionary structure.
     - Return only the corrected dictionary as valid JSON. No explanation.
     """
-        response = llm_model.generate_content(prompt).text.strip()
-
-        try:
-            return json.loads(response)
-        except Exception as e:
-            print("⚠️ Failed to parse LLM output:", e)
-            return {}
 
-    # 🧩 Step 6.9 - Change value dictionary to correct names
-    renamed_value_dict = rename_dict_with_llm(value_dict)
+def _parse_renamed_dict(response):
+    try:
+        return json.loads(response)
+    except Exception as e:
+        print("⚠️ Failed to parse LLM output:", e)
+        return {}
 
+def _print_value_dict(renamed_value_dict):
     print("\n📊 Matched Values from Neo4j by Variable:")
     for var, values in renamed_value_dict.items():
         print(f"✔ {var}:")
         for v in values:
             print(f"   - {v}")
 
+def _print_plan(plan):
+    print("📋 Plan Steps:")
+    for step in plan:
+        print(f"  - {step['name']}: {step['description']}")
+        print(f"    Instruction: {step['instruction']}")
+
+
+def run_pipeline(
+    user_input: str,
+    graph,
+    embed_model,
+    llm_model,
+    df,
+    all_entries,
+    faiss_index,
+    column_context,
+    entry_index=None,
+    graph_snapshot=None,
+    async_graph=None,
+    query_cache=None,
+    on_event=None,
+    sandbox_pool=None,
+    dataset_version=None,
+    bitmap_index=None
+):
+    user_query, mode, picot = _parse_user_input(user_input)
+
+    # Semantically equivalent questions are answered from the query cache
+    cache_key = None
+    if query_cache is not None:
+        cached, cache_key = query_cache.probe(user_query, mode, picot)
+        if cached is not None:
+            return cached
+
+    # Pin one graph snapshot for the whole request (None falls back to Neo4j queries)
+    snapshot = graph_snapshot.current if graph_snapshot else None
+
+    # Columns most relevant to the question, trimmed to COLUMN_CONTEXT_TOKEN_BUDGET
+    query_columns = budget_column_context(column_context, user_query, prompt_name="answer")
+
+    # 2) Initial retrieval
+    results = retrieve_nodes(user_query, all_entries, faiss_index, embed_model, top_k=config.TOP_K)
+    _print_initial_results(results)
+    _emit(on_event, "retrieval", {"results": _result_summaries(results)})
+
+    # 3) Reflection Loop
+    reflected_results = reflection_loop(llm_model, user_query, results, all_entries, faiss_index, embed_model, graph, query_columns, steps=2, snapshot=snapshot)
+    _emit(on_event, "reflection", {"results": _result_summaries(reflected_results)})
+
+    # 4) Graph expansion - variables expanded concurrently, merged in result order
+    variables = [entry['var_name'] for (entry, dist) in reflected_results if entry['type'] == 'variable']
+    expansions = expand_variables(graph, variables, user_query, embed_model, entry_index=entry_index, snapshot=snapshot)
+    expansions = summarize_expansions_with_llm(llm_model, user_query, expansions)
+    full_results = merge_results(reflected_results, expansions)
+    _emit(on_event, "expansion", {"expansions": _result_summaries(expansions)})
+
+    # 5) Final graph-based context
+    _print_full_results(full_results)
+
+    final_context = format_context(full_results, graph, snapshot=snapshot, user_query=user_query, prompt_name="answer")
+
+    # 6) Gemini LLM generates reasoning over KG
+    final_answer = generate_answer(llm_model, user_query, final_context, query_columns, mode=mode, picot=picot)
+    print("\n📝 Final Answer (Knowledge Graph Synthesis):\n")
+    print(final_answer)
+    _emit(on_event, "answer", {"text": final_answer})
+
+
+    # 🧵 Step 6.5 - Extract variables from LLM answer
+    variable_names = extract_variable_array_from_text(final_answer)
+    print("\n🔢 Extracted Variable Names:", variable_names)
+
+    # 🧠 Step 6.6 - Get all value labels for those variables from Neo4j
+    value_dict = get_all_values_for_variables(graph, variable_names, snapshot=snapshot)
+
+    # Columns for renaming and planning are ranked against the answer and its variables too
+    plan_columns = budget_column_context(column_context, user_query, final_answer, *variable_names, prompt_name="plan")
+
+    # 🧩 Step 6.9 - Change value dictionary to correct names
+    response = generate_text(llm_model, _rename_dict_prompt(plan_columns, value_dict), cache_stage="rename_dict").strip()
+    renamed_value_dict = _parse_renamed_dict(response)
+    _print_value_dict(renamed_value_dict)
+    _emit(on_event, "values", {"variables": variable_names, "values": renamed_value_dict})
+
     # 7) Ask Gemini to turn explanation into a structured execution plan
     print("\n🧩 Creating Agentic Plan from Gemini...\n")
 
-    plan = generate_plan(llm_model, final_answer, column_context, user_query, renamed_value_dict)
+    plan = generate_plan(llm_model, final_answer, plan_columns, user_query, renamed_value_dict)
     print(plan)
     if not plan:
         print("❌ No plan generated. Skipping agentic execution.")
         return
 
-    print("📋 Plan Steps:")
-    for step in plan:
-        print(f"  - {step['name']}: {step['description']}")
-        print(f"    Instruction: {step['instruction']}")
+    _print_plan(plan)
+    _emit(on_event, "plan", {"steps": plan})
 
     # 8) ReAct-style supervised execution
     final_response, react_log = execute_plan(
@@ -141,7 +203,11 @@ def run_pipeline(
         user_query=user_query,
         llm_model=llm_model,
         max_retries=1,
-        verbose=True
+        verbose=True,
+        on_event=on_event,
+        sandbox=sandbox_pool,
+        dataset_version=dataset_version,
+        bitmap_index=bitmap_index
     )
 
     print("\n🤖 Final Synthesized Answer:\n")
@@ -150,4 +216,129 @@ def run_pipeline(
     response = create_response_json(llm_model, final_response, user_query)
 
     print(f"FINAL ANSWER: {response}")
-    return {"answer": response, "debug": final_response}
+    result = {"answer": response, "debug": final_response}
+    if query_cache is not None:
+        query_cache.store(cache_key, result, plan=plan)
+    return result
+
+
+async def run_pipeline_async(
+    user_input: str,
+    graph,
+    embed_model,
+    llm_model,
+    df,
+    all_entries,
+    faiss_index,
+    column_context,
+    entry_index=None,
+    graph_snapshot=None,
+    async_graph=None,
+    query_cache=None,
+    on_event=None,
+    sandbox_pool=None,
+    dataset_version=None,
+    bitmap_index=None
+):
+    """Asyncio variant of run_pipeline.
+
+    Gemini, Neo4j (through the async driver) and embedding calls are awaited, so one
+    event loop serves many requests. Independent work runs concurrently: per-variable
+    graph expansions and expansion-filter chunks. Plan execution runs generated pandas
+    code step by step, so it is handed to a worker thread.
+    """
+    if async_graph is None:
+        return await asyncio.to_thread(
+            run_pipeline, user_input, graph, embed_model, llm_model, df, all_entries, faiss_index,
+            column_context, entry_index=entry_index, graph_snapshot=graph_snapshot,
+            query_cache=query_cache, on_event=on_event, sandbox_pool=sandbox_pool, dataset_version=dataset_version,
+            bitmap_index=bitmap_index)
+
+    user_query, mode, picot = _parse_user_input(user_input)
+
+    cache_key = None
+    if query_cache is not None:
+        cached, cache_key = await query_cache.probe_async(user_query, mode, picot)
+        if cached is not None:
+            return cached
+
+    snapshot = graph_snapshot.current if graph_snapshot else None
+
+    query_columns = budget_column_context(column_context, user_query, prompt_name="answer")
+
+    # 2) Initial retrieval
+    results = await retrieve_nodes_async(user_query, all_entries, faiss_index, embed_model, top_k=config.TOP_K)
+    _print_initial_results(results)
+    _emit(on_event, "retrieval", {"results": _result_summaries(results)})
+
+    # 3) Reflection Loop
+    reflected_results = await reflection_loop_async(llm_model, user_query, results, all_entries, faiss_index,
+                                                     embed_model, async_graph, query_columns, steps=2, snapshot=snapshot)
+    _emit(on_event, "reflection", {"results": _result_summaries(reflected_results)})
+
+    # 4) Graph expansion - variables expanded concurrently, merged in result order
+    variables = [entry['var_name'] for (entry, dist) in reflected_results if entry['type'] == 'variable']
+    expansions = await expand_variables_async(async_graph, variables, user_query, embed_model,
+                                              entry_index=entry_index, snapshot=snapshot)
+    expansions = await summarize_expansions_with_llm_async(llm_model, user_query, expansions)
+    full_results = merge_results(reflected_results, expansions)
+    _emit(on_event, "expansion", {"expansions": _result_summaries(expansions)})
+
+    # 5) Final graph-based context
+    _print_full_results(full_results)
+    final_context = await format_context_async(full_results, async_graph, snapshot=snapshot, user_query=user_query,
+                                               prompt_name="answer")
+
+    # 6) Gemini LLM generates reasoning over KG
+    final_answer = await generate_answer_async(llm_model, user_query, final_context, query_columns, mode=mode, picot=picot)
+    print("\n📝 Final Answer (Knowledge Graph Synthesis):\n")
+    print(final_answer)
+    _emit(on_event, "answer", {"text": final_answer})
+
+    variable_names = extract_variable_array_from_text(final_answer)
+    print("\n🔢 Extracted Variable Names:", variable_names)
+
+    value_dict = await get_all_values_for_variables_async(async_graph, variable_names, snapshot=snapshot)
+    plan_columns = budget_column_context(column_context, user_query, final_answer, *variable_names, prompt_name="plan")
+    response = await generate_text_async(llm_model, _rename_dict_prompt(plan_columns, value_dict),
+                                         cache_stage="rename_dict")
+    renamed_value_dict = _parse_renamed_dict(response.strip())
+    _print_value_dict(renamed_value_dict)
+    _emit(on_event, "values", {"variables": variable_names, "values": renamed_value_dict})
+
+    # 7) Structured execution plan
+    print("\n🧩 Creating Agentic Plan from Gemini...\n")
+    plan = await generate_plan_async(llm_model, final_answer, plan_columns, user_query, renamed_value_dict)
+    print(plan)
+    if not plan:
+        print("❌ No plan generated. Skipping agentic execution.")
+        return
+
+    _print_plan(plan)
+    _emit(on_event, "plan", {"steps": plan})
+
+    # 8) ReAct-style supervised execution (on_event must be safe to call from the worker thread)
+    final_response, react_log = await asyncio.to_thread(
+        execute_plan,
+        initial_df=df,
+        plan_steps=plan,
+        user_query=user_query,
+        llm_model=llm_model,
+        max_retries=1,
+        verbose=True,
+        on_event=on_event,
+        sandbox=sandbox_pool,
+        dataset_version=dataset_version,
+        bitmap_index=bitmap_index
+    )
+
+    print("\n🤖 Final Synthesized Answer:\n")
+    print(final_response)
+
+    response = await create_response_json_async(llm_model, final_response, user_query)
+
+    print(f"FINAL ANSWER: {response}")
+    result = {"answer": response, "debug": final_response}
+    if query_cache is not None:
+        query_cache.store(cache_key, result, plan=plan)
+    return result
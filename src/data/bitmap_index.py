@@ -0,0 +1,213 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import config
+from src.data.dataset_cache import column_buffer
+
+BITMAPS_FILE = "bitmaps.npy"
+BITMAPS_SCHEMA_FILE = "bitmaps.json"
+
+
+def _normalize(value):
+    """Lookup form of a code: integer-valued floats and numpy scalars become plain Python values"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _as_list(wanted):
+    return list(wanted) if isinstance(wanted, (list, tuple, set)) else [wanted]
+
+def _same_buffer(buffer, base):
+    """True when buffer is exactly the base array's memory (not a reordered, strided or partial view of it)"""
+    if buffer is None or base is None:
+        return False
+    return (buffer.__array_interface__["data"][0] == base.__array_interface__["data"][0]
+            and buffer.strides == base.strides and buffer.shape == base.shape)
+
+def _popcount(bitmap):
+    return int(np.bitwise_count(bitmap).sum()) if hasattr(np, "bitwise_count") else int(np.unpackbits(bitmap).sum())
+
+def _indexable_codes(column, max_codes):
+    """Factorize a coded column into (codes, values), or None when it is not a low-cardinality coded column"""
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        if len(dtype.categories) > max_codes:
+            return None
+        return column.cat.codes.to_numpy(), [_normalize(v) for v in dtype.categories]
+    if not (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_float_dtype(dtype)):
+        return None
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    if len(uniques) > max_codes:
+        return None
+    values = [_normalize(v) for v in uniques]
+    if any(isinstance(v, float) for v in values):  # non-integer floats are measurements, not codes
+        return None
+    return codes, values
+
+
+class BitmapIndex:
+    """Packed row bitmaps per (column, code) for the low-cardinality coded columns of the dataset.
+
+    Equality/membership filters on indexed columns are answered with bitwise AND/OR over
+    rows / 8 bytes per bitmap, and value counts come from precomputed popcounts.
+    """
+
+    def __init__(self, bitmaps, columns, rows, directory=None):
+        self.bitmaps = bitmaps
+        self.columns = columns
+        self.rows = rows
+        self.directory = directory
+        self._lookup = {name: {_normalize(v): i for i, v in enumerate(spec["values"])} for name, spec in columns.items()}
+
+    @classmethod
+    def build(cls, df, max_codes=None):
+        max_codes = max_codes or config.BITMAP_INDEX_MAX_CODES
+        rows = len(df)
+        chunks, columns, first = [], {}, 0
+        for name in df.columns:
+            if not isinstance(name, str):
+                continue
+            coded = _indexable_codes(df[name], max_codes)
+            if coded is None:
+                continue
+            codes, values = coded
+            bitmaps = np.stack([np.packbits(codes == i) for i in range(len(values))]) if values else \
+                np.zeros((0, (rows + 7) // 8), dtype=np.uint8)
+            columns[name] = {"values": values, "first": first, "counts": [_popcount(b) for b in bitmaps]}
+            chunks.append(bitmaps)
+            first += len(values)
+        bitmaps = np.concatenate(chunks) if chunks else np.zeros((0, (rows + 7) // 8), dtype=np.uint8)
+        return cls(bitmaps, columns, rows)
+
+    def save(self, directory, dataset_version):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, BITMAPS_FILE), self.bitmaps)
+        with open(os.path.join(directory, BITMAPS_SCHEMA_FILE), "w") as f:
+            json.dump({"dataset_version": dataset_version, "rows": self.rows, "columns": self.columns}, f, default=str)
+        self.directory = directory
+        return self
+
+    @classmethod
+    def load(cls, directory, dataset_version=None, mmap=None):
+        """Load a saved index, or None when missing or built from another dataset version"""
+        mmap = config.MMAP_ARTIFACTS if mmap is None else mmap
+        schema_path = os.path.join(directory, BITMAPS_SCHEMA_FILE)
+        if not os.path.exists(schema_path):
+            return None
+        with open(schema_path) as f:
+            schema = json.load(f)
+        if dataset_version is not None and schema["dataset_version"] != dataset_version:
+            return None
+        try:
+            bitmaps = np.load(os.path.join(directory, BITMAPS_FILE), mmap_mode="r" if mmap else None)
+        except ValueError:  # empty arrays cannot be memory-mapped
+            bitmaps = np.load(os.path.join(directory, BITMAPS_FILE))
+        return cls(bitmaps, schema["columns"], schema["rows"], directory)
+
+    def nbytes(self):
+        return self.bitmaps.nbytes
+
+    def _bitmap(self, column, value):
+        i = self._lookup[column].get(_normalize(value))
+        if i is None:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)  # code never occurs
+        return self.bitmaps[self.columns[column]["first"] + i]
+
+    def mask(self, conditions):
+        """Packed AND of column conditions; a list/tuple/set value ORs its codes"""
+        result = None
+        for column, wanted in conditions.items():
+            column_mask = np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+            for value in _as_list(wanted):
+                column_mask |= self._bitmap(column, value)
+            result = column_mask if result is None else result & column_mask
+        if result is None:
+            return np.packbits(np.ones(self.rows, dtype=bool))
+        return result
+
+    def positions(self, mask):
+        return np.flatnonzero(np.unpackbits(mask, count=self.rows))
+
+    def value_counts(self, column):
+        spec = self.columns[column]
+        return pd.Series(spec["counts"], index=spec["values"], name="count").sort_values(ascending=False)
+
+    def helpers(self, base_df):
+        """Functions exposed to generated plan code, bound to the frame the index was built from"""
+        buffers = {name: column_buffer(base_df[name]) for name in self.columns}
+
+        def indexed(df, column):
+            # The bitmaps describe base_df's rows in order; filtered or reordered frames and overwritten columns are scanned
+            if column not in self.columns or len(df) != self.rows or column not in df.columns:
+                return False
+            return _same_buffer(column_buffer(df[column]), buffers[column])
+
+        def bitmap_filter(df, *any_of, **all_of):
+            """Rows of df matching all keyword conditions and, if given, any of the condition dicts.
+
+            bitmap_filter(df, Cardiaccomorbidity1=1, sex=[1, 2]) is
+            df[(df.Cardiaccomorbidity1 == 1) & df.sex.isin([1, 2])];
+            bitmap_filter(df, {"a": 1}, {"b": 2}) is df[(df.a == 1) | (df.b == 2)].
+            """
+            # Missing values are not indexed, so conditions on them fall back to a scan as well
+            if not all(indexed(df, column) and not any(pd.isna(v) for v in _as_list(wanted))
+                       for clause in (all_of, *any_of) for column, wanted in clause.items()):
+                return df[_scan_mask(df, all_of, any_of)]
+            mask = self.mask(all_of)
+            if any_of:
+                either = np.zeros_like(mask)
+                for clause in any_of:
+                    either |= self.mask(clause)
+                mask = mask & either
+            return df.iloc[self.positions(mask)]
+
+        def bitmap_value_counts(df, column):
+            """Counts of each code of a column; instant on the full dataset"""
+            if indexed(df, column):
+                return self.value_counts(column)
+            return df[column].value_counts()
+
+        return {"bitmap_filter": bitmap_filter, "bitmap_value_counts": bitmap_value_counts}
+
+    def describe(self):
+        """Prompt note listing the helpers and the indexed columns"""
+        return (f"Fast helpers (use them for equality filters and counts on coded columns of the full df):\n"
+                f"- bitmap_filter(df, col=code, other=[code1, code2]) -> rows matching all conditions "
+                f"(list = any of those codes); bitmap_filter(df, {{'a': 1}}, {{'b': 2}}) -> rows matching any dict\n"
+                f"- bitmap_value_counts(df, col) -> Series of counts per code\n"
+                f"Indexed columns: {', '.join(self.columns)}")
+
+
+def _scan_mask(df, all_of, any_of):
+    """Boolean mask equivalent to a bitmap_filter call, computed with pandas"""
+    def clause_mask(clause):
+        mask = pd.Series(True, index=df.index)
+        for column, wanted in clause.items():
+            mask &= df[column].isin(_as_list(wanted))
+        return mask
+
+    mask = clause_mask(all_of)
+    if any_of:
+        either = pd.Series(False, index=df.index)
+        for clause in any_of:
+            either |= clause_mask(clause)
+        mask &= either
+    return mask
+
+
+def load_or_build_bitmap_index(df, dataset_version, directory=None):
+    """Bitmap index for the dataset, reusing the one saved next to the data cache when its version matches"""
+    directory = directory or config.DATA_CACHE_DIR
+    index = BitmapIndex.load(directory, dataset_version)
+    if index is not None and index.rows == len(df):
+        return index
+    start = time.time()
+    index = BitmapIndex.build(df).save(directory, dataset_version)
+    print(f"🧩 Built bitmap index over {len(index.columns)} coded columns in {time.time() - start:.2f}s "
+          f"({index.bitmaps.shape[0]} bitmaps, {index.nbytes() / 1e6:.1f} MB)")
+    return BitmapIndex.load(directory, dataset_version)
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import config
+from src.embeddings.entry_columns import encode_strings, decode_strings
+
+MANIFEST_FILE = "manifest.json"
+PARQUET_FILE = "data.parquet"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+FORMAT_VERSION = 3
+
+
+def file_content_hash(path, chunk_size=1 << 20):
+    """sha1 of a file's bytes, used as the dataset version"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _integer_valued(values):
+    finite = values[~np.isnan(values)]
+    return len(finite) > 0 and np.all(finite == np.round(finite))
+
+def optimize_dtypes(df, max_categories=None, max_codes=None):
+    """Shrink a CSV-inferred frame: coded ints to the smallest int type, low-cardinality strings to categoricals.
+
+    Only integer columns with at most `max_codes` distinct values count as coded; other
+    integer columns (ages, years, counts) keep int64 so arithmetic on them cannot
+    overflow. Integer-valued coded float columns (codes with missing values) become
+    float32, which holds small codes exactly. Other floats keep float64. Returns (df, schema).
+    """
+    max_categories = max_categories or config.DATA_CATEGORICAL_MAX_CATEGORIES
+    max_codes = max_codes or config.BITMAP_INDEX_MAX_CODES
+    columns, schema = {}, {}
+    for name in df.columns:
+        column = df[name]
+        dtype = column.dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            converted, role = column, "bool"
+        elif pd.api.types.is_integer_dtype(dtype) and column.nunique() <= max_codes:
+            converted, role = pd.to_numeric(column, downcast="integer"), "coded_int"
+        elif pd.api.types.is_integer_dtype(dtype):
+            converted, role = column.astype(np.int64), "integer"
+        elif pd.api.types.is_float_dtype(dtype) and column.nunique() <= max_codes and _integer_valued(column.to_numpy()):
+            converted, role = column.astype(np.float32), "coded_float"
+        elif pd.api.types.is_float_dtype(dtype):
+            converted, role = column, "float"
+        elif (pd.api.types.is_string_dtype(dtype) or dtype == object) and column.nunique() <= max_categories \
+                and column.nunique() < max(1, len(column) // 2):
+            converted, role = column.astype("category"), "category"
+        else:
+            converted, role = column, "text"
+        columns[name] = converted
+        schema[name] = {"role": role, "csv_dtype": str(dtype), "dtype": str(converted.dtype)}
+    return pd.DataFrame(columns, index=df.index, copy=False), schema
+
+def column_buffer(column):
+    """The ndarray backing a column (codes for categoricals), or None when it is not NumPy-backed"""
+    values = column.array
+    if isinstance(values, pd.Categorical):
+        return values.codes
+    return getattr(values, "_ndarray", None)
+
+def _frame_bytes(df):
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def _write_npy_columns(directory, df, schema):
+    """Write each column as an mmap-able .npy file (categoricals as codes, strings as utf-8 buffers)"""
+    for i, name in enumerate(df.columns):
+        column, spec = df[name], schema[name]
+        stem = os.path.join(directory, f"c{i:05d}")
+        spec["file"] = f"c{i:05d}"
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(stem + ".npy", column.cat.codes.to_numpy())
+            spec["storage"] = "codes"
+            spec["categories"] = column.cat.categories.tolist()
+        elif isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM":
+            np.save(stem + ".npy", column.to_numpy())
+            spec["storage"] = "raw"
+        elif column.dropna().map(type).eq(str).all():
+            missing = column.isna().to_numpy()
+            offsets, blob = encode_strings(["" if m else v for v, m in zip(column.tolist(), missing)])
+            np.save(stem + ".offsets.npy", offsets)
+            np.save(stem + ".bytes.npy", blob)
+            np.save(stem + ".missing.npy", missing)
+            spec["storage"] = "strings"
+        else:
+            with open(stem + ".pkl", "wb") as f:
+                pickle.dump(column.to_numpy(dtype=object), f)  # mixed-type column; rare in registry extracts
+            spec["storage"] = "pickle"
+
+def _load(path, mmap):
+    # "c" maps pages copy-on-write: in-place writes from analysis code get private pages, the file is never touched
+    try:
+        return np.load(path, mmap_mode="c" if mmap else None)
+    except ValueError:  # empty arrays cannot be memory-mapped
+        return np.load(path)
+
+def _read_npy_columns(directory, schema, columns, mmap):
+    data = {}
+    for name in columns:
+        spec = schema[name]
+        stem = os.path.join(directory, spec["file"])
+        if spec["storage"] == "raw":
+            data[name] = _load(stem + ".npy", mmap)
+        elif spec["storage"] == "codes":
+            data[name] = pd.Categorical.from_codes(np.asarray(_load(stem + ".npy", mmap)), spec["categories"])
+        elif spec["storage"] == "strings":
+            values = decode_strings(_load(stem + ".offsets.npy", mmap), _load(stem + ".bytes.npy", mmap))
+            missing = _load(stem + ".missing.npy", False)
+            data[name] = pd.array([None if m else v for v, m in zip(values, missing.tolist())], dtype=spec["dtype"])
+        else:
+            with open(stem + ".pkl", "rb") as f:
+                data[name] = pickle.load(f)
+    return data
+
+
+@contextmanager
+def _cache_lock(cache_dir):
+    """Exclusive inter-process lock on the cache directory (no-op where fcntl is unavailable)"""
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(os.path.join(cache_dir, LOCK_FILE), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def current_cache_dir(cache_dir=None):
+    """Directory of the published cache version, or None before the first build"""
+    cache_dir = cache_dir or config.DATA_CACHE_DIR
+    pointer = os.path.join(cache_dir, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer) as f:
+        version = f.read().strip()
+    return os.path.join(cache_dir, version) if version else None
+
+def read_manifest(cache_dir=None):
+    """Manifest of the published cache version, or None"""
+    directory = current_cache_dir(cache_dir)
+    path = os.path.join(directory, MANIFEST_FILE) if directory else None
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _publish(cache_dir, version):
+    """Atomically point CURRENT at a version, then drop versions older than the one it replaces.
+
+    The replaced version is kept so processes still opening it are not disturbed.
+    """
+    previous = current_cache_dir(cache_dir)
+    pointer_tmp = os.path.join(cache_dir, f".{CURRENT_FILE}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(cache_dir, CURRENT_FILE))
+
+    keep = {version, os.path.basename(previous) if previous else None}
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name not in keep and not name.startswith(".") and os.path.isfile(os.path.join(path, MANIFEST_FILE)):
+            shutil.rmtree(path, ignore_errors=True)
+
+def _csv_version(csv_path, manifest):
+    """Content hash of the CSV; the recorded hash is reused when size and mtime are unchanged"""
+    stat = os.stat(csv_path)
+    if manifest and manifest.get("csv_size") == stat.st_size and manifest.get("csv_mtime_ns") == stat.st_mtime_ns:
+        return manifest["csv_hash"], stat
+    return file_content_hash(csv_path), stat
+
+def build_dataset_cache(csv_path=None, cache_dir=None, storage=None):
+    """Convert the CSV into a new columnar cache version, publish it and return its manifest.
+
+    Callers that may run concurrently should hold the cache lock (see load_dataset).
+    """
+    csv_path = csv_path or config.CSV_PATH
+    cache_dir = cache_dir or config.DATA_CACHE_DIR
+    storage = storage or config.DATA_CACHE_FORMAT
+    if storage == "parquet" and not _has_pyarrow():
+        storage = "npy"
+
+    csv_hash, stat = _csv_version(csv_path, None)
+    start = time.time()
+    raw = pd.read_csv(csv_path)
+    df, schema = optimize_dtypes(raw)
+
+    # Each build gets its own directory; the live one is never modified
+    version = f"{csv_hash[:16]}-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    staging = os.path.join(cache_dir, f".{version}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    if storage == "parquet":
+        df.to_parquet(os.path.join(staging, PARQUET_FILE), index=False)
+    else:
+        _write_npy_columns(staging, df, schema)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "storage": storage,
+        "csv_path": os.path.abspath(csv_path),
+        "csv_hash": csv_hash,
+        "csv_size": stat.st_size,
+        "csv_mtime_ns": stat.st_mtime_ns,
+        "rows": len(df),
+        "columns": list(df.columns),
+        "schema": schema,
+        "csv_bytes": _frame_bytes(raw),
+        "cache_bytes": _frame_bytes(df),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    os.rename(staging, os.path.join(cache_dir, version))
+    _publish(cache_dir, version)
+    print(f"📦 Built {storage} data cache for {csv_path} in {time.time() - start:.2f}s "
+          f"({manifest['csv_bytes'] / 1e6:.1f} MB as CSV dtypes -> {manifest['cache_bytes'] / 1e6:.1f} MB)")
+    return manifest
+
+def _stale(csv_path, manifest):
+    if manifest is None or manifest.get("format_version") != FORMAT_VERSION:
+        return True
+    return manifest["csv_hash"] != _csv_version(csv_path, manifest)[0]
+
+def load_dataset(csv_path=None, columns=None, cache_dir=None, mmap=None):
+    """Load the analysis DataFrame from the columnar cache, rebuilding it when the CSV changed.
+
+    `columns` limits loading to a subset of columns. Returns (DataFrame, dataset version),
+    where the version is the CSV content hash.
+    """
+    csv_path = csv_path or config.CSV_PATH
+    cache_dir = cache_dir or config.DATA_CACHE_DIR
+    mmap = config.MMAP_ARTIFACTS if mmap is None else mmap
+
+    if not config.DATA_CACHE_ENABLED:
+        df = pd.read_csv(csv_path, usecols=columns)
+        return df, file_content_hash(csv_path)
+
+    manifest = read_manifest(cache_dir)
+    if _stale(csv_path, manifest):
+        # Workers starting together on a changed CSV: one rebuilds, the others wait and reuse its result
+        with _cache_lock(cache_dir):
+            manifest = read_manifest(cache_dir)
+            if _stale(csv_path, manifest):
+                manifest = build_dataset_cache(csv_path, cache_dir)
+
+    directory = os.path.join(cache_dir, manifest["version"])
+    columns = list(columns) if columns is not None else manifest["columns"]
+    if manifest["storage"] == "parquet":
+        df = pd.read_parquet(os.path.join(directory, PARQUET_FILE), columns=columns, memory_map=mmap)
+    else:
+        df = pd.DataFrame(_read_npy_columns(directory, manifest["schema"], columns, mmap), copy=False)
+    return df, manifest["csv_hash"]
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+import config
+
+SNAPSHOT_VARIABLES_QUERY = """
+MATCH (v:Variable)
+RETURN elementId(v) AS id, v.name AS name, v.description AS description, labels(v) AS labels
+"""
+
+SNAPSHOT_EDGES_QUERY = """
+MATCH (v:Variable)-[r]->(t)
+RETURN elementId(v) AS source, type(r) AS rel_type, elementId(t) AS target,
+       labels(t) AS labels, t.name AS name, t.label AS label
+"""
+
+# Writers that bump (:GraphMeta {version}) on every change make the staleness check O(1);
+# without that node the version is a content hash of the rows the snapshot is built from
+SNAPSHOT_VERSION_QUERY = """
+OPTIONAL MATCH (m:GraphMeta)
+RETURN max(m.version) AS version
+"""
+
+
+class _Interner:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _content_hash(variables, edges):
+    """Order-independent hash of the snapshot rows (names, descriptions, labels and relationships)"""
+    digest = hashlib.sha1()
+    for rows in (variables, edges):
+        for line in sorted(json.dumps(row, sort_keys=True, default=str) for row in rows):
+            digest.update(line.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def _fetch_rows(session):
+    variables = [r.data() for r in session.run(SNAPSHOT_VARIABLES_QUERY)]
+    edges = [r.data() for r in session.run(SNAPSHOT_EDGES_QUERY)]
+    return variables, edges
+
+def _meta_version(session):
+    version = session.run(SNAPSHOT_VERSION_QUERY).single()["version"]
+    return f"meta:{version}" if version is not None else None
+
+def fetch_graph_version(driver):
+    """Change marker of the graph used to decide whether a snapshot is stale.
+
+    The GraphMeta version when writers maintain one, otherwise a content hash of the
+    snapshot rows (a full read of the subgraph, but no rebuild when nothing changed).
+    """
+    with driver.session() as session:
+        version = _meta_version(session)
+        if version is None:
+            version = _content_hash(*_fetch_rows(session))
+    return version
+
+
+class GraphSnapshot:
+    """Read-only in-process copy of the Variable/Value/Category subgraph.
+
+    Nodes are interned to dense int ids with interned name, label and label-set codes.
+    Outgoing relationships of Variable nodes are stored as CSR adjacency arrays
+    (indptr / targets / typed edges), so neighbourhood lookups are array slices.
+    """
+
+    def __init__(self, variable_ids, descriptions, node_names, node_labels, node_labelsets,
+                 indptr, targets, edge_types, names, labels, labelsets, rel_types, version=None):
+        self.variable_ids = variable_ids
+        self.descriptions = descriptions
+        self.node_names = node_names
+        self.node_labels = node_labels
+        self.node_labelsets = node_labelsets
+        self.indptr = indptr
+        self.targets = targets
+        self.edge_types = edge_types
+        self.names = names
+        self.labels = labels
+        self.labelsets = labelsets
+        self.rel_types = rel_types
+        self.version = version
+        self.loaded_at = time.time()
+
+        self._label_codes = {label: code for code, label in enumerate(labels)}
+        self._has_value = rel_types.index("HAS_VALUE") if "HAS_VALUE" in rel_types else -1
+        is_value_set = np.array(["Value" in ls for ls in labelsets] + [False], dtype=bool)
+        is_variable_set = np.array(["Variable" in ls for ls in labelsets] + [False], dtype=bool)
+        self._is_value = is_value_set[node_labelsets]  # -1 label sets index the trailing False
+        self._is_variable = is_variable_set[node_labelsets]
+
+    @classmethod
+    def load(cls, driver):
+        """Load the snapshot with two Cypher queries"""
+        with driver.session() as session:
+            version = _meta_version(session)
+            variables, edges = _fetch_rows(session)
+        version = version or _content_hash(variables, edges)
+
+        node_ids, names, labels, labelsets, rel_types = {}, _Interner(), _Interner(), _Interner(), _Interner()
+        node_names, node_labels, node_labelsets = [], [], []
+
+        def intern_node(element_id, name, label, labelset):
+            node = node_ids.get(element_id)
+            if node is None:
+                node = node_ids[element_id] = len(node_names)
+                node_names.append(names.code(name))
+                node_labels.append(labels.code(label))
+                node_labelsets.append(labelsets.code(labelset))
+            return node
+
+        variable_ids, descriptions = {}, {}
+        for row in variables:
+            node = intern_node(row["id"], row["name"], None, tuple(row["labels"]))
+            variable_ids.setdefault(row["name"], node)
+            descriptions[node] = row["description"]
+
+        sources = np.empty(len(edges), dtype=np.int32)
+        targets = np.empty(len(edges), dtype=np.int32)
+        edge_types = np.empty(len(edges), dtype=np.int16)
+        for i, row in enumerate(edges):
+            sources[i] = node_ids[row["source"]]
+            targets[i] = intern_node(row["target"], row["name"], row["label"], tuple(row["labels"]))
+            edge_types[i] = rel_types.code(row["rel_type"])
+
+        # CSR over source nodes; a stable sort keeps each node's edges in query order
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(len(node_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(node_names)), out=indptr[1:])
+
+        return cls(variable_ids, descriptions,
+                   np.array(node_names, dtype=np.int32), np.array(node_labels, dtype=np.int32),
+                   np.array(node_labelsets, dtype=np.int16),
+                   indptr, targets[order], edge_types[order],
+                   names.values, labels.values, labelsets.values, rel_types.values, version=version)
+
+    def __contains__(self, var_name):
+        return var_name in self.variable_ids
+
+    def _edges(self, var_name):
+        node = self.variable_ids[var_name]
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return self.targets[start:end], self.edge_types[start:end]
+
+    def _values(self, var_name):
+        targets, types = self._edges(var_name)
+        return targets[(types == self._has_value) & self._is_value[targets]]
+
+    def _name(self, node):
+        code = self.node_names[node]
+        return self.names[code] if code >= 0 else None
+
+    def _label(self, node):
+        code = self.node_labels[node]
+        return self.labels[code] if code >= 0 else None
+
+    def relationships(self, var_name, label=None):
+        """Outgoing relationships of a variable, as format_context's Cypher returns them.
+
+        With a label, relationships are repeated once per matching value node and are
+        empty when the value does not exist under the variable.
+        """
+        matches = 1
+        if label is not None:
+            code = self._label_codes.get(label, -2)
+            matches = int(np.count_nonzero(self.node_labels[self._values(var_name)] == code))
+
+        targets, types = self._edges(var_name)
+        rels = [{"rel_type": self.rel_types[t],
+                 "connected_name": self._name(node),
+                 "labels": list(self.labelsets[self.node_labelsets[node]])}
+                for node, t in zip(targets.tolist(), types.tolist())]
+        return rels * matches
+
+    def values_for_variable(self, var_name):
+        """Sorted value labels of a variable"""
+        return sorted(label for label in (self._label(n) for n in self._values(var_name).tolist()) if label)
+
+    def related_values(self, var_name):
+        """Distinct (related variable, value label) pairs one hop from a variable"""
+        targets, _ = self._edges(var_name)
+        pairs = []
+        for related in dict.fromkeys(targets[self._is_variable[targets]].tolist()):
+            related_name = self._name(related)
+            start, end = self.indptr[related], self.indptr[related + 1]
+            related_targets, related_types = self.targets[start:end], self.edge_types[start:end]
+            values = related_targets[(related_types == self._has_value) & self._is_value[related_targets]]
+            for label in dict.fromkeys(self._label(n) for n in values.tolist()):
+                if related_name and label:
+                    pairs.append((related_name, label))
+        return pairs
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "nodes": len(self.node_names),
+            "edges": len(self.targets),
+            "variables": len(self.variable_ids),
+            "bytes": sum(a.nbytes for a in (self.node_names, self.node_labels, self.node_labelsets,
+                                            self.indptr, self.targets, self.edge_types)),
+        }
+
+
+class GraphSnapshotManager:
+    """Holds the current GraphSnapshot and refreshes it in the background when the graph changes"""
+
+    def __init__(self, driver, refresh_seconds=None):
+        self.driver = driver
+        self.refresh_seconds = config.GRAPH_SNAPSHOT_REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self.current = None
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        self.current = GraphSnapshot.load(self.driver)
+        return self.current
+
+    def add_listener(self, callback):
+        """Call callback(snapshot) after every background reload (e.g. to re-scope caches)"""
+        self._listeners.append(callback)
+
+    def refresh_if_changed(self):
+        """Reload the snapshot when the graph version differs; returns True on reload"""
+        if self.current is not None and fetch_graph_version(self.driver) == self.current.version:
+            return False
+        self.load()
+        print(f"🔄 Graph snapshot refreshed: {self.current.stats()}")
+        for callback in self._listeners:
+            try:
+                callback(self.current)
+            except Exception as e:
+                print(f"⚠️ Graph snapshot listener failed: {e}")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh_if_changed()
+            except Exception as e:
+                print(f"⚠️ Graph snapshot refresh failed, keeping the previous snapshot: {e}")
+
+    def start(self):
+        if self.refresh_seconds and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -1,7 +1,11 @@
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
+import config
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase
 
 load_dotenv()
 
@@ -13,6 +17,13 @@ def get_graph_connection():
     driver = GraphDatabase.driver(uri, auth=(user, password))
     return driver
 
+def get_async_graph_connection():
+    uri = os.getenv("NEO4J_URL")
+    user = os.getenv("NEO4J_USER")
+    password = os.getenv("NEO4J_PASS")
+
+    return AsyncGraphDatabase.driver(uri, auth=(user, password))
+
 def fetch_variable_and_value_nodes(driver):
     query = """
     MATCH (v:Variable)-[:BELONGS_TO]->(c:Category)
@@ -38,20 +49,88 @@ def extract_variable_array_from_text(text: str):
     return variables
 
 # --- Retrieve all value labels grouped by variable name ---
-def get_all_values_for_variables(driver, variable_names):
+VALUES_FOR_VARIABLES_QUERY = """
+UNWIND $names AS name
+MATCH (v:Variable {name: name})
+OPTIONAL MATCH (v)-[:HAS_VALUE]->(val:Value)
+WITH name, val.label AS label
+ORDER BY label
+RETURN name, collect(label) AS labels
+"""
+
+# Read-through LRU of variable name -> (expires_at, value labels); codebooks rarely change.
+# Names come from LLM output, so the cache is capped at VALUES_CACHE_MAX_ITEMS
+_values_cache = OrderedDict()
+_values_cache_lock = threading.Lock()
+
+def clear_values_cache():
+    with _values_cache_lock:
+        _values_cache.clear()
+
+def _values_from_snapshot_or_cache(variable_names, snapshot, now):
+    """Answer what we can without Neo4j; returns (values_by_variable, missing names)"""
     values_by_variable = {}
+    if snapshot is not None:
+        for var_name in variable_names:
+            if var_name in snapshot:
+                values_by_variable[var_name] = snapshot.values_for_variable(var_name)
+
+    with _values_cache_lock:
+        for var_name in variable_names:
+            if var_name in values_by_variable:
+                continue
+            cached = _values_cache.get(var_name)
+            if cached and cached[0] > now:
+                _values_cache.move_to_end(var_name)
+                values_by_variable[var_name] = list(cached[1])
+    missing = [name for name in dict.fromkeys(variable_names) if name not in values_by_variable]
+    return values_by_variable, missing
 
-    for var_name in variable_names:
-        query = """
-        MATCH (v:Variable {name: $var_name})
-        OPTIONAL MATCH (v)-[:HAS_VALUE]->(val:Value)
-        RETURN val.label AS label
-        ORDER BY val.label
-        """
+def _cache_fetched_values(records, missing, ttl, now):
+    fetched = {name: [] for name in missing}
+    for record in records:
+        fetched[record["name"]] = [label for label in record["labels"] if label]
+
+    if ttl <= 0:
+        return fetched
+    with _values_cache_lock:
+        for name, values in fetched.items():
+            _values_cache[name] = (now + ttl, tuple(values))
+            _values_cache.move_to_end(name)
+        # Drop expired entries, then the least recently used beyond the cap
+        for name in [name for name, (expires_at, _) in _values_cache.items() if expires_at <= now]:
+            del _values_cache[name]
+        while len(_values_cache) > config.VALUES_CACHE_MAX_ITEMS:
+            _values_cache.popitem(last=False)
+    return fetched
+
+def get_all_values_for_variables(driver, variable_names, ttl=None, snapshot=None):
+    """Return {variable name: sorted value labels} using one UNWIND query for cache misses.
+
+    Variables known to the graph snapshot are answered in-process.
+    """
+    ttl = config.VALUES_CACHE_TTL_SECONDS if ttl is None else ttl
+    now = time.time()
+
+    values_by_variable, missing = _values_from_snapshot_or_cache(variable_names, snapshot, now)
+    if missing:
         with driver.session() as session:
-            result = session.run(query, {"var_name": var_name})
-            records = list(result)
-        values = [record["label"] for record in records if record.get("label")]
-        values_by_variable[var_name] = values
+            records = list(session.run(VALUES_FOR_VARIABLES_QUERY, {"names": missing}))
+        values_by_variable.update(_cache_fetched_values(records, missing, ttl, now))
+
+    # Preserve the caller's variable order
+    return {name: values_by_variable[name] for name in variable_names}
+
+async def get_all_values_for_variables_async(async_driver, variable_names, ttl=None, snapshot=None):
+    """Async variant of get_all_values_for_variables using the async Neo4j driver"""
+    ttl = config.VALUES_CACHE_TTL_SECONDS if ttl is None else ttl
+    now = time.time()
+
+    values_by_variable, missing = _values_from_snapshot_or_cache(variable_names, snapshot, now)
+    if missing:
+        async with async_driver.session() as session:
+            result = await session.run(VALUES_FOR_VARIABLES_QUERY, {"names": missing})
+            records = await result.data()
+        values_by_variable.update(_cache_fetched_values(records, missing, ttl, now))
 
-    return values_by_variable
+    return {name: values_by_variable[name] for name in variable_names}
@@ -0,0 +1,165 @@
+import json
+import os
+import pickle
+import shutil
+import time
+
+import faiss
+import numpy as np
+import config
+from src.embeddings.entry_columns import write_entry_columns, read_entry_columns, entries_from_columns
+from src.embeddings.vector_index import configure_index, PositionalIndex
+
+ENTRIES_FILE = "kg_entries.pkl"
+ENTRIES_DIR = "kg_entries"
+INDEX_FILE = "faiss_index.faiss"
+EMBEDDINGS_FILE = "embeddings.npy"
+ENTRY_IDS_FILE = "entry_ids.npy"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+
+
+def current_version(versions_dir=None):
+    """Return the name of the active artifact version, or None if only legacy files exist"""
+    versions_dir = versions_dir or config.KG_VERSIONS_DIR
+    pointer = os.path.join(versions_dir, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer) as f:
+        return f.read().strip() or None
+
+def artifact_paths(version=None, versions_dir=None):
+    """Return file paths of an artifact set (the current version, falling back to the legacy cache files)"""
+    versions_dir = versions_dir or config.KG_VERSIONS_DIR
+    version = version or current_version(versions_dir)
+
+    if version is None:
+        return {
+            "version": None,
+            "entries": os.path.join(config.CACHE_DIR, ENTRIES_FILE),
+            "index": config.FAISS_INDEX_PATH,
+            "embeddings": os.path.join(config.CACHE_DIR, EMBEDDINGS_FILE),
+            "entry_ids": None,
+            "manifest": None,
+        }
+
+    root = os.path.join(versions_dir, version)
+    return {
+        "version": version,
+        "entries": os.path.join(root, ENTRIES_DIR),
+        "index": os.path.join(root, INDEX_FILE),
+        "embeddings": os.path.join(root, EMBEDDINGS_FILE),
+        "entry_ids": os.path.join(root, ENTRY_IDS_FILE),
+        "manifest": os.path.join(root, MANIFEST_FILE),
+    }
+
+def load_manifest(version=None, versions_dir=None):
+    """Return the manifest of an artifact version, or None for the legacy cache"""
+    path = artifact_paths(version, versions_dir)["manifest"]
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def load_entries(path, mmap=None):
+    """Load KG entries from a columnar entry directory, or from a legacy pickle"""
+    mmap = config.MMAP_ARTIFACTS if mmap is None else mmap
+    if os.path.isdir(path):
+        return entries_from_columns(read_entry_columns(path, mmap=mmap))
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def load_embeddings(path, mmap=None):
+    """Open the entry embedding matrix, memory-mapped read-only by default"""
+    mmap = config.MMAP_ARTIFACTS if mmap is None else mmap
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+def load_index(path, mmap=None, entry_ids=None):
+    """Read a FAISS index, memory-mapping its storage when supported so pages are shared across workers.
+
+    Indexes that return entry ids (manifest "id_mapped", written by kg_sync) are given
+    their entry_ids and wrapped so searches return entry positions.
+    """
+    mmap = config.MMAP_ARTIFACTS if mmap is None else mmap
+    index = None
+    if mmap:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            index = faiss.read_index(path, flags)
+        except RuntimeError:
+            index = None  # index type without mmap support - fall back to a regular read
+    if index is None:
+        index = faiss.read_index(path)
+    index = configure_index(index)
+    return PositionalIndex(index, entry_ids) if entry_ids is not None else index
+
+def load_entry_ids(path):
+    """Entry id column of an artifact set (None for legacy caches)"""
+    return np.load(path) if path and os.path.exists(path) else None
+
+def load_artifacts(version=None, versions_dir=None):
+    """Load entries, embeddings, entry ids and manifest of an artifact set (no index)"""
+    paths = artifact_paths(version, versions_dir)
+    if not os.path.exists(paths["entries"]):
+        return None
+
+    entries = load_entries(paths["entries"])
+    embeddings = load_embeddings(paths["embeddings"])
+    entry_ids = load_entry_ids(paths["entry_ids"])
+
+    return {
+        "version": paths["version"],
+        "entries": entries,
+        "embeddings": embeddings,
+        "entry_ids": entry_ids,
+        "manifest": load_manifest(paths["version"], versions_dir),
+    }
+
+def _next_version(versions_dir):
+    existing = [int(name[1:]) for name in os.listdir(versions_dir)
+                if name.startswith("v") and name[1:].isdigit()]
+    return f"v{max(existing, default=0) + 1:04d}"
+
+def write_version(entries, embeddings, entry_ids, index, manifest, versions_dir=None):
+    """Write a new artifact set, then atomically point CURRENT at it. Returns the version name."""
+    versions_dir = versions_dir or config.KG_VERSIONS_DIR
+    os.makedirs(versions_dir, exist_ok=True)
+
+    version = _next_version(versions_dir)
+    staging = os.path.join(versions_dir, f".{version}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    write_entry_columns(os.path.join(staging, ENTRIES_DIR), entries)
+    np.save(os.path.join(staging, EMBEDDINGS_FILE), np.asarray(embeddings, dtype=np.float32))
+    np.save(os.path.join(staging, ENTRY_IDS_FILE), np.asarray(entry_ids, dtype=np.int64))
+    faiss.write_index(index, os.path.join(staging, INDEX_FILE))
+
+    manifest = dict(manifest, version=version, created_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    files=[ENTRIES_DIR, EMBEDDINGS_FILE, ENTRY_IDS_FILE, INDEX_FILE])
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(staging, os.path.join(versions_dir, version))
+
+    pointer_tmp = os.path.join(versions_dir, f".{CURRENT_FILE}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(versions_dir, CURRENT_FILE))
+    return version
+
+def prune_versions(keep=None, versions_dir=None):
+    """Delete all but the newest `keep` artifact versions (never the current one)"""
+    versions_dir = versions_dir or config.KG_VERSIONS_DIR
+    keep = keep or config.KG_KEEP_VERSIONS
+    if not os.path.isdir(versions_dir):
+        return []
+
+    current = current_version(versions_dir)
+    versions = sorted(name for name in os.listdir(versions_dir) if name.startswith("v") and name[1:].isdigit())
+    removed = []
+    for version in versions[:-keep]:
+        if version != current:
+            shutil.rmtree(os.path.join(versions_dir, version))
+            removed.append(version)
+    return removed
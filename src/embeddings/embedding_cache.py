@@ -0,0 +1,179 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import config
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU in front of a sqlite store.
+
+    Keys are sha256(model name + text), so the same string embedded by a different
+    model never collides. The disk tier is trimmed to `max_disk_items` by evicting
+    the least recently used rows.
+    """
+
+    def __init__(self, path=None, memory_items=None, max_disk_items=None):
+        self.path = path or config.EMBED_CACHE_PATH
+        self.memory_items = memory_items or config.EMBED_CACHE_MEMORY_ITEMS
+        self.max_disk_items = max_disk_items or config.EMBED_CACHE_MAX_DISK_ITEMS
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, text):
+        return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """Return {key: vector} for every key found in either tier"""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vec
+                    self._stats["memory_hits"] += 1
+                else:
+                    missing.append(key)
+
+            if missing:
+                now = time.time()
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i+500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT key, dim, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    for key, dim, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32, count=dim)
+                        found[key] = vec
+                        self._remember(key, vec)
+                    if rows:
+                        self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                               [(now, key) for key, _, _ in rows])
+                self._conn.commit()
+                self._stats["disk_hits"] += sum(1 for k in missing if k in found)
+                self._stats["misses"] += sum(1 for k in missing if k not in found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs in both tiers"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            rows = []
+            for key, vec in items:
+                vec = np.ascontiguousarray(vec, dtype=np.float32)
+                self._remember(key, vec)
+                rows.append((key, vec.shape[0], vec.tobytes(), now))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            self._evict_disk()
+            self._conn.commit()
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute("""
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+                )
+            """, (overflow,))
+            self._stats["evictions"] += overflow
+
+    def stats(self):
+        """Return hit/miss counters and the overall hit rate"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def cached_embedding_model(embed_model, cache):
+    """Wrap an embedding function so repeated texts are served from the cache"""
+    model_name = getattr(embed_model, "model_name", "unknown")
+
+    def _lookup(texts):
+        keys = [cache.make_key(model_name, t) for t in texts]
+        found = cache.get_many(keys)
+
+        # Each distinct missing text is embedded once, in a single batched call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        return keys, found, missing
+
+    def _store(found, missing, new_embeddings):
+        new_items = list(zip(missing.keys(), new_embeddings))
+        cache.put_many(new_items)
+        found.update(new_items)
+
+    def get_embeddings(texts):
+        """Embed one text or a list of texts, only calling the provider for cache misses"""
+        if not isinstance(texts, list):
+            return get_embeddings([texts])[0]
+        if not texts:
+            return embed_model(texts)
+
+        keys, found, missing = _lookup(texts)
+        if missing:
+            _store(found, missing, embed_model(list(missing.values())))
+        return np.vstack([found[k] for k in keys]).astype(np.float32, copy=False)
+
+    async def aembed_texts(texts):
+        """Async variant of get_embeddings"""
+        from src.embeddings.vector_index import aembed
+
+        if not isinstance(texts, list):
+            return (await aembed_texts([texts]))[0]
+        if not texts:
+            return await aembed(embed_model, texts)
+
+        keys, found, missing = _lookup(texts)
+        if missing:
+            _store(found, missing, await aembed(embed_model, list(missing.values())))
+        return np.vstack([found[k] for k in keys]).astype(np.float32, copy=False)
+
+    get_embeddings.backend = getattr(embed_model, "backend", None)
+    get_embeddings.model_name = model_name
+    get_embeddings.cache = cache
+    get_embeddings.aembed = aembed_texts
+    return get_embeddings
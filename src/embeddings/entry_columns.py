@@ -0,0 +1,138 @@
+import json
+import os
+
+import numpy as np
+
+# Integer codes for the entry 'type' column
+TYPE_CODES = {"variable": 0, "value": 1}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+SCHEMA_FILE = "schema.json"
+FORMAT_VERSION = 1
+
+
+def render_text(type_code, var_name, category, label=None, description=None):
+    """Render an entry's embedded text exactly as build_entries does"""
+    if type_code == TYPE_CODES["value"]:
+        return f"Value: {label} (from {var_name} - {category})"
+    return f"Variable: {var_name} - {description} ({category})"
+
+def encode_strings(values):
+    """Encode strings as (offsets, utf-8 bytes) arrays; offsets has len(values) + 1 entries"""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8) if encoded else np.zeros(0, dtype=np.uint8)
+    return offsets, blob
+
+def decode_string(offsets, blob, i):
+    """Decode the i-th string of an encoded string column"""
+    return bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+def decode_strings(offsets, blob):
+    """Decode a whole encoded string column into a list"""
+    raw = bytes(blob)
+    bounds = offsets.tolist()
+    return [raw[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(len(bounds) - 1)]
+
+def _dictionary_encode(values):
+    """Return (int32 codes, vocabulary) with None encoded as -1"""
+    vocab, lookup = [], {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+            continue
+        if value not in lookup:
+            lookup[value] = len(vocab)
+            vocab.append(value)
+        codes[i] = lookup[value]
+    return codes, vocab
+
+def encode_entry_columns(entries):
+    """Encode KG entry dicts as struct-of-arrays columns.
+
+    Variable and category names are interned into vocabularies, types are int8 codes
+    and entry texts are not stored at all - they are rendered from the columns.
+    """
+    types = np.array([TYPE_CODES[e['type']] for e in entries], dtype=np.int8)
+    var_codes, var_vocab = _dictionary_encode(
+        [e['parent_var'] if e['type'] == 'value' else e['var_name'] for e in entries])
+    category_codes, category_vocab = _dictionary_encode([e.get('category') for e in entries])
+    description_codes, description_vocab = _dictionary_encode(
+        [e.get('description') if e['type'] == 'variable' else None for e in entries])
+    label_offsets, label_bytes = encode_strings([e.get('label') or "" for e in entries])
+
+    columns = {
+        "type": types,
+        "var": var_codes,
+        "category": category_codes,
+        "description": description_codes,
+        "label_offsets": label_offsets,
+        "label_bytes": label_bytes,
+    }
+    for name, vocab in (("var_names", var_vocab), ("categories", category_vocab),
+                        ("descriptions", description_vocab)):
+        columns[f"{name}_offsets"], columns[f"{name}_bytes"] = encode_strings(vocab)
+    return columns
+
+def write_entry_columns(directory, entries):
+    """Write KG entries as mmap-able .npy columns instead of a pickle"""
+    os.makedirs(directory, exist_ok=True)
+
+    columns = encode_entry_columns(entries)
+    for name, array in columns.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    with open(os.path.join(directory, SCHEMA_FILE), "w") as f:
+        json.dump({"format_version": FORMAT_VERSION, "entries": len(entries), "columns": sorted(columns)}, f, indent=2)
+
+def read_entry_columns(directory, mmap=True):
+    """Open the column arrays of an entry directory (memory-mapped by default)"""
+    with open(os.path.join(directory, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    if schema["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported entry column format {schema['format_version']} in {directory}")
+
+    columns = {}
+    for name in schema["columns"]:
+        path = os.path.join(directory, f"{name}.npy")
+        try:
+            columns[name] = np.load(path, mmap_mode="r" if mmap else None)
+        except ValueError:  # empty arrays cannot be memory-mapped
+            columns[name] = np.load(path)
+    return columns
+
+def entries_from_columns(columns):
+    """Materialize the list-of-dicts entry representation from columns"""
+    var_names = decode_strings(columns["var_names_offsets"], columns["var_names_bytes"])
+    categories = decode_strings(columns["categories_offsets"], columns["categories_bytes"])
+    descriptions = decode_strings(columns["descriptions_offsets"], columns["descriptions_bytes"])
+    labels = decode_strings(columns["label_offsets"], columns["label_bytes"])
+
+    var_codes = columns["var"].tolist()
+    category_codes = columns["category"].tolist()
+    description_codes = columns["description"].tolist()
+
+    entries = []
+    for i, type_code in enumerate(columns["type"].tolist()):
+        var_name = var_names[var_codes[i]]
+        category = categories[category_codes[i]] if category_codes[i] >= 0 else None
+
+        if type_code == TYPE_CODES["value"]:
+            entries.append({
+                "text": render_text(type_code, var_name, category, label=labels[i]),
+                "type": "value",
+                "parent_var": var_name,
+                "category": category,
+                "label": labels[i]
+            })
+        else:
+            description = descriptions[description_codes[i]] if description_codes[i] >= 0 else None
+            entries.append({
+                "text": render_text(type_code, var_name, category, description=description),
+                "type": "variable",
+                "var_name": var_name,
+                "description": description,
+                "category": category
+            })
+    return entries
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """Return an L2-normalized float32 copy of a matrix (zero rows stay zero)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def is_normalized(matrix, tolerance=1e-3):
+    """True when every row of a float32 matrix already has unit L2 norm"""
+    if matrix.dtype != np.float32:
+        return False
+    norms = np.linalg.norm(matrix, axis=1)
+    return bool(np.all(np.abs(norms - 1.0) <= tolerance))
+
+
+class EntryEmbeddingIndex:
+    """Maps KG entry texts (and variable/value keys) to rows of the prebuilt embedding matrix.
+
+    Rows are pre-normalized, so scoring candidates against a query is a single
+    matrix-vector product. Only texts that are not in the matrix reach the
+    embedding provider. Lookups go through the EntryStore's hashed key index.
+    """
+
+    def __init__(self, entries, embeddings):
+        from src.retrieval.entry_store import EntryStore
+
+        if len(entries) != len(embeddings):
+            raise ValueError(f"Entries ({len(entries)}) and embeddings ({len(embeddings)}) are misaligned")
+
+        self.store = entries if isinstance(entries, EntryStore) else EntryStore.from_entries(entries)
+        # Keep an already-normalized (possibly memory-mapped) matrix as-is instead of copying it
+        self.matrix = embeddings if is_normalized(embeddings) else normalize_rows(embeddings)
+
+    def __len__(self):
+        return len(self.store)
+
+    def rows_for(self, texts, keys=None):
+        """Return the matrix row for each key (or each exact text when no keys are given), -1 when unknown"""
+        if keys is not None:
+            return self.store.find_rows(keys)
+        return self.store.find_text_rows(texts)
+
+    def _score_known(self, query_embedding, texts, keys):
+        """Score texts found in the matrix; returns (normalized query, sims, positions still to embed)"""
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        query_norm = np.linalg.norm(query)
+        if query_norm:
+            query = query / query_norm
+
+        rows = self.rows_for(texts, keys)
+        sims = np.empty(len(texts), dtype=np.float32)
+
+        known = rows >= 0
+        if known.any():
+            sims[known] = self.matrix[rows[known]] @ query
+        return query, sims, np.flatnonzero(~known)
+
+    def similarities(self, query_embedding, texts, embed_model, keys=None):
+        """Cosine similarity of the query against each text.
+
+        Known texts are scored from the stored matrix; only unknown ones are embedded.
+        """
+        query, sims, new_positions = self._score_known(query_embedding, texts, keys)
+        if len(new_positions):
+            new_vectors = normalize_rows(embed_model([texts[i] for i in new_positions]))
+            sims[new_positions] = new_vectors @ query
+        return sims
+
+    async def similarities_async(self, query_embedding, texts, embed_model, keys=None):
+        """Async variant of similarities; unknown texts go through the async embedding client"""
+        from src.embeddings.vector_index import aembed
+
+        query, sims, new_positions = self._score_known(query_embedding, texts, keys)
+        if len(new_positions):
+            new_vectors = normalize_rows(await aembed(embed_model, [texts[i] for i in new_positions]))
+            sims[new_positions] = new_vectors @ query
+        return sims
@@ -0,0 +1,70 @@
+import time
+
+import faiss
+import numpy as np
+import config
+from src.embeddings.vector_index import build_faiss_index, prepare_queries
+
+
+def sample_queries(embeddings, n_queries=200, noise=0.05, seed=0):
+    """Draw query vectors by perturbing random rows of the embedding matrix"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=min(n_queries, len(embeddings)), replace=False)
+    queries = np.asarray(embeddings[rows], dtype=np.float32)
+    return queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+
+def synthesize_embeddings(embeddings, size, noise=0.05, seed=0):
+    """Grow a real embedding matrix to `size` rows by jittering copies of it"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(embeddings), size=size)
+    synthetic = np.asarray(embeddings[rows], dtype=np.float32)
+    synthetic += rng.normal(scale=noise, size=synthetic.shape).astype(np.float32)
+    return synthetic
+
+def benchmark_index_types(embeddings, queries, index_types=None, top_k=None):
+    """Compare index types on recall@top_k against exact cosine search and per-query latency.
+
+    Returns one dict per index type with build time, recall and p50/p99 search latency
+    (single-query searches, as issued by retrieve_nodes).
+    """
+    index_types = index_types or ["flat_ip", "hnsw", "ivf_flat"]
+    top_k = top_k or config.TOP_K
+
+    baseline = build_faiss_index(embeddings, "flat_ip")
+    _, truth = baseline.search(prepare_queries(baseline, queries), top_k)
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_faiss_index(embeddings, index_type)
+        build_s = time.perf_counter() - start
+
+        prepared = prepare_queries(index, queries)
+        latencies = []
+        found = np.empty_like(truth)
+        for i in range(len(prepared)):
+            start = time.perf_counter()
+            _, ids = index.search(prepared[i:i+1], top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found[i] = ids[0]
+
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(truth)))
+        report.append({
+            "index_type": index_type,
+            "vectors": index.ntotal,
+            "build_s": build_s,
+            f"recall@{top_k}": hits / truth.size,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "bytes": faiss.serialize_index(index).nbytes,
+        })
+    return report
+
+def format_report(report):
+    """Render a benchmark report as a plain-text table"""
+    headers = list(report[0].keys())
+    rows = [[f"{v:.4f}" if isinstance(v, float) else str(v) for v in r.values()] for r in report]
+    widths = [max(len(h), *(len(r[i]) for r in rows)) for i, h in enumerate(headers)]
+    lines = ["  ".join(h.ljust(w) for h, w in zip(headers, widths))]
+    lines += ["  ".join(c.ljust(w) for c, w in zip(r, widths)) for r in rows]
+    return "\n".join(lines)
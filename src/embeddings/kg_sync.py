@@ -0,0 +1,225 @@
+import hashlib
+import os
+
+import faiss
+import numpy as np
+import config
+from src.embeddings.artifacts import artifact_paths, load_artifacts, write_version, prune_versions, current_version
+from src.embeddings.vector_index import build_id_mapped_index, configure_index
+
+# An IVF index is retrained once the collection has grown or shrunk by this factor since training
+IVF_RETRAIN_FACTOR = 2
+
+
+def entry_key(entry):
+    """Stable identity of a KG entry: a value is (variable, label), a variable is its name"""
+    if entry['type'] == 'value':
+        return f"value\x00{entry['parent_var']}\x00{entry['label']}"
+    return f"variable\x00{entry['var_name']}"
+
+def entry_id(entry):
+    """63-bit integer id derived from the entry key, used as the FAISS vector id"""
+    digest = hashlib.sha1(entry_key(entry).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFF_FFFF_FFFF_FFFF
+
+def content_hash(entry):
+    """Hash of the embedded text - changes when a description or category changes"""
+    return hashlib.sha1(entry['text'].encode("utf-8")).hexdigest()
+
+def kg_content_hash(entries):
+    """Order-independent fingerprint of a whole entry set"""
+    digest = hashlib.sha256()
+    for key in sorted(f"{entry_id(e)}:{content_hash(e)}" for e in entries):
+        digest.update(key.encode("utf-8"))
+    return digest.hexdigest()
+
+def diff_entries(old_entries, new_entries):
+    """Return (added, changed, removed) entry ids between two entry lists"""
+    old_hashes = {entry_id(e): content_hash(e) for e in old_entries}
+    new_hashes = {entry_id(e): content_hash(e) for e in new_entries}
+
+    added = [i for i in new_hashes if i not in old_hashes]
+    removed = [i for i in old_hashes if i not in new_hashes]
+    changed = [i for i in new_hashes if i in old_hashes and old_hashes[i] != new_hashes[i]]
+    return added, changed, removed
+
+def _rebuild_reason(index, manifest, index_type, removing, final_count):
+    """Why the serving index cannot take the delta in place, or None when it can"""
+    if index is None or not manifest.get("id_mapped"):
+        return "no ID-mapped serving index in the current artifact set"
+    if manifest.get("index_type") != index_type:
+        return f"index type changed from '{manifest.get('index_type')}' to '{index_type}'"
+    if index_type == "hnsw" and removing:
+        return "HNSW indexes do not support removing vectors"
+    trained_on = manifest.get("trained_on")
+    if index_type == "ivf_flat" and trained_on and not trained_on / IVF_RETRAIN_FACTOR <= final_count <= trained_on * IVF_RETRAIN_FACTOR:
+        return f"collection size {final_count} drifted from the {trained_on} vectors the IVF index was trained on"
+    return None
+
+def _load_serving_index(version, versions_dir):
+    """Writable serving index of an artifact version, or None"""
+    if version is None:
+        return None
+    path = artifact_paths(version, versions_dir)["index"]
+    if not os.path.exists(path):
+        return None
+    return faiss.read_index(path)
+
+def _update_serving_index(current, index_type, remove_ids, add_ids, add_vectors, final_embeddings, final_ids, versions_dir):
+    """Apply the delta to the current serving index by id; returns (index, trained_on, rebuilt)"""
+    manifest = (current or {}).get("manifest") or {}
+    index = _load_serving_index(current["version"] if current else None, versions_dir)
+    if index is not None and index.d != final_embeddings.shape[1]:
+        index = None
+    reason = _rebuild_reason(index, manifest, index_type, remove_ids, len(final_ids))
+    if reason:
+        print(f"🔁 Rebuilding the '{index_type}' serving index: {reason}")
+        return build_id_mapped_index(final_embeddings, final_ids, index_type), len(final_ids), True
+
+    if remove_ids:
+        index.remove_ids(np.array(remove_ids, dtype=np.int64))
+    if add_ids:
+        vectors = np.array(add_vectors, dtype=np.float32)
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            faiss.normalize_L2(vectors)
+        index.add_with_ids(vectors, np.array(add_ids, dtype=np.int64))
+    print(f"➕ Updated the '{index_type}' serving index in place (-{len(remove_ids)} / +{len(add_ids)} vectors)")
+    return configure_index(index), manifest.get("trained_on", len(final_ids)), False
+
+def sync_kg(driver, embed_model, index_type=None, versions_dir=None):
+    """Incrementally sync the cached KG artifacts with Neo4j.
+
+    Diffs the live graph against the current artifact set by content hash, embeds only
+    added or changed entries and applies the delta by id to the persisted ID-mapped
+    serving index. The index is only rebuilt when that is impossible (new index type,
+    removals from HNSW, IVF training drift). Writes a new versioned artifact set and
+    returns its name, or the current one when nothing changed.
+    """
+    from src.database.neo4j_client import fetch_variable_and_value_nodes
+    from src.retrieval.node_retrieval import build_entries
+
+    index_type = index_type or config.FAISS_INDEX_TYPE
+
+    print("⚙️ Fetching variables and values from Neo4j...")
+    new_entries = build_entries(fetch_variable_and_value_nodes(driver))
+    if not new_entries:
+        raise ValueError("Neo4j returned no Variable/Value nodes - refusing to sync an empty KG")
+    new_by_id = {entry_id(e): e for e in new_entries}
+
+    current = load_artifacts(versions_dir=versions_dir)
+    if current is None:
+        old_entries, old_ids, old_embeddings, parent = [], np.zeros(0, dtype=np.int64), None, None
+    else:
+        old_entries, old_embeddings, parent = current["entries"], current["embeddings"], current["version"]
+        old_ids = current["entry_ids"]
+        if old_ids is None:  # legacy cache files carry no ids
+            old_ids = np.array([entry_id(e) for e in old_entries], dtype=np.int64)
+
+    added, changed, removed = diff_entries(old_entries, new_entries)
+    print(f"🔍 Diff: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+    if current is not None and not (added or changed or removed):
+        print(f"✅ KG artifacts already up to date ({parent or 'legacy cache'})")
+        return parent
+
+    # Embed only what is new or changed
+    to_embed = added + changed
+    new_vectors = embed_model([new_by_id[i]['text'] for i in to_embed]) if to_embed else None
+
+    dim = old_embeddings.shape[1] if old_embeddings is not None and len(old_embeddings) else new_vectors.shape[1]
+    working = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    if len(old_ids):
+        vectors = np.array(old_embeddings, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        working.add_with_ids(vectors, old_ids)
+    if removed or changed:
+        working.remove_ids(np.array(removed + changed, dtype=np.int64))
+    if to_embed:
+        vectors = np.array(new_vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        working.add_with_ids(vectors, np.array(to_embed, dtype=np.int64))
+
+    # Entries, embeddings and entry ids are written row-aligned; the serving index resolves ids to rows
+    final_ids = faiss.vector_to_array(working.id_map).astype(np.int64)
+    final_embeddings = working.index.reconstruct_n(0, working.ntotal)
+    final_entries = [new_by_id[int(i)] for i in final_ids]
+    serving_index, trained_on, rebuilt = _update_serving_index(
+        current, index_type, removed + changed, to_embed, new_vectors, final_embeddings, final_ids, versions_dir)
+
+    version = write_version(final_entries, final_embeddings, final_ids, serving_index, {
+        "parent": parent,
+        "embed_model": getattr(embed_model, "model_name", None),
+        "index_type": index_type,
+        "id_mapped": True,
+        "index_rebuilt": rebuilt,
+        "trained_on": trained_on,
+        "entries": len(final_entries),
+        "dim": int(dim),
+        "added": len(added),
+        "changed": len(changed),
+        "removed": len(removed),
+        "kg_content_hash": kg_content_hash(final_entries),
+    }, versions_dir=versions_dir)
+    print(f"✅ Wrote KG artifact version {version} ({len(final_entries)} entries, {len(to_embed)} embedded)")
+
+    pruned = prune_versions(versions_dir=versions_dir)
+    if pruned:
+        print(f"🧹 Pruned old versions: {', '.join(pruned)}")
+    return version
+
+def rebuild_index(index_type=None, versions_dir=None):
+    """Write a new artifact version with the current entries and embeddings and a freshly built index.
+
+    Used to switch index type or retrain; nothing is fetched or embedded. Returns the new version name.
+    """
+    version = current_version(versions_dir)
+    current = load_artifacts(version, versions_dir) if version is not None else None
+    if current is None or current["entry_ids"] is None:
+        raise FileNotFoundError("No versioned KG artifact set found - run migrate or sync first")
+
+    index_type = index_type or config.FAISS_INDEX_TYPE
+    embeddings = np.array(current["embeddings"], dtype=np.float32)
+    entry_ids = current["entry_ids"]
+    manifest = dict(current["manifest"] or {}, parent=current["version"], index_type=index_type, id_mapped=True,
+                    index_rebuilt=True, trained_on=len(entry_ids), added=0, changed=0, removed=0)
+    for key in ("version", "created_at", "files"):
+        manifest.pop(key, None)
+
+    version = write_version(current["entries"], embeddings, entry_ids,
+                            build_id_mapped_index(embeddings, entry_ids, index_type), manifest, versions_dir=versions_dir)
+    print(f"✅ Wrote KG artifact version {version} with a rebuilt '{index_type}' index ({len(entry_ids)} entries)")
+
+    pruned = prune_versions(versions_dir=versions_dir)
+    if pruned:
+        print(f"🧹 Pruned old versions: {', '.join(pruned)}")
+    return version
+
+def migrate_legacy_cache(index_type=None, versions_dir=None):
+    """Convert the legacy pickle cache into a versioned, columnar, mmap-able artifact set.
+
+    No Neo4j or embedding calls are made - the cached entries and vectors are reused.
+    """
+    if current_version(versions_dir) is not None:
+        raise ValueError("A versioned artifact set already exists - use sync_kg to update it")
+
+    index_type = index_type or config.FAISS_INDEX_TYPE
+    legacy = load_artifacts(versions_dir=versions_dir)
+    if legacy is None:
+        raise FileNotFoundError("No legacy KG cache found to migrate")
+
+    entries = legacy["entries"]
+    embeddings = np.array(legacy["embeddings"], dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    entry_ids = np.array([entry_id(e) for e in entries], dtype=np.int64)
+
+    version = write_version(entries, embeddings, entry_ids, build_id_mapped_index(embeddings, entry_ids, index_type), {
+        "parent": None,
+        "migrated_from": "legacy cache",
+        "index_type": index_type,
+        "id_mapped": True,
+        "trained_on": len(entries),
+        "entries": len(entries),
+        "dim": int(embeddings.shape[1]),
+        "kg_content_hash": kg_content_hash(entries),
+    }, versions_dir=versions_dir)
+    print(f"✅ Migrated legacy cache to artifact version {version} ({len(entries)} entries)")
+    return version
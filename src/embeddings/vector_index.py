@@ -1,3 +1,4 @@
+import asyncio
 import faiss
 import numpy as np
 import os
@@ -5,80 +6,254 @@ from dotenv import load_dotenv
 import config
 from numpy import dot
 from numpy.linalg import norm
-from huggingface_hub import InferenceClient
 
 load_dotenv()
 
-def get_embedding_model():
-    """Return a function that uses HuggingFace's InferenceClient for embeddings"""
-    api_key = os.getenv("HF_API_KEY")
-    model_name = os.getenv("HF_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+def _hf_api_provider(model_name):
+    """Embed batches remotely with HuggingFace's InferenceClient (one request per batch)"""
+    from huggingface_hub import InferenceClient
 
-    # Initialize the client
     client = InferenceClient(
         model=model_name,
-        api_key=api_key
+        api_key=os.getenv("HF_API_KEY")
     )
 
+    def embed_batch(texts):
+        return client.feature_extraction(texts)
+
+    return embed_batch
+
+def _local_provider(model_name):
+    """Embed batches in-process on CPU with sentence-transformers (ONNX runtime when available)"""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError("The 'local' embedding backend requires sentence-transformers: "
+                          "pip install sentence-transformers[onnx]") from e
+
+    try:
+        model = SentenceTransformer(model_name, device=config.EMBED_LOCAL_DEVICE, backend="onnx")
+    except Exception:
+        # ONNX weights or onnxruntime unavailable - fall back to the torch backend
+        model = SentenceTransformer(model_name, device=config.EMBED_LOCAL_DEVICE)
+
+    def embed_batch(texts):
+        return model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+
+    return embed_batch
+
+def _hf_api_async_provider(model_name):
+    """Embed batches remotely with HuggingFace's AsyncInferenceClient"""
+    from huggingface_hub import AsyncInferenceClient
+
+    client = AsyncInferenceClient(
+        model=model_name,
+        api_key=os.getenv("HF_API_KEY")
+    )
+
+    async def embed_batch(texts):
+        return await client.feature_extraction(texts)
+
+    return embed_batch
+
+# Registered embedding backends: name -> factory(model_name) returning embed_batch(list[str]) -> (n, dim) array
+EMBEDDING_PROVIDERS = {
+    "hf_api": _hf_api_provider,
+    "local": _local_provider,
+}
+
+# Native async backends; backends without one run their sync embed_batch in a worker thread
+ASYNC_EMBEDDING_PROVIDERS = {
+    "hf_api": _hf_api_async_provider,
+}
+
+async def aembed(embed_model, texts):
+    """Await an embedding function's async variant, or run it in a worker thread"""
+    if hasattr(embed_model, "aembed"):
+        return await embed_model.aembed(texts)
+    return await asyncio.to_thread(embed_model, texts)
+
+def get_embedding_model(backend=None, model_name=None, use_cache=None):
+    """Return an embedding function backed by the configured provider.
+
+    The returned function accepts a single text (returns a 1-D vector) or a list of
+    texts (returns an (n, dim) matrix), issues one provider call per batch and always
+    yields float32. Unless disabled, it is wrapped in the persistent embedding cache.
+    """
+    backend = backend or os.getenv("EMBED_BACKEND", config.EMBED_BACKEND)
+    model_name = model_name or os.getenv("HF_MODEL_NAME", config.EMBED_MODEL_NAME)
+
+    if backend not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Available: {', '.join(EMBEDDING_PROVIDERS)}")
+    embed_batch = EMBEDDING_PROVIDERS[backend](model_name)
+    batch_size = config.EMBED_BATCH_SIZE
+
     def get_embeddings(texts):
-        """Get embeddings using HuggingFace InferenceClient"""
+        """Embed one text or a list of texts, one provider call per batch"""
         if not isinstance(texts, list):
             is_single = True
             texts = [texts]
         else:
             is_single = False
 
-        # Process in smaller batches for API stability
-        batch_size = 20
-        all_embeddings = []
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
 
+        batches = []
         for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-
-            # Get embeddings for the batch
-            batch_embeddings = []
-            for text in batch:
-                embedding = client.feature_extraction(text)
-                batch_embeddings.append(embedding)
-
-            all_embeddings.extend(batch_embeddings)
+            batch = np.asarray(embed_batch(texts[i:i+batch_size]), dtype=np.float32)
+            batches.append(batch.reshape(len(texts[i:i+batch_size]), -1))
 
-        # Convert to numpy array with the right shape
-        embeddings_array = np.array(all_embeddings)
+        embeddings_array = np.vstack(batches)
 
         # Return single vector if input was single text
         if is_single:
             return embeddings_array[0]
         return embeddings_array
 
+    if backend in ASYNC_EMBEDDING_PROVIDERS:
+        async_embed_batch = ASYNC_EMBEDDING_PROVIDERS[backend](model_name)
+    else:
+        async def async_embed_batch(batch):
+            return await asyncio.to_thread(embed_batch, batch)
+
+    async def aembed_texts(texts):
+        """Async variant of get_embeddings; batches are requested concurrently"""
+        if not isinstance(texts, list):
+            return (await aembed_texts([texts]))[0]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        chunks = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
+        batches = await asyncio.gather(*(async_embed_batch(chunk) for chunk in chunks))
+        return np.vstack([np.asarray(batch, dtype=np.float32).reshape(len(chunk), -1)
+                          for chunk, batch in zip(chunks, batches)])
+
+    get_embeddings.backend = backend
+    get_embeddings.model_name = model_name
+    get_embeddings.aembed = aembed_texts
+
+    if use_cache is None:
+        use_cache = config.EMBED_CACHE_ENABLED
+    if use_cache:
+        from src.embeddings.embedding_cache import EmbeddingCache, cached_embedding_model
+        return cached_embedding_model(get_embeddings, EmbeddingCache())
     return get_embeddings
 
-def create_faiss_index(entries, embed_model):
-    """Create a FAISS index from entries using external API"""
-    texts = [e['text'] for e in entries]
+def _ivf_nlist(n_vectors):
+    """Clip the configured IVF list count so every list gets enough training points"""
+    return max(1, min(config.IVF_NLIST, n_vectors // 39))
+
+def build_faiss_index(embeddings, index_type=None):
+    """Build a FAISS index of the given type over an embedding matrix.
+
+    Supported types: "flat_l2" (legacy), "flat_ip", "hnsw" and "ivf_flat". All but
+    "flat_l2" use inner product on L2-normalized vectors, i.e. cosine similarity.
+    """
+    index_type = index_type or config.FAISS_INDEX_TYPE
+    embeddings = _index_vectors(embeddings, index_type)
+    index = _empty_index(embeddings, index_type)
+    index.add(embeddings)
+    return configure_index(index)
+
+def build_id_mapped_index(embeddings, ids, index_type=None):
+    """Build an index of the given type whose search results are the given int64 ids.
+
+    Vectors can later be added or removed by id (see kg_sync) without rebuilding. IVF
+    indexes store ids natively; other types are wrapped in an IndexIDMap2.
+    """
+    index_type = index_type or config.FAISS_INDEX_TYPE
+    embeddings = _index_vectors(embeddings, index_type)
+    index = _empty_index(embeddings, index_type)
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    return configure_index(index)
 
-    # Process in batches to avoid API limits
-    batch_size = 20
-    all_embeddings = []
+def _index_vectors(embeddings, index_type):
+    """float32 rows as stored in an index of the given type (L2-normalized for inner product)"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if index_type != "flat_l2":
+        embeddings = embeddings.copy()
+        faiss.normalize_L2(embeddings)
+    return embeddings
 
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        batch_embeddings = embed_model(batch_texts)
+def _empty_index(embeddings, index_type):
+    """An empty (trained, for IVF) index of the given type for these vectors"""
+    n, dim = embeddings.shape
+    if index_type == "flat_l2":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "flat_ip":
+        return faiss.IndexFlatIP(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == "ivf_flat":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, _ivf_nlist(n), faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        return index
+    raise ValueError(f"Unknown FAISS index type '{index_type}'. "
+                     f"Available: flat_l2, flat_ip, hnsw, ivf_flat")
 
-        if i == 0:
-            # Initialize array with correct dimensions based on first batch
-            dim = batch_embeddings.shape[1]
-            all_embeddings = np.zeros((len(texts), dim))
+def configure_index(index):
+    """Apply the configured search-time parameters (efSearch / nprobe) to an index"""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config.HNSW_EF_SEARCH
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = config.IVF_NPROBE
+    return index
 
-        all_embeddings[i:i+len(batch_texts)] = batch_embeddings
 
-    # Create FAISS index
-    dim = all_embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(all_embeddings)
+class PositionalIndex:
+    """Search view of an ID-mapped index that returns row positions in the entry list.
 
+    Retrieval indexes entries by position; the serving index stores stable entry ids,
+    which are translated through the entry_ids column of the artifact set.
+    """
+
+    def __init__(self, index, entry_ids):
+        self.index = index
+        entry_ids = np.asarray(entry_ids, dtype=np.int64)
+        self._order = np.argsort(entry_ids)
+        self._sorted_ids = entry_ids[self._order]
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, queries, k):
+        distances, ids = self.index.search(queries, k)
+        slots = np.clip(np.searchsorted(self._sorted_ids, ids), 0, len(self._sorted_ids) - 1)
+        found = (ids >= 0) & (self._sorted_ids[slots] == ids)
+        return distances, np.where(found, self._order[slots], -1)
+
+def prepare_queries(index, query_embeddings):
+    """Return float32 query rows, L2-normalized when the index searches by inner product"""
+    queries = np.array(query_embeddings, dtype=np.float32).reshape(-1, index.d)
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        faiss.normalize_L2(queries)
+    return queries
+
+def create_faiss_index(entries, embed_model, index_type=None):
+    """Create a FAISS index from entries using the embedding provider"""
+    texts = [e['text'] for e in entries]
+
+    # The embedding function batches internally - one provider call per batch
+    all_embeddings = embed_model(texts)
+
+    index = build_faiss_index(all_embeddings, index_type)
     return index, all_embeddings
 
 def compute_cosine_similarity(vec1, vec2):
     """Compute cosine similarity between two vectors"""
     return dot(vec1, vec2) / (norm(vec1) * norm(vec2))
+
+def compute_cosine_similarities(query_vec, matrix):
+    """Compute cosine similarity between one vector and every row of a matrix"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    query_vec = np.asarray(query_vec, dtype=np.float32)
+    denom = norm(matrix, axis=1) * norm(query_vec)
+    denom[denom == 0] = 1.0
+    return (matrix @ query_vec) / denom
@@ -1,50 +1,126 @@
 import pandas as pd
 import numpy as np
 import json
-
-def execute_plan(initial_df, plan_steps, user_query, llm_model, max_retries=2, verbose=True):
-    state = {"df": initial_df.copy()}
+import re
+import config
+from src.generation.context_budget import budget_react_log
+from src.execution.step_cache import PlanMemo
+from src.data.dataset_cache import column_buffer
+
+FAST_MODE_REFLECTION = "Reflection skipped (fast mode); step completed without errors."
+
+# Plan state shares the loaded dataset through shallow copies. This relies on copy-on-write, which
+# is always on from pandas 3 (see requirements.txt), to keep in-place writes out of the shared frame
+
+def execute_plan(initial_df, plan_steps, user_query, llm_model, max_retries=2, verbose=True, fast=None, on_event=None,
+                 sandbox=None, dataset_version=None, bitmap_index=None):
+    """Run plan steps ReAct-style and synthesize a final response.
+
+    In fast mode each step gets its thought and code from one structured JSON call,
+    LLM reflections are only requested for steps that needed recovery, and the final
+    variable check is skipped. The return value is the same in both modes.
+
+    With `on_event(event, data)`, a "step" event follows every step and the final
+    synthesis is streamed as "token" events. With a SandboxPool, generated code runs
+    in an isolated worker process that holds the plan's state.
+
+    In-process, `df` starts as a shallow copy of `initial_df`: columns are only copied
+    when generated code writes to them, and frames derived by steps are the only new
+    allocations. Their size is reported as a "memory" event at the end of the plan.
+
+    Given the dataset version, in-process step results are memoized across requests:
+    a step whose code and inputs match an earlier one reuses its outputs and reflection.
+    With a BitmapIndex, generated code can call bitmap_filter/bitmap_value_counts.
+    """
+    if sandbox is not None:
+        tools = bitmap_index.describe() if bitmap_index is not None and sandbox.bitmap_index is not None else ""
+        with sandbox.session() as session:
+            return _execute_plan(session, plan_steps, user_query, llm_model, max_retries, verbose, fast, on_event,
+                                 tools=tools)
+    memo = PlanMemo(dataset_version) if config.STEP_CACHE_ENABLED and dataset_version else None
+    helpers = bitmap_index.helpers(initial_df) if bitmap_index is not None else None
+    return _execute_plan({"df": initial_df.copy(deep=False)}, plan_steps, user_query, llm_model, max_retries, verbose,
+                         fast, on_event, base_df=initial_df, memo=memo, helpers=helpers,
+                         tools=bitmap_index.describe() if bitmap_index is not None else "")
+
+def _execute_plan(state, plan_steps, user_query, llm_model, max_retries, verbose, fast, on_event, base_df=None, memo=None,
+                  helpers=None, tools=""):
+    fast = config.PLAN_EXECUTION_FAST_MODE if fast is None else fast
     completed_steps, failed_steps = [], []
     react_log = {}
+    base_buffers = _frame_buffers(base_df) if base_df is not None else None
+    peak_bytes = 0
 
     for i, step in enumerate(plan_steps):
         if i > 0 and plan_steps[i - 1]["name"] in failed_steps:
             if verbose:
                 print(f"⚠️ Skipping step {i + 1} ({step['name']}) due to previous failure.")
             continue
-        success = _execute_step(step, state, user_query, llm_model, completed_steps, failed_steps, react_log, max_retries, verbose)
+        success = _execute_step(step, state, user_query, llm_model, completed_steps, failed_steps, react_log, max_retries, verbose,
+                                fast=fast, memo=memo, helpers=helpers, tools=tools)
         if not success and verbose:
             print(f"⚠️ Halting execution at step '{step['name']}' due to repeated failure.")
-
-    final_check = _run_final_check(llm_model, user_query, completed_steps, failed_steps, react_log)
-    print(final_check)
-
-    final_response = _synthesize_final_response(llm_model, user_query, completed_steps, failed_steps, react_log)
+        state_bytes = _state_bytes(state, base_buffers) if base_buffers is not None else None
+        peak_bytes = max(peak_bytes, state_bytes or 0)
+        if on_event is not None:
+            on_event("step", {"name": step["name"], "status": "completed" if success else "failed",
+                              "result": react_log.get(step["name"], {}).get("result", "")[:500],
+                              "state_bytes": state_bytes})
+
+    if base_buffers is not None:
+        memory = {"base_bytes": int(base_df.memory_usage(index=False).sum()), "peak_state_bytes": peak_bytes,
+                  "final_state_bytes": _state_bytes(state, base_buffers)}
+        if verbose:
+            print(f"🧮 Plan state memory: peak {peak_bytes / 1e6:.1f} MB materialized on top of the shared "
+                  f"{memory['base_bytes'] / 1e6:.1f} MB dataset")
+        if on_event is not None:
+            on_event("memory", memory)
+
+    # The final check is informational only (printed, never returned), so fast mode skips it
+    if not fast:
+        final_check = _run_final_check(llm_model, user_query, completed_steps, failed_steps, react_log)
+        print(final_check)
+
+    on_token = (lambda text: on_event("token", {"text": text})) if on_event is not None else None
+    final_response = _synthesize_final_response(llm_model, user_query, completed_steps, failed_steps, react_log, on_token=on_token)
     return final_response, react_log
 
-def _execute_step(step, state, user_query, llm_model, completed_steps, failed_steps, react_log, max_retries, verbose, attempt=1):
+def _execute_step(step, state, user_query, llm_model, completed_steps, failed_steps, react_log, max_retries, verbose, attempt=1, fast=False,
+                  memo=None, helpers=None, tools=""):
     step_name, instruction = step["name"], step["instruction"]
     _print_step_header(step_name, len(completed_steps) + 1, attempt if attempt > 1 else None, verbose)
-    state_description = _get_state_description(state)
+    state_description = _describe_state(state) + (f"\n\n{tools}" if tools else "")
 
-    thought = llm_model.generate_content(_thought_prompt(user_query, step_name, instruction)).text.strip()
-    code = llm_model.generate_content(_code_prompt(user_query, thought, instruction, state_description)).text.strip()
-    code = code.replace("```python", "").replace("```", "").strip()
+    if fast:
+        thought, code = _parse_thought_and_code(llm_model.generate_content(
+            _thought_and_code_prompt(user_query, step_name, instruction, state_description),
+            generation_config={"response_mime_type": "application/json"}).text)
+    else:
+        thought = llm_model.generate_content(_thought_prompt(user_query, step_name, instruction)).text.strip()
+        code = llm_model.generate_content(_code_prompt(user_query, thought, instruction, state_description)).text.strip()
+    code = _strip_code_fences(code)
 
     try:
-        result = _run_code(code, state)
+        result, cached = _run_memoized(code, state, memo, verbose, helpers)
         if result is None:
             raise ValueError("Code did not produce a 'result' variable")
 
-        state["result"] = result
-        reflection = llm_model.generate_content(
-            _reflection_prompt(user_query, step_name, instruction, code, result)).text.strip()
+        if fast:
+            reflection = FAST_MODE_REFLECTION
+        elif cached is not None and cached.reflection:
+            reflection = cached.reflection
+        else:
+            reflection = llm_model.generate_content(
+                _reflection_prompt(user_query, step_name, instruction, code, result)).text.strip()
+            if cached is not None:
+                cached.reflection = reflection
         _log_step(react_log, step_name, thought, instruction, code, result, reflection, verbose)
 
         if isinstance(result, pd.DataFrame) and result.empty and "empty" not in instruction.lower() and attempt < max_retries:
             if verbose:
                 print("⚠️ Step produced an empty DataFrame. Retrying with adjusted approach...")
-            return _execute_step(step, state, user_query, llm_model, completed_steps, failed_steps, react_log, max_retries, verbose, attempt + 1)
+            return _execute_step(step, state, user_query, llm_model, completed_steps, failed_steps, react_log, max_retries, verbose, attempt + 1,
+                                 fast=fast, memo=memo, helpers=helpers, tools=tools)
 
         completed_steps.append(step_name)
         return True
@@ -56,15 +132,19 @@ def _execute_step(step, state, user_query, llm_model, completed_steps, failed_st
         if attempt < max_retries:
             recovery_code = llm_model.generate_content(
                 _recovery_prompt(str(e), code, state_description, instruction)).text.strip()
-            recovery_code = recovery_code.replace("```python", "").replace("```", "").strip()
+            recovery_code = _strip_code_fences(recovery_code)
             try:
-                result = _run_code(recovery_code, state)
+                result, cached = _run_memoized(recovery_code, state, memo, verbose, helpers)
                 if result is None:
                     raise ValueError("Recovery code did not produce a 'result' variable")
 
-                state["result"] = result
-                reflection = llm_model.generate_content(
-                    _reflection_prompt(user_query, step_name, instruction, recovery_code, result)).text.strip()
+                if cached is not None and cached.reflection:
+                    reflection = cached.reflection
+                else:
+                    reflection = llm_model.generate_content(
+                        _reflection_prompt(user_query, step_name, instruction, recovery_code, result)).text.strip()
+                    if cached is not None:
+                        cached.reflection = reflection
                 _log_step(react_log, step_name, thought, instruction, recovery_code, result, reflection, verbose)
                 completed_steps.append(step_name)
                 return True
@@ -82,13 +162,80 @@ def _execute_step(step, state, user_query, llm_model, completed_steps, failed_st
             failed_steps.append(step_name)
             return False
 
-def _run_code(code, state):
+def _strip_code_fences(code):
+    return code.replace("```python", "").replace("```json", "").replace("```", "").strip()
+
+def _parse_thought_and_code(text):
+    """Read {"thought", "code"} from a fused response; unparseable output is treated as bare code"""
+    cleaned = _strip_code_fences(text)
+    match = re.search(r"\{.*\}", cleaned, re.DOTALL)
+    try:
+        parsed = json.loads(match.group(0) if match else cleaned)
+        return str(parsed.get("thought", "")).strip(), str(parsed.get("code", "")).strip()
+    except (json.JSONDecodeError, AttributeError):
+        return "", cleaned
+
+def _run_code(code, state, helpers=None):
     local_scope = dict(state)
-    exec(code, {"pd": pd, "np": np}, local_scope)
+    exec(code, {"pd": pd, "np": np, **(helpers or {})}, local_scope)
     for var_name, var_value in local_scope.items():
         if var_name != "__builtins__" and var_name not in state:
             state[var_name] = var_value
-    return local_scope.get("result")
+    result = local_scope.get("result")
+    if result is not None:
+        state["result"] = result
+    return result
+
+def _run_step_code(code, state, helpers=None):
+    """Run step code against the in-process state dict or a sandbox session (which has its own helpers)"""
+    if isinstance(state, dict):
+        return _run_code(code, state, helpers)
+    return state.run_code(code)
+
+def _run_memoized(code, state, memo, verbose, helpers=None):
+    """Run step code, or replay its outputs when the same code already ran on the same inputs.
+
+    Returns (result, cache entry); the entry is None when the step cannot be cached.
+    """
+    if memo is None:
+        return _run_step_code(code, state, helpers), None
+    key = memo.key(code, state)
+    cached = memo.get(key)
+    if cached is not None:
+        if verbose:
+            print("♻️ Step result reused from the step cache")
+        return memo.apply(cached, state), cached
+
+    before = set(state)
+    try:
+        result = _run_step_code(code, state, helpers)
+    except Exception:
+        memo.forget(code)
+        raise
+    return result, memo.record(key, code, state, before, result) if result is not None else None
+
+def _describe_state(state):
+    if isinstance(state, dict):
+        return _get_state_description(state)
+    return state.describe()
+
+def _frame_buffers(df):
+    return {name: column_buffer(df[name]) for name in df.columns}
+
+def _state_bytes(state, base_buffers):
+    """Bytes held by DataFrames/Series in the plan state that do not share memory with the base frame"""
+    total, seen = 0, set()
+    for value in state.values():
+        if id(value) in seen or not isinstance(value, (pd.DataFrame, pd.Series)):
+            continue
+        seen.add(id(value))
+        columns = value.items() if isinstance(value, pd.DataFrame) else [(value.name, value)]
+        for name, column in columns:
+            buffer, base = column_buffer(column), base_buffers.get(name)
+            if buffer is not None and base is not None and np.may_share_memory(buffer, base):
+                continue
+            total += int(column.memory_usage(index=False))
+    return total
 
 def _print_step_header(step_name, step_num, attempt, verbose):
     if verbose:
@@ -155,6 +302,32 @@ Focus only on what the instruction asks for.
 Return ONLY executable Python code with no markdown formatting or explanation.
 """
 
+def _thought_and_code_prompt(user_query, step_name, instruction, state_description):
+    return f"""
+You are a biomedical data analyst and Python expert who writes correct pandas code to analyze biomedical data.
+
+USER QUERY: {user_query}
+STEP: {step_name}
+INSTRUCTION: {instruction}
+
+CURRENT STATE:
+{state_description}
+
+First, write a concise paragraph explaining what this step is trying to achieve in the context of the user's query.
+Then write Python code that:
+1. Uses the variables from the current state - no need to redefine them
+2. Performs the analysis described in the instruction
+3. Stores the result in a variable called 'result' (please never show full rows, use len or only top 3 rows)
+4. If creating a new DataFrame named in the instruction (e.g., "Create a DataFrame called df_filtered"), define it as indicated and also assign it to a variable with that exact name
+5. Follow ONLY what is in the instructions. No extra steps as it might mess up following steps.
+
+You can import things only if you are 100% certain they exist.
+Do not add print statements or comments to the code.
+
+Respond ONLY with a JSON object of the form:
+{{"thought": "<your paragraph>", "code": "<executable Python code, no markdown>"}}
+"""
+
 def _recovery_prompt(error_msg, code, state_description, instruction):
     return f"""
 You are a Python expert fixing code that failed with this error: {error_msg}
@@ -207,7 +380,7 @@ EXECUTION SUMMARY:
 - Failed steps: {', '.join(failed_steps) if failed_steps else 'None'}
 
 DETAILED EXECUTION LOG:
-{json.dumps(react_log, indent=2)}
+{budget_react_log(react_log, user_query, prompt_name="final_check")}
 
 Provide a comprehensive summary that includes:
 1. Any variables that are needed to provide a useful answer. Make an array of missing variables names. (Example: [operativedeath, bmi, complication1])
@@ -218,7 +391,19 @@ DO not explain anything or add extra text.
 """
     return llm_model.generate_content(prompt).text.strip()
 
-def _synthesize_final_response(llm_model, user_query, completed_steps, failed_steps, react_log):
+def _stream_text(llm_model, prompt, on_token):
+    """Generate with Gemini streaming, passing each text chunk to on_token; returns the full text"""
+    parts = []
+    for chunk in llm_model.generate_content(prompt, stream=True):
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunk without text parts (e.g. only safety metadata)
+        parts.append(text)
+        on_token(text)
+    return "".join(parts).strip()
+
+def _synthesize_final_response(llm_model, user_query, completed_steps, failed_steps, react_log, on_token=None):
     prompt = f"""
 You are a biomedical data analyst synthesizing results from multiple analysis steps.
 
@@ -229,7 +414,7 @@ EXECUTION SUMMARY:
 - Failed steps: {', '.join(failed_steps) if failed_steps else 'None'}
 
 DETAILED EXECUTION LOG:
-{json.dumps(react_log, indent=2)}
+{budget_react_log(react_log, user_query, prompt_name="synthesis")}
 
 Provide a comprehensive summary that includes:
 1. What steps were performed and their purpose
@@ -239,4 +424,6 @@ Provide a comprehensive summary that includes:
 
 Be thorough but focus on answering the user's original question.
 """
+    if on_token is not None:
+        return _stream_text(llm_model, prompt, on_token)
     return llm_model.generate_content(prompt).text.strip()
@@ -16,9 +16,8 @@ def extract_clean_json_array(text):
                 print("⚠️ Could not parse even with literal_eval:", e)
     return []
 
-def generate_plan(llm_model, answer_text, column_context, question, value_dict):
-    """Generate a structured execution plan from a reasoning answer"""
-    plan_prompt = f"""
+def _plan_prompt(answer_text, column_context, question, value_dict):
+    return f"""
 You are an assistant generating a structured plan to analyze biomedical patient data in a pandas DataFrame.
 
 Below is:
@@ -52,5 +51,19 @@ Each step must include:
 
 ⚠️ Do not return any explanation. Respond ONLY with the JSON array.
 """
-    response = llm_model.generate_content(plan_prompt).text.strip()
+
+def generate_plan(llm_model, answer_text, column_context, question, value_dict):
+    """Generate a structured execution plan from a reasoning answer"""
+    from src.generation.gemini_client import generate_text
+
+    plan_prompt = _plan_prompt(answer_text, column_context, question, value_dict)
+    response = generate_text(llm_model, plan_prompt, cache_stage="plan").strip()
     return extract_clean_json_array(response)
+
+async def generate_plan_async(llm_model, answer_text, column_context, question, value_dict):
+    """Async variant of generate_plan"""
+    from src.generation.gemini_client import generate_text_async
+
+    response = await generate_text_async(llm_model, _plan_prompt(answer_text, column_context, question, value_dict),
+                                         cache_stage="plan")
+    return extract_clean_json_array(response.strip())
@@ -0,0 +1,330 @@
+import multiprocessing as mp
+import pickle
+import queue
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import config
+
+
+class SandboxStepError(Exception):
+    """An exception raised by generated code inside a sandbox worker (message preserved)"""
+
+
+class CompactResult:
+    """Text summary of a step result that is too large to send back to the server process"""
+
+    def __init__(self, text, kind, shape=None):
+        self.text = text
+        self.kind = kind
+        self.shape = shape
+
+    def __str__(self):
+        return self.text
+
+    __repr__ = __str__
+
+
+def _open_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrame:
+    """A DataFrame laid out in one shared-memory block so workers map it instead of unpickling it.
+
+    Numeric, boolean and datetime columns are stored as raw buffers and categorical
+    columns as their codes; both are attached zero-copy (read-only). Other columns are
+    stored as factorized int32 codes plus their (small) set of unique values.
+    """
+
+    def __init__(self, df):
+        layout, chunks, offset = [], [], 0
+        for name in df.columns:
+            column = df[name]
+            if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM":
+                data = np.ascontiguousarray(column.to_numpy())
+                layout.append({"name": name, "kind": "raw", "dtype": data.dtype.str, "offset": offset, "length": len(data)})
+            elif isinstance(column.dtype, pd.CategoricalDtype):
+                data = np.ascontiguousarray(column.cat.codes.to_numpy())
+                layout.append({"name": name, "kind": "categorical", "dtype": data.dtype.str, "categories": column.cat.categories,
+                               "ordered": column.cat.ordered, "offset": offset, "length": len(data)})
+            else:
+                codes, uniques = pd.factorize(column, use_na_sentinel=True)
+                data = codes.astype(np.int32)
+                layout.append({"name": name, "kind": "codes", "dtype": str(column.dtype), "uniques": uniques,
+                               "offset": offset, "length": len(data)})
+            chunks.append(data)
+            offset += data.nbytes
+            offset += (-offset) % 16  # keep every column aligned
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for spec, data in zip(layout, chunks):
+            np.ndarray(data.shape, dtype=data.dtype, buffer=self.shm.buf, offset=spec["offset"])[:] = data
+
+        index = df.index
+        self.spec = {
+            "shm_name": self.shm.name,
+            "columns": layout,
+            "index": None if isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1 else index,
+            "rows": len(df),
+        }
+
+    @staticmethod
+    def attach(spec):
+        """Rebuild the DataFrame in a worker; returns (DataFrame, SharedMemory handle to keep alive)"""
+        shm = _open_shared_memory(spec["shm_name"])
+        columns = {}
+        for col in spec["columns"]:
+            if col["kind"] == "raw":
+                data = np.ndarray((col["length"],), dtype=np.dtype(col["dtype"]), buffer=shm.buf, offset=col["offset"])
+                data.flags.writeable = False
+                columns[col["name"]] = data
+            elif col["kind"] == "categorical":
+                codes = np.ndarray((col["length"],), dtype=np.dtype(col["dtype"]), buffer=shm.buf, offset=col["offset"])
+                codes.flags.writeable = False
+                columns[col["name"]] = pd.Categorical.from_codes(codes, col["categories"], ordered=col["ordered"])
+            else:
+                codes = np.ndarray((col["length"],), dtype=np.int32, buffer=shm.buf, offset=col["offset"])
+                uniques = np.asarray(col["uniques"], dtype=object)
+                valid = codes >= 0
+                values = np.full(col["length"], np.nan, dtype=object)
+                values[valid] = uniques[codes[valid]]
+                columns[col["name"]] = pd.array(values, dtype=col["dtype"]) if col["dtype"] != "object" else values
+        index = spec["index"] if spec["index"] is not None else pd.RangeIndex(spec["rows"])
+        return pd.DataFrame(columns, index=index, copy=False), shm
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _compact(result, max_bytes):
+    """What a worker sends back for a step result: small objects as-is, large ones as text"""
+    if isinstance(result, (pd.DataFrame, pd.Series)) and not result.empty:
+        return CompactResult(str(result), type(result).__name__, result.shape)
+    try:
+        payload = pickle.dumps(result)
+    except Exception:
+        return CompactResult(str(result), type(result).__name__)
+    if len(payload) > max_bytes:
+        return CompactResult(str(result)[:max_bytes], type(result).__name__)
+    return result
+
+
+def _worker_main(conn, spec, memory_limit_mb, max_result_bytes, bitmap_dir=None):
+    """Sandbox worker loop: owns one session's state and runs generated code against it"""
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass  # not supported on this platform
+
+    from src.execution.plan_execution import _run_code, _get_state_description
+
+    base_df, shm = SharedFrame.attach(spec)
+    helpers = None
+    if bitmap_dir is not None:
+        from src.data.bitmap_index import BitmapIndex
+        index = BitmapIndex.load(bitmap_dir)  # memory-mapped, so workers share its pages
+        helpers = index.helpers(base_df) if index is not None else None
+    # Each session sees a shallow copy: copy-on-write copies a column only when code writes to it,
+    # so the read-only shared buffers are never modified
+    state = {"df": base_df.copy(deep=False)}
+    conn.send(("ready",))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        command = message[0]
+        if command == "run":
+            try:
+                result = _run_code(message[1], state, helpers)
+                conn.send(("ok", _compact(result, max_result_bytes), _get_state_description(state)))
+            except MemoryError:
+                conn.send(("error", f"Step exceeded the sandbox memory limit of {memory_limit_mb} MB"))
+            except Exception as e:
+                conn.send(("error", str(e)))
+        elif command == "describe":
+            conn.send(("ok", _get_state_description(state)))
+        elif command == "reset":
+            state = {"df": base_df.copy(deep=False)}
+            conn.send(("ok",))
+        elif command == "exit":
+            break
+    shm.close()
+
+
+class SandboxWorker:
+    """Handle on one pre-warmed worker process"""
+
+    def __init__(self, context, spec, bitmap_dir=None):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, spec, config.SANDBOX_MEMORY_LIMIT_MB, config.SANDBOX_MAX_RESULT_BYTES, bitmap_dir),
+            daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def wait_ready(self, timeout):
+        if not self.conn.poll(timeout):
+            raise TimeoutError("Sandbox worker did not start in time")
+        self.conn.recv()
+        return self
+
+    def call(self, message, timeout):
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"Step exceeded the sandbox time limit of {timeout:g}s")
+        return self.conn.recv()
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxSession:
+    """Plan-execution state living in one sandbox worker.
+
+    Used by execute_plan in place of the state dict. Code runs in the worker with a
+    wall-clock limit; a worker that times out or dies is replaced and the code of the
+    steps that already succeeded is replayed, so later steps still see their variables.
+    """
+
+    def __init__(self, pool, worker):
+        self.pool = pool
+        self.worker = worker
+        self.history = []
+        self._description = None
+
+    def run_code(self, code, timeout=None):
+        timeout = timeout or config.SANDBOX_STEP_TIMEOUT_SECONDS
+        try:
+            reply = self.worker.call(("run", code), timeout)
+        except (TimeoutError, EOFError, OSError) as e:
+            self._restart()
+            raise SandboxStepError(str(e) if isinstance(e, TimeoutError) else "Sandbox worker died while running the step")
+
+        if reply[0] == "error":
+            raise SandboxStepError(reply[1])
+        _, result, self._description = reply
+        self.history.append(code)
+        return result
+
+    def describe(self):
+        if self._description is None:
+            self._description = self.worker.call(("describe",), config.SANDBOX_STEP_TIMEOUT_SECONDS)[1]
+        return self._description
+
+    def _restart(self):
+        self.pool.count_restart()
+        self.pool.retire(self.worker)
+        self.worker = self.pool.new_worker()
+        for code in self.history:
+            try:
+                self.worker.call(("run", code), config.SANDBOX_STEP_TIMEOUT_SECONDS)
+            except Exception as e:
+                print(f"⚠️ Sandbox replay failed, later steps may miss state: {e}")
+                break
+        self._description = None
+
+
+class SandboxPool:
+    """Pool of pre-warmed worker processes that share the dataset through shared memory"""
+
+    def __init__(self, df, size=None, start_method=None, bitmap_index=None):
+        self.size = size or config.SANDBOX_WORKERS
+        self.frame = SharedFrame(df)
+        # Workers load a saved bitmap index from its directory; one that was never saved is not shared
+        self.bitmap_index = bitmap_index if bitmap_index is not None and bitmap_index.directory else None
+        self.context = mp.get_context(start_method or config.SANDBOX_START_METHOD)
+        if self.context.get_start_method() == "forkserver":
+            self.context.set_forkserver_preload(["src.execution.sandbox"])
+        self._idle = queue.Queue()
+        self._workers = set()  # every live worker, idle or checked out
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {"sessions": 0, "restarts": 0}
+
+    def _spawn(self):
+        worker = SandboxWorker(self.context, self.frame.spec, self._bitmap_dir())
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def new_worker(self):
+        return self._spawn().wait_ready(config.SANDBOX_START_TIMEOUT_SECONDS)
+
+    def retire(self, worker):
+        """Kill a worker and stop tracking it"""
+        with self._lock:
+            self._workers.discard(worker)
+        worker.kill()
+
+    def _bitmap_dir(self):
+        return self.bitmap_index.directory if self.bitmap_index is not None else None
+
+    def start(self):
+        """Start all workers (in parallel) and wait until they have mapped the dataset"""
+        workers = [self._spawn() for _ in range(self.size)]
+        for worker in workers:
+            self._idle.put(worker.wait_ready(config.SANDBOX_START_TIMEOUT_SECONDS))
+        return self
+
+    @contextmanager
+    def session(self):
+        """Check out a worker for one plan execution; it is reset and returned afterwards"""
+        worker = self._idle.get()
+        session = SandboxSession(self, worker)
+        with self._lock:
+            self._stats["sessions"] += 1
+        try:
+            yield session
+        finally:
+            try:
+                session.worker.call(("reset",), config.SANDBOX_STEP_TIMEOUT_SECONDS)
+                self._idle.put(session.worker)
+            except Exception:
+                self.retire(session.worker)
+                if not self._closed:
+                    self.count_restart()
+                    self._idle.put(self.new_worker())
+
+    def count_restart(self):
+        with self._lock:
+            self._stats["restarts"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, workers=self.size, idle=self._idle.qsize(), shared_bytes=self.frame.shm.size)
+
+    def close(self):
+        """Stop every worker, including those still checked out by a session, and free the shared frame"""
+        with self._lock:
+            self._closed = True
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            try:
+                worker.conn.send(("exit",))
+            except OSError:
+                pass
+            worker.kill()
+        self.frame.close()
@@ -0,0 +1,224 @@
+import ast
+import copy
+import hashlib
+import pickle
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import config
+
+# Method calls that modify their receiver, and calls whose output is not a function of the inputs
+MUTATING_METHODS = {"append", "extend", "insert", "pop", "popitem", "remove", "clear", "update", "setdefault",
+                    "sort", "reverse", "add", "discard", "__setitem__", "__delitem__"}
+NONDETERMINISTIC_CALLS = {"sample", "shuffle", "permutation", "rand", "randn", "randint", "random", "choice",
+                          "now", "today", "default_rng"}
+
+
+class CachedStep:
+    """Outputs of one executed step: new state variables, the result and (once known) its reflection"""
+
+    def __init__(self, key, outputs, result, nbytes, reflection=None):
+        self.key = key
+        self.outputs = outputs
+        self.result = result
+        self.nbytes = nbytes
+        self.reflection = reflection
+
+
+class StepResultCache:
+    """Process-wide LRU of step outputs bounded by their approximate size in bytes"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or config.STEP_CACHE_MAX_BYTES
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "uncacheable": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key).nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
+
+    def count_uncacheable(self):
+        with self._lock:
+            self._stats["uncacheable"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats, items=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes,
+                        hit_rate=self._stats["hits"] / lookups if lookups else 0.0)
+
+
+_step_cache = None
+_step_cache_lock = threading.Lock()
+
+def get_step_cache():
+    """Process-wide step result cache, shared by concurrent plan executions"""
+    global _step_cache
+    with _step_cache_lock:
+        if _step_cache is None:
+            _step_cache = StepResultCache()
+        return _step_cache
+
+
+class _Uncacheable(Exception):
+    pass
+
+def _detach(value):
+    """A copy of a step output that later in-place writes on either side cannot affect"""
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return value.copy(deep=False)  # copy-on-write: shares buffers until one side writes
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        return value
+    if isinstance(value, (list, tuple, dict, set, np.ndarray)):
+        return copy.deepcopy(value)
+    raise _Uncacheable(type(value).__name__)
+
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def _is_mutating_target(target):
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return any(_is_mutating_target(t) for t in target.elts)
+    if isinstance(target, ast.Starred):
+        return _is_mutating_target(target.value)
+    return isinstance(target, (ast.Subscript, ast.Attribute))
+
+def analyze_code(code):
+    """Return (normalized code, loaded names, assigned names, cacheable) for step code.
+
+    The normalized form is the AST dump, so formatting and comments do not change it.
+    Code that writes into existing objects, uses randomness/clocks or binds names through
+    import/def/class is not cacheable.
+    """
+    tree = ast.parse(code)
+    loads, stores, cacheable = set(), set(), True
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            (loads if isinstance(node.ctx, ast.Load) else stores).add(node.id)
+        elif isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Delete)):
+            targets = node.targets if isinstance(node, (ast.Assign, ast.Delete)) else [node.target]
+            if any(_is_mutating_target(t) for t in targets):
+                cacheable = False
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if name in MUTATING_METHODS or name in NONDETERMINISTIC_CALLS:
+                cacheable = False
+            for keyword in node.keywords:
+                if keyword.arg == "inplace" and not (isinstance(keyword.value, ast.Constant) and keyword.value.value is False):
+                    cacheable = False
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            cacheable = False
+        elif isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            cacheable = False  # binds names outside ast.Name stores, which a cache hit could not replay
+    return ast.dump(tree), loads, stores, cacheable
+
+
+class PlanMemo:
+    """Per-plan view of the step cache that tracks where each state variable came from.
+
+    A variable's fingerprint is the dataset version for the initial `df` and the cache
+    key of the step that produced it otherwise, so a step key identifies the step's
+    inputs without hashing DataFrames.
+    """
+
+    def __init__(self, dataset_version, cache=None):
+        self.dataset_version = dataset_version
+        self.cache = cache or get_step_cache()
+        self.lineage = {"df": f"dataset:{dataset_version}"}
+
+    def _fingerprint(self, name):
+        if name not in self.lineage:
+            self.lineage[name] = uuid.uuid4().hex  # produced outside the cache: unique to this plan
+        return self.lineage[name]
+
+    def key(self, code, state):
+        """Cache key for running the code against the state, or None when it cannot be cached"""
+        try:
+            normalized, loads, _, cacheable = analyze_code(code)
+        except SyntaxError:
+            return None
+        if not cacheable:
+            self.cache.count_uncacheable()
+            return None
+        inputs = sorted(f"{name}={self._fingerprint(name)}" for name in loads if name in state)
+        payload = "\n".join([self.dataset_version, normalized, *inputs])
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self.cache.get(key) if key is not None else None
+
+    def apply(self, entry, state):
+        """Replay a cached step into the state the way _run_code would have; returns its result"""
+        for name, value in entry.outputs.items():
+            if name not in state:
+                state[name] = _detach(value)
+                self.lineage[name] = entry.key + ":" + name
+        state["result"] = _detach(entry.result)
+        self.lineage["result"] = entry.key + ":result"
+        return state["result"]
+
+    def record(self, key, code, state, before, result):
+        """Store a just-executed step under its key (None when uncacheable); returns the entry or None"""
+        try:
+            _, loads, stores, _ = analyze_code(code)
+        except SyntaxError:
+            loads, stores = set(), set()
+        new_names = [name for name in stores if name in state and name not in before and name != "result"]
+        if key is None:
+            # Anything the code touched may have changed: give it a fresh identity
+            for name in loads | set(new_names) | {"result"}:
+                self.lineage.pop(name, None)
+            return None
+
+        for name in new_names:
+            self.lineage[name] = key + ":" + name
+        self.lineage["result"] = key + ":result"
+        try:
+            outputs = {name: _detach(state[name]) for name in new_names}
+            entry = CachedStep(key, outputs, _detach(result), sum(_nbytes(v) for v in outputs.values()) + _nbytes(result))
+        except _Uncacheable:
+            self.cache.count_uncacheable()
+            return None
+        self.cache.put(key, entry)
+        return entry
+
+    def forget(self, code):
+        """Reset the identity of everything a failed step may have modified"""
+        self.record(None, code, {}, set(), None)
@@ -1,57 +1,108 @@
-def format_context(results, driver):
-    """Format context for presentation to LLM"""
-    context_blocks = []
-
-    for entry, dist in results:
-        if entry['type'] == 'value':
-            cypher_val = """
-            MATCH (v:Variable {name: $var_name})-[:HAS_VALUE]->(val:Value {label: $val})
-            OPTIONAL MATCH (v)-[r]->(connected)
-            RETURN type(r) as rel_type, connected.name as connected_name, labels(connected) as labels
-            """
-            with driver.session() as session:
-                result = session.run(cypher_val, {"var_name": entry["parent_var"], "val": entry["label"]})
-                records = list(result)  # ✅ Cache before reuse
-                rels = [record.data() for record in records]
-
-            rel_txt = "\n".join([
-                f"➪ [{r['rel_type']}] → {r['connected_name']} ({', '.join(r['labels'])})"
-                for r in rels if r['connected_name']
-            ])
-
-            block = (f"Value '{entry['label']}' from Variable '{entry['parent_var']}' "
-                     f"(Category: {entry.get('category','?')}, score={dist:.2f})\n{rel_txt}")
-
-        else:  # 'variable'
-            cypher_var = """
-            MATCH (v:Variable {name: $var_name})
-            OPTIONAL MATCH (v)-[r]->(connected)
-            RETURN type(r) as rel_type, connected.name as connected_name, labels(connected) as labels
-            """
-            with driver.session() as session:
-                result = session.run(cypher_var, {"var_name": entry["var_name"]})
-                records = list(result)  # ✅ Cache before reuse
-                rels = [record.data() for record in records]
-
-            rel_txt = "\n".join([
-                f"➪ [{r['rel_type']}] → {r['connected_name']} ({', '.join(r['labels'])})"
-                for r in rels if r['connected_name']
-            ])
-
-            block = (f"Variable '{entry['var_name']}' - {entry['description']} "
-                     f"(Category: {entry['category']}, score={dist:.2f})\n{rel_txt}")
-
-        context_blocks.append(block)
-
-    return "\n\n".join(context_blocks)
-
-def reflection_loop(llm_model, user_query, current_results, entries, index, embed_model, graph, column_context, steps=2):
-    """Perform reflection loop to refine results"""
-    from src.retrieval.node_retrieval import retrieve_nodes, merge_results
+from collections import defaultdict
+
+import config
+from src.generation.context_budget import budget_context_blocks
+
+CONTEXT_RELATIONSHIPS_QUERY = """
+UNWIND $items AS item
+MATCH (v:Variable {name: item.var_name})
+OPTIONAL MATCH (v)-[:HAS_VALUE]->(val:Value {label: item.label})
+WITH item, v, val
+WHERE item.label IS NULL OR val IS NOT NULL
+OPTIONAL MATCH (v)-[r]->(connected)
+RETURN item.idx AS idx, type(r) AS rel_type, connected.name AS connected_name, labels(connected) AS labels
+"""
 
-    for _ in range(steps):
-        context_text = format_context(current_results, graph)
-        prompt = f"""
+def _context_key(entry):
+    """(variable, value label or None) identifying the graph node behind a result entry"""
+    if entry['type'] == 'value':
+        return entry['parent_var'], entry['label']
+    return entry['var_name'], None
+
+def fetch_context_relationships(results, driver, snapshot=None):
+    """Fetch outgoing relationships for every result entry in a single UNWIND round trip.
+
+    Returns {(variable, label or None): [relationship records]}, with relationships of
+    a value entry only present when that value exists under its variable. Variables
+    present in the graph snapshot are answered in-process without querying Neo4j.
+    """
+    rels_by_key, keys = _split_context_keys(results, snapshot)
+    if not keys:
+        return rels_by_key
+
+    with driver.session() as session:
+        records = [record.data() for record in session.run(CONTEXT_RELATIONSHIPS_QUERY, {"items": _context_items(keys)})]
+    return _group_context_records(rels_by_key, keys, records)
+
+async def fetch_context_relationships_async(results, async_driver, snapshot=None):
+    """Async variant of fetch_context_relationships using the async Neo4j driver"""
+    rels_by_key, keys = _split_context_keys(results, snapshot)
+    if not keys:
+        return rels_by_key
+
+    async with async_driver.session() as session:
+        result = await session.run(CONTEXT_RELATIONSHIPS_QUERY, {"items": _context_items(keys)})
+        records = await result.data()
+    return _group_context_records(rels_by_key, keys, records)
+
+def _split_context_keys(results, snapshot):
+    """Answer snapshot-known variables in-process; return (relationships so far, keys left for Neo4j)"""
+    rels_by_key = defaultdict(list)
+    keys = []
+    for key in dict.fromkeys(_context_key(entry) for entry, _ in results):
+        if snapshot is not None and key[0] in snapshot:
+            rels_by_key[key] = snapshot.relationships(*key)
+        else:
+            keys.append(key)
+    return rels_by_key, keys
+
+def _context_items(keys):
+    return [{"idx": i, "var_name": var_name, "label": label} for i, (var_name, label) in enumerate(keys)]
+
+def _group_context_records(rels_by_key, keys, records):
+    for record in records:
+        rels_by_key[keys[record["idx"]]].append(record)
+    return rels_by_key
+
+def _render_context_block(entry, dist, rels):
+    rel_txt = "\n".join([
+        f"➪ [{r['rel_type']}] → {r['connected_name']} ({', '.join(r['labels'])})"
+        for r in rels if r['connected_name']
+    ])
+
+    if entry['type'] == 'value':
+        return (f"Value '{entry['label']}' from Variable '{entry['parent_var']}' "
+                f"(Category: {entry.get('category','?')}, score={dist:.2f})\n{rel_txt}")
+    return (f"Variable '{entry['var_name']}' - {entry['description']} "
+            f"(Category: {entry['category']}, score={dist:.2f})\n{rel_txt}")
+
+def _render_context(results, rels_by_key, user_query=None, step_text=None, token_budget=None, prompt_name="context"):
+    context_blocks = [
+        _render_context_block(entry, dist, rels_by_key.get(_context_key(entry), []))
+        for entry, dist in results
+    ]
+    # Scores are cosine similarities, except for the legacy flat_l2 index where they are distances
+    return budget_context_blocks(context_blocks, user_query, scores=[float(dist) for _, dist in results],
+                                 step_text=step_text, higher_is_better=config.FAISS_INDEX_TYPE != "flat_l2",
+                                 budget=token_budget, prompt_name=prompt_name)
+
+def format_context(results, driver, snapshot=None, user_query=None, step_text=None, token_budget=None,
+                   prompt_name="context"):
+    """Format context for presentation to LLM, trimmed to the token budget (CONTEXT_TOKEN_BUDGET).
+
+    Blocks are kept by retrieval score and relevance to the query and `step_text` (a plan step).
+    """
+    return _render_context(results, fetch_context_relationships(results, driver, snapshot=snapshot),
+                           user_query, step_text, token_budget, prompt_name)
+
+async def format_context_async(results, async_driver, snapshot=None, user_query=None, step_text=None, token_budget=None,
+                               prompt_name="context"):
+    """Async variant of format_context"""
+    return _render_context(results, await fetch_context_relationships_async(results, async_driver, snapshot=snapshot),
+                           user_query, step_text, token_budget, prompt_name)
+
+def _reflection_prompt(user_query, context_text, column_context):
+    return f"""
 A user asked: "{user_query}"
 
 Current context from the knowledge graph:
@@ -63,21 +114,53 @@ Column Context:
 Based on this context and the list of column names, which variables or values might still be missing to fully answer the question?
 List just their names, one per line. If you're unsure, list none.
         """
-        reflection = llm_model.generate_content(prompt).text.strip().splitlines()
-        new_terms = [line.strip() for line in reflection if line.strip()]
 
-        extra_results = []
-        for term in new_terms:
-            # Avoid re-retrieving if it obviously overlaps existing
-            if not any(term.lower() in e['text'].lower() for e, _ in current_results):
-                retrieved = retrieve_nodes(term, entries, index, embed_model, top_k=5)
-                extra_results = merge_results(extra_results, retrieved)
+def _missing_reflection_terms(reflection_text, current_results):
+    """Reflection terms that do not obviously overlap existing results"""
+    new_terms = [line.strip() for line in reflection_text.strip().splitlines() if line.strip()]
+    return [term for term in new_terms
+            if not any(term.lower() in e['text'].lower() for e, _ in current_results)]
+
+def _print_provenance(extra_results, provenance):
+    for e, _ in extra_results:
+        print(f"  ↳ '{e['text']}' (via: {', '.join(provenance[e['text']])})")
+
+def reflection_loop(llm_model, user_query, current_results, entries, index, embed_model, graph, column_context, steps=2, snapshot=None):
+    """Perform reflection loop to refine results"""
+    from src.retrieval.node_retrieval import retrieve_nodes_batch, merge_results
+
+    for _ in range(steps):
+        context_text = format_context(current_results, graph, snapshot=snapshot, user_query=user_query,
+                                      prompt_name="reflection")
+        reflection = llm_model.generate_content(_reflection_prompt(user_query, context_text, column_context)).text
+        missing_terms = _missing_reflection_terms(reflection, current_results)
+
+        # One embedding request and one FAISS search for all reflection terms
+        extra_results, provenance = retrieve_nodes_batch(missing_terms, entries, index, embed_model, top_k=5)
+        _print_provenance(extra_results, provenance)
 
         current_results = merge_results(current_results, extra_results)
     return current_results
 
-def generate_answer(llm_model, user_query, context, column_context, mode="default", picot=None):
-    """Generate final answer based on context"""
+async def reflection_loop_async(llm_model, user_query, current_results, entries, index, embed_model, async_graph,
+                                column_context, steps=2, snapshot=None):
+    """Async variant of reflection_loop"""
+    from src.retrieval.node_retrieval import retrieve_nodes_batch_async, merge_results
+    from src.generation.gemini_client import generate_text_async
+
+    for _ in range(steps):
+        context_text = await format_context_async(current_results, async_graph, snapshot=snapshot, user_query=user_query,
+                                                  prompt_name="reflection")
+        reflection = await generate_text_async(llm_model, _reflection_prompt(user_query, context_text, column_context))
+        missing_terms = _missing_reflection_terms(reflection, current_results)
+
+        extra_results, provenance = await retrieve_nodes_batch_async(missing_terms, entries, index, embed_model, top_k=5)
+        _print_provenance(extra_results, provenance)
+
+        current_results = merge_results(current_results, extra_results)
+    return current_results
+
+def _answer_prompt(user_query, context, column_context, mode="default", picot=None):
     picot_text = ""
     if picot:
         picot_text = f"""
@@ -114,12 +197,21 @@ Please:
 
 Provide a concise yet complete explanation.
 """
-    response = llm_model.generate_content(prompt)
+    return prompt
+
+def generate_answer(llm_model, user_query, context, column_context, mode="default", picot=None):
+    """Generate final answer based on context"""
+    response = llm_model.generate_content(_answer_prompt(user_query, context, column_context, mode, picot))
     return response.text
 
-def create_response_json(llm_model, final_response, user_query):
-    """Create a simplified JSON response"""
-    prompt = f"""
+async def generate_answer_async(llm_model, user_query, context, column_context, mode="default", picot=None):
+    """Async variant of generate_answer"""
+    from src.generation.gemini_client import generate_text_async
+
+    return await generate_text_async(llm_model, _answer_prompt(user_query, context, column_context, mode, picot))
+
+def _response_json_prompt(final_response, user_query):
+    return f"""
 You are a biomedical assistant. Based on the following user query and the final detailed response, summarize the final conclusion into a single, clear sentence.
 
 User query:
@@ -131,6 +223,19 @@ Final synthesized answer:
 Respond with only the final answer as a natural-language sentence. Do not include any extra commentary.
 """
 
-    short_answer = llm_model.generate_content(prompt).text.strip()
+def create_response_json(llm_model, final_response, user_query):
+    """Create a simplified JSON response"""
+    from src.generation.gemini_client import generate_text
+
+    short_answer = generate_text(llm_model, _response_json_prompt(final_response, user_query),
+                                 cache_stage="response_json").strip()
+
+    return {"answer": short_answer}
+
+async def create_response_json_async(llm_model, final_response, user_query):
+    """Async variant of create_response_json"""
+    from src.generation.gemini_client import generate_text_async
 
+    short_answer = (await generate_text_async(llm_model, _response_json_prompt(final_response, user_query),
+                                              cache_stage="response_json")).strip()
     return {"answer": short_answer}
@@ -0,0 +1,156 @@
+import json
+import re
+
+import config
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    """Fast local token estimate (~4 characters per token for Gemini's tokenizer on English text)"""
+    return (len(text) + 3) // 4
+
+def query_terms(*texts):
+    """Lowercased words of at least three characters, used for lexical relevance"""
+    terms = set()
+    for text in texts:
+        if text:
+            terms.update(w for w in _WORD.findall(str(text).lower()) if len(w) >= 3)
+    return terms
+
+def lexical_relevance(text, terms):
+    """Fraction of the terms that occur in the text (substring match, so 'cardiac' hits 'cardiaccomorbidity1')"""
+    if not terms:
+        return 0.0
+    lowered = text.lower()
+    return sum(1 for t in terms if t in lowered) / len(terms)
+
+def log_section(prompt_name, section, kept_tokens, total_tokens, kept_items=None, total_items=None):
+    items = f", {kept_items}/{total_items} items" if total_items is not None else ""
+    print(f"📏 {prompt_name}.{section}: {kept_tokens}/{total_tokens} tokens{items}")
+
+def fit_items(texts, priorities, budget, separator="\n"):
+    """Keep the highest-priority texts that fit the token budget, returned in their original order.
+
+    The first (highest-priority) item is always kept, so a section is never emptied.
+    """
+    separator_tokens = estimate_tokens(separator)
+    order = sorted(range(len(texts)), key=lambda i: -priorities[i])
+    kept, used = set(), 0
+    for i in order:
+        cost = estimate_tokens(texts[i]) + separator_tokens
+        if kept and used + cost > budget:
+            continue
+        kept.add(i)
+        used += cost
+    return [texts[i] for i in sorted(kept)]
+
+def _score_priorities(scores, higher_is_better=True):
+    """Retrieval scores rescaled to [0, 1] (best = 1); all 1.0 when they do not discriminate"""
+    values = [s if higher_is_better else -s for s in scores]
+    low, high = min(values, default=0.0), max(values, default=0.0)
+    if high - low < 1e-9:
+        return [1.0] * len(values)
+    return [(v - low) / (high - low) for v in values]
+
+def budget_context_blocks(blocks, user_query, scores=None, step_text=None, higher_is_better=True, budget=None,
+                          prompt_name="prompt"):
+    """Trim rendered format_context blocks (in retrieval order) to a token budget.
+
+    Blocks are ranked by their retrieval score (FAISS/cosine, one per block) plus their
+    lexical relevance to the query and, when given, the plan step being served.
+    Without scores the retrieval rank stands in for them.
+    """
+    budget = budget or config.CONTEXT_TOKEN_BUDGET
+    terms = query_terms(user_query, step_text)
+    if scores is None:
+        retrieval = [1.0 / (1 + rank) for rank in range(len(blocks))]
+    else:
+        retrieval = _score_priorities(scores, higher_is_better)
+    priorities = [r + lexical_relevance(block, terms) for r, block in zip(retrieval, blocks)]
+    kept = fit_items(blocks, priorities, budget, separator="\n\n")
+
+    text = "\n\n".join(kept)
+    log_section(prompt_name, "context", estimate_tokens(text), estimate_tokens("\n\n".join(blocks)), len(kept), len(blocks))
+    return text
+
+def budget_column_context(column_context, *relevance_texts, budget=None, prompt_name="prompt"):
+    """Trim a '- column' per line column context to the columns most relevant to the given texts"""
+    budget = budget or config.COLUMN_CONTEXT_TOKEN_BUDGET
+    lines = [line for line in column_context.splitlines() if line.strip()]
+    total = estimate_tokens(column_context)
+    if total <= budget:
+        log_section(prompt_name, "column_context", total, total, len(lines), len(lines))
+        return column_context
+
+    terms = query_terms(*relevance_texts)
+    # Column names are matched against the terms, and a term is matched against the column name
+    priorities = []
+    for line in lines:
+        name = line.lstrip("- ").strip().lower()
+        priorities.append(lexical_relevance(name, terms) + sum(1 for t in terms if name and name in t))
+    kept = fit_items(lines, priorities, budget)
+
+    text = "\n".join(kept)
+    log_section(prompt_name, "column_context", estimate_tokens(text), total, len(kept), len(lines))
+    return text
+
+def _truncate(text, max_tokens):
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars] + " …[truncated]"
+
+def _step_tokens(step_name, entry):
+    return estimate_tokens(json.dumps({step_name: entry}, indent=2))
+
+def _shrink_step(step_name, entry, max_tokens):
+    """The step with its result/code/reflection cut to fit max_tokens (result keeps the largest share)"""
+    entry = dict(entry)
+    fixed = _step_tokens(step_name, {k: v for k, v in entry.items() if k not in ("result", "code", "reflection")})
+    remaining = max(32, max_tokens - fixed - 32)
+    entry["result"] = _truncate(str(entry.get("result", "")), remaining // 2)
+    entry["code"] = _truncate(str(entry.get("code", "")), remaining // 4)
+    entry["reflection"] = _truncate(str(entry.get("reflection", "")), remaining // 4)
+    return entry
+
+def budget_react_log(react_log, user_query=None, budget=None, prompt_name="synthesis"):
+    """JSON of the ReAct log that fits the budget, keeping the steps most relevant to the query.
+
+    The last step is always kept whole. Earlier steps are ranked by the relevance of
+    their instruction, thought and result to the query (recent steps break ties) and
+    added whole while they fit; the next one is shortened into what is left, and the
+    rest are dropped. Kept steps stay in execution order.
+    """
+    budget = budget or config.REACT_LOG_TOKEN_BUDGET
+    text = json.dumps(react_log, indent=2)
+    total = estimate_tokens(text)
+    if total <= budget or not react_log:
+        log_section(prompt_name, "react_log", total, total, len(react_log), len(react_log))
+        return text
+
+    names = list(react_log)
+    last = names[-1]
+    terms = query_terms(user_query)
+
+    def priority(position):
+        entry = react_log[names[position]]
+        relevant = " ".join(str(entry.get(k, "")) for k in ("instruction", "thought", "result"))
+        return lexical_relevance(relevant, terms) + 0.1 * position / len(names)
+
+    kept = {last: react_log[last]}
+    used = _step_tokens(last, react_log[last])
+    for position in sorted(range(len(names) - 1), key=lambda p: -priority(p)):
+        name = names[position]
+        cost = _step_tokens(name, react_log[name])
+        if used + cost <= budget:
+            kept[name] = react_log[name]
+            used += cost
+        elif budget - used >= 96:
+            shrunk = _shrink_step(name, react_log[name], budget - used)
+            if used + _step_tokens(name, shrunk) <= budget:
+                kept[name] = shrunk
+                used += _step_tokens(name, shrunk)
+
+    trimmed = {name: kept[name] for name in names if name in kept}
+    text = json.dumps(trimmed, indent=2)
+    log_section(prompt_name, "react_log", estimate_tokens(text), total, len(trimmed), len(react_log))
+    return text
@@ -1,28 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 import config
 import os
 from dotenv import load_dotenv
+from src.generation.context_budget import estimate_tokens
+from src.generation.llm_cache import LLMResponseCache, CachedGenerativeModel
 
 load_dotenv()
 
 def initialize_gemini():
-    """Initialize and return the Gemini model"""
+    """Initialize and return the Gemini model, wrapped with the persistent response cache"""
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
     genai.configure(api_key=GEMINI_API_KEY)
-    return genai.GenerativeModel("gemini-2.0-flash")
+    model = genai.GenerativeModel("gemini-2.0-flash")
+    return CachedGenerativeModel(model, LLMResponseCache() if config.LLM_CACHE_ENABLED else None)
 
-def summarize_expansions_with_llm(llm_model, user_query, expansions, chunk_size=None):
-    """Summarize expansions using LLM"""
-    if chunk_size is None:
-        chunk_size = config.CHUNK_SIZE
+def _stage_kwargs(llm_model, cache_stage):
+    # Only the caching wrapper understands cache_stage; plain models get the bare call
+    return {"cache_stage": cache_stage} if cache_stage and isinstance(llm_model, CachedGenerativeModel) else {}
 
-    from src.retrieval.node_retrieval import chunk_results
+def generate_text(llm_model, prompt, cache_stage=None):
+    """Return the text of a Gemini completion; `cache_stage` names a cacheable prompt stage"""
+    return llm_model.generate_content(prompt, **_stage_kwargs(llm_model, cache_stage)).text
 
-    final_selection = []
-    for chunk in chunk_results(expansions, chunk_size=chunk_size):
-        chunk_text = "\n".join(f"- {c[0]['text']}" for c in chunk)
+async def generate_text_async(llm_model, prompt, cache_stage=None):
+    """Await a Gemini completion and return its text (worker thread for models without async support)"""
+    kwargs = _stage_kwargs(llm_model, cache_stage)
+    if hasattr(llm_model, "generate_content_async"):
+        response = await llm_model.generate_content_async(prompt, **kwargs)
+    else:
+        response = await asyncio.to_thread(llm_model.generate_content, prompt, **kwargs)
+    return response.text
+
+def _expansion_filter_prompt(user_query, chunk):
+    chunk_text = "\n".join(f"- {c[0]['text']}" for c in chunk)
 
-        prompt = f"""
+    return f"""
 A user asked: "{user_query}"
 
 We have the following potential expansions:
@@ -31,10 +45,78 @@ We have the following potential expansions:
 Please list the lines (by exact text) that you believe are relevant to the query
 (or say 'none' if none are relevant).
         """
-        reflection_response = llm_model.generate_content(prompt).text.strip().splitlines()
-        selected_lines = [line.strip("- ").strip() for line in reflection_response if line.strip()]
 
-        for c in chunk:
-            if any(c[0]['text'] in s for s in selected_lines):
-                final_selection.append(c)
+def _select_from_chunk(chunk, response_text):
+    """Keep the chunk items whose text the LLM listed, in their original order"""
+    reflection_response = response_text.strip().splitlines()
+    selected_lines = [line.strip("- ").strip() for line in reflection_response if line.strip()]
+    return [c for c in chunk if any(c[0]['text'] in s for s in selected_lines)]
+
+def budget_chunks(user_query, expansions, token_budget=None, max_items=None):
+    """Pack expansions, in order, into chunks whose filter prompt fits the token budget"""
+    token_budget = token_budget or config.EXPANSION_FILTER_TOKEN_BUDGET
+    max_items = max_items or config.EXPANSION_FILTER_MAX_ITEMS
+    base_tokens = estimate_tokens(_expansion_filter_prompt(user_query, []))
+
+    chunks, chunk, chunk_tokens = [], [], base_tokens
+    for item in expansions:
+        item_tokens = estimate_tokens(f"- {item[0]['text']}\n")
+        # A chunk always takes at least one item, even if it alone exceeds the budget
+        if chunk and (chunk_tokens + item_tokens > token_budget or len(chunk) >= max_items):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], base_tokens
+        chunk.append(item)
+        chunk_tokens += item_tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _filter_chunks(user_query, expansions, chunk_size):
+    if chunk_size is not None:
+        from src.retrieval.node_retrieval import chunk_results
+        return list(chunk_results(expansions, chunk_size=chunk_size))
+    return budget_chunks(user_query, expansions)
+
+def summarize_expansions_with_llm(llm_model, user_query, expansions, chunk_size=None, max_concurrency=None):
+    """Summarize expansions using LLM.
+
+    Chunks are sized to EXPANSION_FILTER_TOKEN_BUDGET (or fixed at `chunk_size`) and sent
+    concurrently; the model wrapper applies the process-wide rate limit. Selected items
+    keep their original order.
+    """
+    max_concurrency = max_concurrency or config.EXPANSION_FILTER_MAX_CONCURRENCY
+    chunks = _filter_chunks(user_query, expansions, chunk_size)
+    if not chunks:
+        return []
+
+    def filter_chunk(chunk):
+        return generate_text(llm_model, _expansion_filter_prompt(user_query, chunk), cache_stage="expansion_filter")
+
+    if len(chunks) == 1 or max_concurrency <= 1:
+        responses = list(map(filter_chunk, chunks))
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(chunks))) as pool:
+            responses = list(pool.map(filter_chunk, chunks))
+
+    final_selection = []
+    for chunk, response_text in zip(chunks, responses):
+        final_selection.extend(_select_from_chunk(chunk, response_text))
+    return final_selection
+
+async def summarize_expansions_with_llm_async(llm_model, user_query, expansions, chunk_size=None, max_concurrency=None):
+    """Async variant of summarize_expansions_with_llm"""
+    max_concurrency = max_concurrency or config.EXPANSION_FILTER_MAX_CONCURRENCY
+    chunks = _filter_chunks(user_query, expansions, chunk_size)
+    in_flight = asyncio.Semaphore(max_concurrency)
+
+    async def filter_chunk(chunk):
+        async with in_flight:
+            return await generate_text_async(llm_model, _expansion_filter_prompt(user_query, chunk),
+                                             cache_stage="expansion_filter")
+
+    responses = await asyncio.gather(*(filter_chunk(chunk) for chunk in chunks))
+
+    final_selection = []
+    for chunk, response_text in zip(chunks, responses):
+        final_selection.extend(_select_from_chunk(chunk, response_text))
     return final_selection
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from src.generation.rate_limiter import get_rate_limiter
+
+
+class LLMResponseCache:
+    """Persistent cache of LLM response texts: in-memory LRU in front of a sqlite store.
+
+    Entries remember the stage that produced them and when, so each stage can apply
+    its own TTL at lookup time. Hit/miss counters are kept per stage.
+    """
+
+    def __init__(self, path=None, memory_items=None, max_disk_items=None):
+        self.path = path or config.LLM_CACHE_PATH
+        self.memory_items = memory_items or config.LLM_CACHE_MEMORY_ITEMS
+        self.max_disk_items = max_disk_items or config.LLM_CACHE_MAX_DISK_ITEMS
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, generation_config, prompt):
+        config_json = json.dumps(generation_config or {}, sort_keys=True, default=str)
+        return hashlib.sha256(f"{model_name}\x00{config_json}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _count(self, stage, outcome):
+        counters = self._stats.setdefault(stage, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def get(self, key, stage, ttl):
+        """Return the cached text when it is younger than `ttl` seconds, else None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._conn.execute("SELECT text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(key, entry)
+            if entry is None or now - entry[1] > ttl:
+                self._count(stage, "misses")
+                return None
+
+            self._memory.move_to_end(key)
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._count(stage, "hits")
+            return entry[0]
+
+    def put(self, key, stage, text):
+        now = time.time()
+        with self._lock:
+            self._remember(key, (text, now))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stage, text, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, text, now, now))
+            self._evict_disk()
+            self._conn.commit()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used ASC LIMIT ?
+                )
+            """, (overflow,))
+
+    def stats(self):
+        """Return per-stage hit/miss counters with hit rates, plus totals"""
+        with self._lock:
+            stages = {stage: dict(counters) for stage, counters in self._stats.items()}
+            memory_items = len(self._memory)
+        for counters in stages.values():
+            lookups = counters["hits"] + counters["misses"]
+            counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        hits = sum(c["hits"] for c in stages.values())
+        lookups = hits + sum(c["misses"] for c in stages.values())
+        return {"stages": stages, "memory_items": memory_items, "hit_rate": hits / lookups if lookups else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedResponse:
+    """Stand-in for a Gemini response served from the cache"""
+
+    cached = True
+
+    def __init__(self, text):
+        self.text = text
+
+
+class CachedGenerativeModel:
+    """Wraps a GenerativeModel so calls tagged with a cacheable `cache_stage` are served from the cache.
+
+    Only stages listed in `stage_ttls` (config.LLM_CACHE_TTLS) with a positive TTL are
+    cached; untagged calls and streaming calls always go to the model. Every call that
+    reaches the model first takes a token from `limiter` (the process-wide Gemini rate
+    limit by default). Every other attribute is delegated to the wrapped model.
+    """
+
+    def __init__(self, model, cache=None, stage_ttls=None, limiter=None):
+        self.model = model
+        self.cache = cache
+        self.stage_ttls = config.LLM_CACHE_TTLS if stage_ttls is None else stage_ttls
+        self.limiter = limiter or get_rate_limiter()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _cache_key(self, cache_stage, prompt, kwargs):
+        """Cache key for a call, or None when the call must not be cached"""
+        if self.cache is None or not self.stage_ttls.get(cache_stage) or kwargs.get("stream"):
+            return None
+        generation_config = {"model": getattr(self.model, "_generation_config", None),
+                             "call": kwargs.get("generation_config")}
+        model_name = getattr(self.model, "model_name", type(self.model).__name__)
+        return self.cache.make_key(model_name, generation_config, prompt)
+
+    def generate_content(self, prompt, *, cache_stage=None, **kwargs):
+        key = self._cache_key(cache_stage, prompt, kwargs)
+        if key is not None:
+            text = self.cache.get(key, cache_stage, self.stage_ttls[cache_stage])
+            if text is not None:
+                return CachedResponse(text)
+
+        self.limiter.acquire()
+        response = self.model.generate_content(prompt, **kwargs)
+        if key is not None:
+            self.cache.put(key, cache_stage, response.text)
+        return response
+
+    async def generate_content_async(self, prompt, *, cache_stage=None, **kwargs):
+        key = self._cache_key(cache_stage, prompt, kwargs)
+        if key is not None:
+            text = self.cache.get(key, cache_stage, self.stage_ttls[cache_stage])
+            if text is not None:
+                return CachedResponse(text)
+
+        await self.limiter.acquire_async()
+        if hasattr(self.model, "generate_content_async"):
+            response = await self.model.generate_content_async(prompt, **kwargs)
+        else:
+            response = await asyncio.to_thread(self.model.generate_content, prompt, **kwargs)
+        if key is not None:
+            self.cache.put(key, cache_stage, response.text)
+        return response
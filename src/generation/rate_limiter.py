@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import time
+
+import config
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and asyncio tasks.
+
+    Tokens refill at `rate` per second up to `capacity`; each request takes one.
+    A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate or 1))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens=1):
+        """Take tokens now (possibly going negative) and return how long the caller must wait"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """Process-wide token bucket for Gemini requests, shared by every stage and concurrent pipeline"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket(config.GEMINI_REQUESTS_PER_SECOND, config.GEMINI_BURST)
+        return _rate_limiter
@@ -0,0 +1,135 @@
+import asyncio
+import time
+import traceback
+import uuid
+from collections import deque
+
+import config
+from src.jobs.job_store import process_owner
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when no more jobs can be accepted"""
+
+
+class JobQueue:
+    """Bounded local queue of analysis jobs drained by a fixed pool of asyncio workers.
+
+    `run_job(query)` is awaited by a worker for each job; its return value is stored
+    as the job result. Job records live in a pluggable job store, tagged with this
+    process as their owner; store calls run in the default executor so a blocking
+    backend never stalls the event loop. Queue depth, wait time and run time are
+    tracked for /status.
+    """
+
+    def __init__(self, run_job, store, max_queue=None, workers=None, metrics_window=500):
+        self.run_job = run_job
+        self.store = store
+        self.max_queue = max_queue or config.JOB_QUEUE_MAX_SIZE
+        self.workers = workers or config.JOB_WORKERS
+        self.owner = process_owner()
+
+        self._queue = None
+        self._tasks = []
+        self._running = 0
+        self._reserved = 0
+        self._counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._wait_times = deque(maxlen=metrics_window)
+        self._run_times = deque(maxlen=metrics_window)
+
+    async def start(self):
+        """Start the workers on the running event loop"""
+        interrupted = await asyncio.to_thread(self.store.fail_orphaned, "Interrupted by a server restart")
+        if interrupted:
+            print(f"⚠️ Marked {interrupted} unfinished job(s) of exited server processes as failed")
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _update(self, job_id, **fields):
+        await asyncio.to_thread(self.store.update, job_id, **fields)
+
+    async def submit(self, query):
+        """Enqueue a query and return its job id; raises QueueFullError when the queue is full"""
+        if self._queue is None:
+            raise RuntimeError("JobQueue.start() has not been called")
+        # Submissions whose record is still being written hold their slot, so the queue stays bounded
+        if self._queue.qsize() + self._reserved >= self.max_queue:
+            self._counts["rejected"] += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queue} waiting)")
+
+        job_id = uuid.uuid4().hex
+        submitted_at = time.time()
+        self._reserved += 1
+        try:
+            await asyncio.to_thread(self.store.create, job_id, query, submitted_at, self.owner)
+        finally:
+            self._reserved -= 1
+        self._queue.put_nowait((job_id, query, submitted_at))
+        self._counts["submitted"] += 1
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id, query, submitted_at = await self._queue.get()
+            started_at = time.time()
+            self._wait_times.append(started_at - submitted_at)
+            self._running += 1
+            try:
+                await self._update(job_id, status="running", started_at=started_at)
+                result = await self.run_job(query)
+                await self._update(job_id, status="completed", finished_at=time.time(), result=result)
+                self._counts["completed"] += 1
+            except asyncio.CancelledError:
+                # The loop is shutting down; write synchronously so the record is not lost
+                self.store.update(job_id, status="failed", finished_at=time.time(), error="Cancelled at shutdown")
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                await self._update(job_id, status="failed", finished_at=time.time(), error=str(e))
+                self._counts["failed"] += 1
+            finally:
+                self._running -= 1
+                self._run_times.append(time.time() - started_at)
+                self._queue.task_done()
+
+    def position(self, job_id):
+        """1-based position of a queued job, or None when it is not waiting"""
+        if self._queue is None:
+            return None
+        for i, (queued_id, _, _) in enumerate(list(self._queue._queue)):
+            if queued_id == job_id:
+                return i + 1
+        return None
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        ordered = sorted(samples)
+        return {
+            "avg": round(sum(ordered) / len(ordered), 3),
+            "p50": round(ordered[len(ordered) // 2], 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            "max": round(ordered[-1], 3),
+        }
+
+    def metrics(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "running": self._running,
+            **self._counts,
+            "wait_seconds": self._summary(self._wait_times),
+            "run_seconds": self._summary(self._run_times),
+        }
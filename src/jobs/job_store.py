@@ -0,0 +1,145 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+
+import config
+
+JOB_FIELDS = ("id", "query", "status", "submitted_at", "started_at", "finished_at", "result", "error")
+
+
+def process_owner():
+    """Owner tag stored on the jobs this process runs ("host:pid")"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _owner_gone(owner):
+    """True when the owning process is known to have exited (only decidable on this host)"""
+    if owner is None:
+        return True  # written before jobs recorded an owner
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+class MemoryJobStore:
+    """Job records kept in process memory (lost on restart)"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, query, submitted_at, owner=None):
+        with self._lock:
+            self._jobs[job_id] = {"id": job_id, "query": query, "status": "queued", "submitted_at": submitted_at,
+                                  "started_at": None, "finished_at": None, "result": None, "error": None}
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def fail_orphaned(self, error):
+        """Jobs in memory never outlive their process, so there is nothing to reap"""
+        return 0
+
+    def close(self):
+        pass
+
+
+class SqliteJobStore:
+    """Job records persisted in sqlite, so status and results survive restarts"""
+
+    def __init__(self, path=None):
+        self.path = path or config.JOB_STORE_PATH
+        self._lock = threading.Lock()
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                status TEXT NOT NULL,
+                submitted_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT,
+                owner TEXT
+            )
+        """)
+        if "owner" not in [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")  # stores created before jobs had owners
+        self._conn.commit()
+
+    def create(self, job_id, query, submitted_at, owner=None):
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (id, query, status, submitted_at, owner) VALUES (?, ?, 'queued', ?, ?)",
+                               (job_id, query, submitted_at, owner))
+            self._conn.commit()
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def fail_orphaned(self, error):
+        """Mark queued/running jobs whose owning process has exited as failed; returns how many.
+
+        The store may be shared by several server processes (uvicorn workers, rolling
+        restarts), so jobs owned by live processes or by other hosts are left alone.
+        """
+        with self._lock:
+            owners = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN ('queued', 'running')")]
+            failed = 0
+            for owner in filter(_owner_gone, owners):
+                cursor = self._conn.execute("UPDATE jobs SET status = 'failed', error = ? "
+                                            "WHERE status IN ('queued', 'running') AND owner IS ?", (error, owner))
+                failed += cursor.rowcount
+            self._conn.commit()
+            return failed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+JOB_STORES = {
+    "sqlite": SqliteJobStore,
+    "memory": MemoryJobStore,
+}
+
+def get_job_store(backend=None):
+    """Create the configured job store backend (JOB_STORE_BACKEND)"""
+    backend = backend or config.JOB_STORE_BACKEND
+    if backend not in JOB_STORES:
+        raise ValueError(f"Unknown job store backend '{backend}' (expected one of {', '.join(JOB_STORES)})")
+    return JOB_STORES[backend]()
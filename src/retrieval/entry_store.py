@@ -0,0 +1,191 @@
+import hashlib
+import os
+import pickle
+from collections.abc import Mapping
+
+import numpy as np
+import config
+from src.embeddings.entry_columns import (TYPE_CODES, TYPE_NAMES, render_text, encode_entry_columns,
+                                          read_entry_columns, decode_string, decode_strings)
+
+VALUE_FIELDS = ("text", "type", "parent_var", "category", "label")
+VARIABLE_FIELDS = ("text", "type", "var_name", "description", "category")
+
+
+def _hash64(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+def _key_string(key):
+    """Lookup key for a value ((variable, label) tuple) or a variable (name)"""
+    if isinstance(key, tuple):
+        return f"value\x00{key[0]}\x00{key[1]}"
+    return f"variable\x00{key}"
+
+
+class EntryView(Mapping):
+    """Read-only dict-like view of one entry in an EntryStore; fields are rendered on demand"""
+
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, entry_id):
+        self.store = store
+        self.id = entry_id
+
+    def __getitem__(self, key):
+        return self.store.field(self.id, key)
+
+    def __iter__(self):
+        return iter(VALUE_FIELDS if self.store.is_value(self.id) else VARIABLE_FIELDS)
+
+    def __len__(self):
+        return 5
+
+    def __repr__(self):
+        return f"EntryView({self.id}, {dict(self)!r})"
+
+
+class EntryStore:
+    """Compact struct-of-arrays store of KG entries addressed by integer id (row).
+
+    Variable, category and description names are interned, entry types are int8 codes,
+    value labels live in one utf-8 buffer and texts are rendered only when asked for.
+    The columns may be memory-mapped. Indexing returns an EntryView, so code written
+    against the list-of-dicts representation keeps working.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.types = columns["type"]
+        self.var_codes = columns["var"]
+        self.category_codes = columns["category"]
+        self.description_codes = columns["description"]
+        self._label_offsets = columns["label_offsets"]
+        self._label_bytes = columns["label_bytes"]
+
+        self.var_names = decode_strings(columns["var_names_offsets"], columns["var_names_bytes"])
+        self.categories = decode_strings(columns["categories_offsets"], columns["categories_bytes"])
+        self.descriptions = decode_strings(columns["descriptions_offsets"], columns["descriptions_bytes"])
+
+        self._key_index = None
+        self._text_index = None
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build a store from the list-of-dicts representation"""
+        return cls(encode_entry_columns(entries))
+
+    @classmethod
+    def load(cls, path, mmap=None):
+        """Open a columnar entry directory, or convert a legacy entries pickle"""
+        mmap = config.MMAP_ARTIFACTS if mmap is None else mmap
+        if os.path.isdir(path):
+            return cls(read_entry_columns(path, mmap=mmap))
+        with open(path, "rb") as f:
+            return cls.from_entries(pickle.load(f))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, entry_id):
+        entry_id = int(entry_id)
+        if entry_id < 0:
+            entry_id += len(self)
+        if not 0 <= entry_id < len(self):
+            raise IndexError(f"Entry id {entry_id} out of range")
+        return EntryView(self, entry_id)
+
+    def __iter__(self):
+        for entry_id in range(len(self)):
+            yield EntryView(self, entry_id)
+
+    def is_value(self, entry_id):
+        return self.types[entry_id] == TYPE_CODES["value"]
+
+    def type_name(self, entry_id):
+        return TYPE_NAMES[int(self.types[entry_id])]
+
+    def var_name(self, entry_id):
+        return self.var_names[self.var_codes[entry_id]]
+
+    def category(self, entry_id):
+        code = self.category_codes[entry_id]
+        return self.categories[code] if code >= 0 else None
+
+    def label(self, entry_id):
+        return decode_string(self._label_offsets, self._label_bytes, entry_id) if self.is_value(entry_id) else None
+
+    def description(self, entry_id):
+        code = self.description_codes[entry_id]
+        return self.descriptions[code] if code >= 0 else None
+
+    def text(self, entry_id):
+        return render_text(self.types[entry_id], self.var_name(entry_id), self.category(entry_id),
+                           label=self.label(entry_id), description=self.description(entry_id))
+
+    def field(self, entry_id, key):
+        """Return one dict-style field of an entry"""
+        is_value = self.is_value(entry_id)
+        if key == "text":
+            return self.text(entry_id)
+        if key == "type":
+            return self.type_name(entry_id)
+        if key == "category":
+            return self.category(entry_id)
+        if key == ("parent_var" if is_value else "var_name"):
+            return self.var_name(entry_id)
+        if is_value and key == "label":
+            return self.label(entry_id)
+        if not is_value and key == "description":
+            return self.description(entry_id)
+        raise KeyError(key)
+
+    def to_dict(self, entry_id):
+        return dict(EntryView(self, entry_id))
+
+    def _entry_key(self, entry_id):
+        if self.is_value(entry_id):
+            return _key_string((self.var_name(entry_id), self.label(entry_id)))
+        return _key_string(self.var_name(entry_id))
+
+    @staticmethod
+    def _build_hash_index(keys, count):
+        hashes = np.fromiter((_hash64(k) for k in keys), dtype=np.uint64, count=count)
+        order = np.argsort(hashes, kind="stable")
+        return hashes[order], order
+
+    def _lookup(self, index, probes, key_of_row):
+        sorted_hashes, order = index
+        rows = np.full(len(probes), -1, dtype=np.int64)
+        if not len(sorted_hashes):
+            return rows
+        probe_hashes = np.array([_hash64(p) for p in probes], dtype=np.uint64)
+        positions = np.searchsorted(sorted_hashes, probe_hashes)
+        for i, pos in enumerate(positions):
+            # Walk equal hashes (first row wins) and confirm the key to rule out collisions
+            while pos < len(sorted_hashes) and sorted_hashes[pos] == probe_hashes[i]:
+                row = int(order[pos])
+                if key_of_row(row) == probes[i]:
+                    rows[i] = row
+                    break
+                pos += 1
+        return rows
+
+    def find_rows(self, keys):
+        """Return entry ids for (variable, label) value keys or variable names, -1 when missing"""
+        if self._key_index is None:
+            self._key_index = self._build_hash_index((self._entry_key(i) for i in range(len(self))), len(self))
+        return self._lookup(self._key_index, [_key_string(k) for k in keys], self._entry_key)
+
+    def find_text_rows(self, texts):
+        """Return entry ids for exact entry texts, -1 when missing"""
+        if self._text_index is None:
+            self._text_index = self._build_hash_index((self.text(i) for i in range(len(self))), len(self))
+        return self._lookup(self._text_index, list(texts), self.text)
+
+    def ids_of_type(self, type_name):
+        """Return the ids of all 'value' or 'variable' entries"""
+        return np.flatnonzero(np.asarray(self.types) == TYPE_CODES[type_name])
+
+    def nbytes(self):
+        """Bytes held by the column arrays"""
+        return sum(array.nbytes for array in self.columns.values())
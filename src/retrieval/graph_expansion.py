@@ -1,34 +1,21 @@
-import config
-
-def expand_graph_from_variable_filtered(driver, var_name, user_query, embed_model, similarity_threshold=None):
-    """Expand graph from a variable with filtering by relevance"""
-    if similarity_threshold is None:
-        similarity_threshold = config.SIMILARITY_THRESHOLD
-
-    # Get query embedding using the API function
-    query_embedding = embed_model(user_query)
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
-    cypher = """
-    MATCH (v:Variable {name: $var_name})
-    OPTIONAL MATCH (v)-[:HAS_VALUE]->(val:Value)
-    OPTIONAL MATCH (v)-[r]->(related:Variable)
-    OPTIONAL MATCH (related)-[:HAS_VALUE]->(val2:Value)
-    RETURN DISTINCT related.name AS related_var,
-                    related.description AS related_desc,
-                    val2.label AS related_val,
-                    labels(related) AS labels
-    """
-
-    with driver.session() as session:
-        result = session.run(cypher, {"var_name": var_name})
-        records = list(result)  # ✅ Cache result to avoid stream exhaustion
-        data = [record.data() for record in records]
+import config
 
-    expansions = []
-    from src.embeddings.vector_index import compute_cosine_similarity
+EXPANSION_QUERY = """
+MATCH (v:Variable {name: $var_name})
+OPTIONAL MATCH (v)-[:HAS_VALUE]->(val:Value)
+OPTIONAL MATCH (v)-[r]->(related:Variable)
+OPTIONAL MATCH (related)-[:HAS_VALUE]->(val2:Value)
+RETURN DISTINCT related.name AS related_var,
+                related.description AS related_desc,
+                val2.label AS related_val,
+                labels(related) AS labels
+"""
 
-    # Process in batches to avoid API limits
-    batch_size = 20
+def _expansion_candidates(data):
+    """Turn related-variable rows into (texts, (variable, value) keys) to score"""
     texts = []
     row_map = []
 
@@ -39,28 +26,143 @@ def expand_graph_from_variable_filtered(driver, var_name, user_query, embed_mode
             text = f"Value: {related_val} (from {related_var} - expanded)"
             texts.append(text)
             row_map.append((related_var, related_val))
+    return texts, row_map
+
+def _filtered_expansions(texts, row_map, similarities, similarity_threshold):
+    expansions = []
+    for i, sim in enumerate(similarities):
+        if sim >= similarity_threshold:
+            related_var, related_val = row_map[i]
+            expansions.append((
+                {
+                    "text": texts[i],
+                    "type": "value",
+                    "parent_var": related_var,
+                    "label": related_val,
+                    "category": "unknown"
+                },
+                float(sim)  # cosine similarity to the query, comparable with retrieval scores
+            ))
+    return expansions
+
+def _snapshot_rows(snapshot, var_name):
+    return [{"related_var": related_var, "related_val": related_val}
+            for related_var, related_val in snapshot.related_values(var_name)]
+
+def expand_graph_from_variable_filtered(driver, var_name, user_query, embed_model, similarity_threshold=None,
+                                        entry_index=None, snapshot=None, query_embedding=None):
+    """Expand graph from a variable with filtering by relevance.
+
+    When an EntryEmbeddingIndex is given, related values already in the KG are scored
+    from the prebuilt embedding matrix and only new texts are embedded. Neighbours come
+    from the graph snapshot when it knows the variable, otherwise from Neo4j. Pass
+    `query_embedding` to share one query embedding across variables.
+    """
+    if similarity_threshold is None:
+        similarity_threshold = config.SIMILARITY_THRESHOLD
+
+    # Get query embedding using the API function
+    if query_embedding is None:
+        query_embedding = embed_model(user_query)
+
+    if snapshot is not None and var_name in snapshot:
+        data = _snapshot_rows(snapshot, var_name)
+    else:
+        with driver.session() as session:
+            result = session.run(EXPANSION_QUERY, {"var_name": var_name})
+            records = list(result)  # ✅ Cache result to avoid stream exhaustion
+            data = [record.data() for record in records]
+
+    from src.embeddings.vector_index import compute_cosine_similarities
+
+    texts, row_map = _expansion_candidates(data)
+    if not texts:
+        return []
+
+    # One vectorized similarity pass - from the stored matrix when available,
+    # otherwise over a single batched embedding call
+    if entry_index is not None:
+        similarities = entry_index.similarities(query_embedding, texts, embed_model, keys=row_map)
+    else:
+        similarities = compute_cosine_similarities(query_embedding, embed_model(texts))
+
+    return _filtered_expansions(texts, row_map, similarities, similarity_threshold)
+
+async def expand_graph_from_variable_filtered_async(async_driver, var_name, user_query, embed_model,
+                                                    similarity_threshold=None, entry_index=None, snapshot=None,
+                                                    query_embedding=None):
+    """Async variant of expand_graph_from_variable_filtered using the async Neo4j driver"""
+    from src.embeddings.vector_index import compute_cosine_similarities, aembed
+
+    if similarity_threshold is None:
+        similarity_threshold = config.SIMILARITY_THRESHOLD
 
+    if query_embedding is None:
+        query_embedding = await aembed(embed_model, user_query)
+
+    if snapshot is not None and var_name in snapshot:
+        data = _snapshot_rows(snapshot, var_name)
+    else:
+        async with async_driver.session() as session:
+            result = await session.run(EXPANSION_QUERY, {"var_name": var_name})
+            data = await result.data()
+
+    texts, row_map = _expansion_candidates(data)
     if not texts:
-        return expansions
-
-    # Get embeddings for all texts in batches
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        batch_embeddings = embed_model(batch_texts)
-
-        for j, text_embed in enumerate(batch_embeddings):
-            sim = compute_cosine_similarity(query_embedding, text_embed)
-            if sim >= similarity_threshold:
-                related_var, related_val = row_map[i+j]
-                expansions.append((
-                    {
-                        "text": texts[i+j],
-                        "type": "value",
-                        "parent_var": related_var,
-                        "label": related_val,
-                        "category": "unknown"
-                    },
-                    1.0
-                ))
+        return []
+
+    if entry_index is not None:
+        similarities = await entry_index.similarities_async(query_embedding, texts, embed_model, keys=row_map)
+    else:
+        similarities = compute_cosine_similarities(query_embedding, await aembed(embed_model, texts))
 
+    return _filtered_expansions(texts, row_map, similarities, similarity_threshold)
+
+def _merge_in_order(per_variable):
+    from src.retrieval.node_retrieval import merge_results
+
+    expansions = []
+    for expansions_for_var in per_variable:
+        expansions = merge_results(expansions, expansions_for_var)
     return expansions
+
+def expand_variables(driver, var_names, user_query, embed_model, entry_index=None, snapshot=None, max_workers=None):
+    """Expand several variables concurrently on a bounded thread pool.
+
+    The query is embedded once and shared. Results are merged in `var_names` order,
+    so the output matches expanding the variables one after another.
+    """
+    max_workers = max_workers or config.EXPANSION_MAX_WORKERS
+    if not var_names:
+        return []
+
+    query_embedding = embed_model(user_query)
+
+    def expand(var_name):
+        return expand_graph_from_variable_filtered(driver, var_name, user_query, embed_model, entry_index=entry_index,
+                                                   snapshot=snapshot, query_embedding=query_embedding)
+
+    if max_workers <= 1 or len(var_names) == 1:
+        return _merge_in_order(map(expand, var_names))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(var_names))) as pool:
+        return _merge_in_order(pool.map(expand, var_names))
+
+async def expand_variables_async(async_driver, var_names, user_query, embed_model, entry_index=None, snapshot=None,
+                                 max_workers=None):
+    """Async variant of expand_variables; at most `max_workers` expansions are in flight"""
+    from src.embeddings.vector_index import aembed
+
+    max_workers = max_workers or config.EXPANSION_MAX_WORKERS
+    if not var_names:
+        return []
+
+    query_embedding = await aembed(embed_model, user_query)
+    limit = asyncio.Semaphore(max_workers)
+
+    async def expand(var_name):
+        async with limit:
+            return await expand_graph_from_variable_filtered_async(async_driver, var_name, user_query, embed_model,
+                                                                   entry_index=entry_index, snapshot=snapshot,
+                                                                   query_embedding=query_embedding)
+
+    return _merge_in_order(await asyncio.gather(*(expand(v) for v in var_names)))
@@ -1,4 +1,6 @@
 import config
+from src.embeddings.vector_index import prepare_queries, aembed
+from src.retrieval.entry_store import EntryView
 
 def build_entries(raw_nodes):
     """Build entries from raw nodes"""
@@ -34,30 +36,92 @@ def build_entries(raw_nodes):
 
     return entries
 
+def retrieve_node_ids(user_query, index, embed_model, top_k=None):
+    """Retrieve (entry id, score) pairs for a query"""
+    if top_k is None:
+        top_k = config.TOP_K
+
+    # Get query embedding from the embedding provider
+    query_embedding = prepare_queries(index, embed_model(user_query))
+
+    # Search the FAISS index
+    distances, indices = index.search(query_embedding, top_k)
+
+    # Approximate indexes pad with -1 when fewer than top_k hits are found
+    return [(int(i), float(d)) for i, d in zip(indices[0], distances[0]) if i >= 0]
+
 def retrieve_nodes(user_query, entries, index, embed_model, top_k=None):
     """Retrieve relevant nodes based on query"""
+    return [(entries[i], dist) for i, dist in retrieve_node_ids(user_query, index, embed_model, top_k)]
+
+def retrieve_nodes_batch(queries, entries, index, embed_model, top_k=None):
+    """Retrieve nodes for several queries with one embedding call and one FAISS search.
+
+    Returns the merged (entry, score) results in query order, de-duplicated like
+    merge_results, plus a provenance map from each entry's text to the queries
+    that retrieved it.
+    """
     if top_k is None:
         top_k = config.TOP_K
+    if not queries:
+        return [], {}
 
-    # Get query embedding from API
-    query_embedding = embed_model(user_query).reshape(1, -1)
+    # Embed every query in one request and search the stacked matrix at once
+    query_matrix = prepare_queries(index, embed_model(list(queries)))
+    distances, indices = index.search(query_matrix, top_k)
+    return _merge_batch_hits(queries, entries, distances, indices)
 
-    # Search the FAISS index
+async def retrieve_nodes_async(user_query, entries, index, embed_model, top_k=None):
+    """Async variant of retrieve_nodes; the query is embedded through the async embedding client"""
+    if top_k is None:
+        top_k = config.TOP_K
+
+    query_embedding = prepare_queries(index, await aembed(embed_model, user_query))
     distances, indices = index.search(query_embedding, top_k)
+    return [(entries[i], float(d)) for i, d in zip(indices[0], distances[0]) if i >= 0]
 
+async def retrieve_nodes_batch_async(queries, entries, index, embed_model, top_k=None):
+    """Async variant of retrieve_nodes_batch"""
+    if top_k is None:
+        top_k = config.TOP_K
+    if not queries:
+        return [], {}
+
+    query_matrix = prepare_queries(index, await aembed(embed_model, list(queries)))
+    distances, indices = index.search(query_matrix, top_k)
+    return _merge_batch_hits(queries, entries, distances, indices)
+
+def _merge_batch_hits(queries, entries, distances, indices):
+    """Merge per-query FAISS hits in query order and record which queries found each entry"""
     results = []
-    for rank, i in enumerate(indices[0]):
-        results.append((entries[i], float(distances[0][rank])))
-    return results
+    provenance = {}
+    seen_ids = set()
+    for query, dist_row, idx_row in zip(queries, distances, indices):
+        for dist, i in zip(dist_row, idx_row):
+            if i < 0:
+                continue
+            entry = entries[i]
+            if i not in seen_ids:
+                seen_ids.add(i)
+                results.append((entry, float(dist)))
+            provenance.setdefault(entry['text'], []).append(query)
+    return merge_results([], results), provenance
+
+def _result_key(entry):
+    """Dedup key of a result entry: its id for EntryStore entries, otherwise its text"""
+    if isinstance(entry, EntryView):
+        return ("id", entry.id)
+    return ("text", entry['text'].lower())
 
 def merge_results(existing, new):
     """Merge two sets of results, avoiding duplicates"""
     combined = existing[:]
-    existing_texts = set(e['text'].lower() for (e, _) in existing)
+    existing_keys = set(_result_key(e) for (e, _) in existing)
     for e, d in new:
-        if e['text'].lower() not in existing_texts:
+        key = _result_key(e)
+        if key not in existing_keys:
             combined.append((e, d))
-            existing_texts.add(e['text'].lower())
+            existing_keys.add(key)
     return combined
 
 def chunk_results(results, chunk_size=None):
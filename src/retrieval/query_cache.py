@@ -0,0 +1,173 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import faiss
+import numpy as np
+import config
+
+
+def normalize_query(user_query):
+    """Lowercase and collapse whitespace so trivially different phrasings share a key"""
+    return re.sub(r"\s+", " ", user_query.strip().lower())
+
+def query_scope(mode, picot):
+    """Canonical mode/PICOT string; a cached answer is only reused within the same scope"""
+    return json.dumps({"mode": mode or "default", "picot": picot or {}}, sort_keys=True)
+
+
+class SemanticQueryCache:
+    """Whole-pipeline result cache keyed by the meaning of the question.
+
+    The normalized query plus its mode/PICOT is embedded and searched in a small
+    inner-product FAISS index over past queries. A neighbour with the same scope and a
+    cosine similarity of at least `threshold` is a hit. Entries live in sqlite together
+    with the dataset and KG versions they were computed against. Entries from other
+    versions are dropped on load and on `set_versions`.
+    """
+
+    def __init__(self, embed_model, dataset_version=None, kg_version=None, path=None, threshold=None, max_items=None):
+        self.embed_model = embed_model
+        self.path = path or config.QUERY_CACHE_PATH
+        self.threshold = config.QUERY_CACHE_SIMILARITY_THRESHOLD if threshold is None else threshold
+        self.max_items = max_items or config.QUERY_CACHE_MAX_ITEMS
+
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0}
+        self._index = None
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS queries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                result TEXT NOT NULL,
+                plan TEXT,
+                dataset_version TEXT,
+                kg_version TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.set_versions(dataset_version, kg_version)
+
+    def set_versions(self, dataset_version, kg_version):
+        """Switch to a dataset/KG version, dropping entries computed against any other"""
+        with self._lock:
+            self.dataset_version = dataset_version
+            self.kg_version = kg_version
+            self._conn.execute("DELETE FROM queries WHERE dataset_version IS NOT ? OR kg_version IS NOT ?",
+                               (dataset_version, kg_version))
+            self._conn.commit()
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        rows = self._conn.execute("SELECT id, embedding FROM queries").fetchall()
+        self._index = None
+        if rows:
+            vectors = np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+            self._add(np.array([row_id for row_id, _ in rows], dtype=np.int64), vectors)
+
+    def _add(self, ids, vectors):
+        if self._index is None:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+        self._index.add_with_ids(vectors, ids)
+
+    def _key(self, user_query, mode, picot, embedding):
+        text = normalize_query(user_query)
+        scope = query_scope(mode, picot)
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return text, scope, vector
+
+    def key_text(self, user_query, mode, picot):
+        """Text that is embedded for a query"""
+        return f"{normalize_query(user_query)}\n{query_scope(mode, picot)}"
+
+    def probe(self, user_query, mode, picot, embedding=None):
+        """Look up a query. Returns (cached result or None, key to pass to `store`).
+
+        The key records the dataset/KG versions current at lookup time, i.e. the ones
+        the pipeline run that follows is computed against.
+        """
+        if embedding is None:
+            embedding = self.embed_model(self.key_text(user_query, mode, picot))
+        text, scope, vector = self._key(user_query, mode, picot, embedding)
+
+        with self._lock:
+            key = (text, scope, vector, self.dataset_version, self.kg_version)
+            hit = None
+            if self._index is not None and self._index.ntotal:
+                sims, ids = self._index.search(vector, min(8, self._index.ntotal))
+                for sim, row_id in zip(sims[0], ids[0]):
+                    if row_id < 0 or sim < self.threshold:
+                        break
+                    row = self._conn.execute("SELECT scope, result FROM queries WHERE id = ?", (int(row_id),)).fetchone()
+                    if row is not None and row[0] == scope:
+                        hit = (json.loads(row[1]), float(sim))
+                        break
+            self._stats["hits" if hit else "misses"] += 1
+
+        if hit:
+            print(f"⚡ Semantic cache hit (similarity={hit[1]:.3f})")
+            return hit[0], key
+        return None, key
+
+    async def probe_async(self, user_query, mode, picot):
+        """Async variant of probe; the query is embedded through the async embedding client"""
+        from src.embeddings.vector_index import aembed
+
+        embedding = await aembed(self.embed_model, self.key_text(user_query, mode, picot))
+        return self.probe(user_query, mode, picot, embedding=embedding)
+
+    def store(self, key, result, plan=None):
+        """Remember a pipeline result under the key returned by `probe`.
+
+        Skipped when the versions changed since the probe: the result was computed
+        against data that `set_versions` has already invalidated.
+        """
+        text, scope, vector, dataset_version, kg_version = key
+        with self._lock:
+            if (dataset_version, kg_version) != (self.dataset_version, self.kg_version):
+                print("⚠️ Not caching a result computed against a superseded dataset/KG version")
+                return
+            cursor = self._conn.execute(
+                "INSERT INTO queries (query, scope, embedding, result, plan, dataset_version, kg_version, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (text, scope, vector.tobytes(), json.dumps(result, default=str),
+                 json.dumps(plan, default=str) if plan is not None else None,
+                 dataset_version, kg_version, time.time()))
+            self._add(np.array([cursor.lastrowid], dtype=np.int64), vector)
+            self._evict()
+            self._conn.commit()
+            self._stats["stores"] += 1
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+        overflow = count - self.max_items
+        if overflow > 0:
+            old_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM queries ORDER BY created_at ASC LIMIT ?", (overflow,))]
+            self._conn.executemany("DELETE FROM queries WHERE id = ?", [(i,) for i in old_ids])
+            self._index.remove_ids(np.array(old_ids, dtype=np.int64))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._index.ntotal if self._index is not None else 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["threshold"] = self.threshold
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()